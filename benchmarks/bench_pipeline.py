@@ -0,0 +1,94 @@
+"""
+End-to-end timing of the `data_processing` scripts on `full_dataset.zip`. The scripts run in order,
+as they would by hand, inside a scratch copy of the repository layout so no real output is touched.
+
+    python benchmarks/bench_pipeline.py --repeat 1
+"""
+import glob
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import zipfile
+
+from common import DATA_PROCESSING_DIR, DATASET_ZIP, FAST_SERVER_DIR, base_parser, summarize, write_results
+
+# Variants of the pipeline: scripts (with arguments) in order, and the folder each one writes
+PIPELINES = {
+    "scripts": [
+        (["data_processor.py"], "full_dataset_labelled"),
+        (["data_concatenation.py"], "full_dataset_combined"),
+        (["feature_engineering.py"], "ecl_distance_datasets"),
+        (["create_train_test_data.py"], "train_test_split"),
+    ],
+    "zip": [
+        (["data_processor.py", "--zip"], "full_dataset_combined"),
+        (["feature_engineering.py"], "ecl_distance_datasets"),
+        (["create_train_test_data.py"], "train_test_split"),
+    ],
+    "zip-parquet": [
+        (["data_processor.py", "--zip", "--format", "parquet"], "full_dataset_combined"),
+        (["feature_engineering.py"], "ecl_distance_datasets"),
+        (["create_train_test_data.py"], "train_test_split"),
+    ],
+}
+
+
+def folder_size(path: str) -> int:
+    return sum(os.path.getsize(file) for file in glob.glob(os.path.join(path, "*")) if os.path.isfile(file))
+
+
+def run_once(scratch: str, stages: list) -> dict:
+    """Extract the dataset and run every stage once, return the duration and output size of each step."""
+    timings = {}
+    start = time.perf_counter()
+    with zipfile.ZipFile(DATASET_ZIP) as archive:
+        archive.extractall(os.path.join(scratch, "full_dataset"))
+    shutil.copy(DATASET_ZIP, os.path.join(scratch, "full_dataset.zip"))
+    timings["extract"] = (time.perf_counter() - start, folder_size(os.path.join(scratch, "full_dataset")))
+
+    workdir = os.path.join(scratch, "data_processing")
+    for command, output in stages:
+        start = time.perf_counter()
+        subprocess.run([sys.executable] + command, cwd=workdir, check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        timings[" ".join(command)] = (time.perf_counter() - start, folder_size(os.path.join(scratch, output)))
+    return timings
+
+
+def run(pipelines: list, repeat: int) -> list:
+    results = []
+    for pipeline in pipelines:
+        runs = []
+        for _ in range(repeat):
+            scratch = tempfile.mkdtemp(prefix="seetrue-bench-")
+            try:
+                shutil.copytree(DATA_PROCESSING_DIR, os.path.join(scratch, "data_processing"),
+                                ignore=shutil.ignore_patterns("*.ipynb", "*.log", "__pycache__"))
+                # feature_engineering.py imports the gaze feature engine shared with the server
+                os.makedirs(os.path.join(scratch, "fast_server"))
+                shutil.copy(os.path.join(FAST_SERVER_DIR, "gaze_features.py"), os.path.join(scratch, "fast_server"))
+                runs.append(run_once(scratch, PIPELINES[pipeline]))
+            finally:
+                shutil.rmtree(scratch, ignore_errors=True)
+
+        for step in runs[0]:
+            durations = [timings[step][0] for timings in runs]
+            result = {"name": f"{pipeline}/{step}", "pipeline": pipeline, "step": step,
+                      "output_bytes": runs[0][step][1], **summarize(durations)}
+            results.append(result)
+            print(f"{result['name']:<55} median {result['median_s']:8.2f} s  "
+                  f"output {result['output_bytes'] / 1e6:8.1f} MB")
+        total = [sum(duration for duration, _ in timings.values()) for timings in runs]
+        results.append({"name": f"{pipeline}/total", "pipeline": pipeline, "step": "total", **summarize(total)})
+    return results
+
+
+if __name__ == "__main__":
+    parser = base_parser(__doc__)
+    parser.set_defaults(repeat=1)
+    parser.add_argument("--pipelines", nargs="+", choices=list(PIPELINES), default=list(PIPELINES))
+    args = parser.parse_args()
+    write_results("pipeline", run(args.pipelines, args.repeat), args.output)
@@ -0,0 +1,49 @@
+"""
+Microbenchmarks of the server preprocessing across payload sizes and eye event mixes:
+the per-record functions (`calculate_euclidean_distance`, `remove_na_row`, `preprocess_data`)
+and their columnar counterparts.
+
+    python benchmarks/bench_preprocessing.py --sizes 1000 10000 50000
+"""
+from common import base_parser, measure, write_results
+
+from utils import (RECORDED_EVENT_MIX, calculate_euclidean_distance, calculate_euclidean_distances,
+                   preprocess_columns, preprocess_data, remove_na_columns, remove_na_row, synthetic_payload,
+                   to_columns)
+
+EVENT_MIXES = {
+    "recorded": RECORDED_EVENT_MIX,
+    "na_heavy": {"NA": 0.9, "S": 0.05, "FB": 0.02, "FE": 0.02, "BE": 0.005, "BB": 0.005},
+    "fixation_heavy": {"NA": 0.1, "S": 0.1, "FB": 0.2, "FE": 0.58, "BE": 0.01, "BB": 0.01},
+}
+
+
+def run(sizes: list, repeat: int) -> list:
+    results = []
+    for mix_name, mix in EVENT_MIXES.items():
+        for size in sizes:
+            columns = synthetic_payload(size, event_mix=mix)
+            payload = {key: values.tolist() for key, values in columns.items()}
+            events = payload["eye_event"]
+            event_array = to_columns(payload)["eye_event"]
+            cases = {
+                "calculate_euclidean_distance": lambda: [calculate_euclidean_distance(event) for event in events],
+                "calculate_euclidean_distances": lambda: calculate_euclidean_distances(event_array),
+                "remove_na_row": lambda: remove_na_row(payload),
+                "remove_na_columns": lambda: remove_na_columns(to_columns(payload)),
+                "preprocess_data": lambda: preprocess_data(payload),
+                "preprocess_columns": lambda: preprocess_columns(payload),
+            }
+            for case, fn in cases.items():
+                result = {"name": f"{case}/{mix_name}/{size}", "case": case, "event_mix": mix_name, "size": size}
+                result.update(measure(fn, repeat=repeat, rows=size))
+                results.append(result)
+                print(f"{result['name']:<55} median {result['median_s'] * 1000:10.3f} ms")
+    return results
+
+
+if __name__ == "__main__":
+    parser = base_parser(__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000, 50000])
+    args = parser.parse_args()
+    write_results("preprocessing", run(args.sizes, args.repeat), args.output)
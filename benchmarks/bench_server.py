@@ -0,0 +1,91 @@
+"""
+In-process throughput and latency of the FastAPI `/predict` app (no network, no Docker) at several
+concurrency levels, with synthetic and `full_dataset.zip`-derived payloads in JSON and binary form.
+
+    python benchmarks/bench_server.py --model fast_server/model --concurrency 1 8 32
+
+The model directory defaults to $SEETRUE_MODEL_PATH or fast_server/model.
+"""
+import asyncio
+import json
+import os
+import time
+
+from common import FAST_SERVER_DIR, base_parser, dataset_payload, summarize, write_results
+
+
+async def run_level(client, body: bytes, headers: dict, concurrency: int, requests: int) -> list:
+    """Send `requests` requests with at most `concurrency` in flight, return their latencies."""
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            start = time.perf_counter()
+            response = await client.post("/predict", content=body, headers=headers)
+            latencies.append(time.perf_counter() - start)
+            response.raise_for_status()
+
+    await asyncio.gather(*[one() for _ in range(requests)])
+    return latencies
+
+
+async def run(payloads: dict, concurrency_levels: list, requests: int) -> list:
+    import httpx
+
+    import main
+    from payload import BINARY_CONTENT_TYPE, encode_columns
+
+    results = []
+    async with main.lifespan(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            for payload_name, payload in payloads.items():
+                rows = len(payload["timestamp"])
+                encodings = {
+                    "json": (json.dumps(payload).encode(), {"content-type": "application/json"}),
+                    "binary": (encode_columns(payload), {"content-type": BINARY_CONTENT_TYPE}),
+                }
+                for encoding, (body, headers) in encodings.items():
+                    # Warm the path once before timing
+                    await run_level(client, body, headers, 1, 2)
+                    for concurrency in concurrency_levels:
+                        start = time.perf_counter()
+                        latencies = await run_level(client, body, headers, concurrency, requests)
+                        elapsed = time.perf_counter() - start
+                        result = {
+                            "name": f"predict/{payload_name}/{encoding}/c{concurrency}",
+                            "payload": payload_name,
+                            "encoding": encoding,
+                            "concurrency": concurrency,
+                            "body_bytes": len(body),
+                            **summarize(latencies),
+                            "requests_per_s": requests / elapsed,
+                            "rows_per_s": requests * rows / elapsed,
+                        }
+                        results.append(result)
+                        print(f"{result['name']:<45} p50 {result['median_s'] * 1000:9.2f} ms  "
+                              f"p99 {result['p99_s'] * 1000:9.2f} ms  {result['requests_per_s']:8.1f} req/s")
+    return results
+
+
+if __name__ == "__main__":
+    parser = base_parser(__doc__)
+    parser.add_argument("--model", help="YDF model directory, defaults to $SEETRUE_MODEL_PATH or fast_server/model")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument("--requests", type=int, default=200, help="Requests per concurrency level")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000], help="Synthetic payload rows")
+    parser.add_argument("--dataset-rows", type=int, default=50000, help="Rows of the dataset payload, 0 skips it")
+    args = parser.parse_args()
+
+    model_path = os.path.abspath(args.model or os.environ.get("SEETRUE_MODEL_PATH", os.path.join(FAST_SERVER_DIR, "model")))
+    os.environ["SEETRUE_MODEL_PATH"] = model_path
+
+    from utils import synthetic_payload
+
+    payloads = {f"synthetic{size}": {key: values.tolist() for key, values in synthetic_payload(size).items()}
+                for size in args.sizes}
+    if args.dataset_rows:
+        payloads[f"dataset{args.dataset_rows}"] = dataset_payload(args.dataset_rows)
+    results = asyncio.run(run(payloads, args.concurrency, args.requests))
+    write_results("server", results, args.output)
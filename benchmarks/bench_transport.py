@@ -0,0 +1,119 @@
+"""
+Effect of compressed transport on `/predict`, with `full_dataset.zip`-derived payloads of several sizes: body
+size, client compression time, upload time over a link of `--uplink-mbps`, and the in-process server time of
+the request, which includes the decompression. Also compares the response serialization of large timelines
+with FastAPI's generic encoder.
+
+    python benchmarks/bench_transport.py --model fast_server/model --sizes 1000 10000 100000 --uplink-mbps 5
+
+The model directory defaults to $SEETRUE_MODEL_PATH or fast_server/model.
+"""
+import asyncio
+import json
+import os
+import time
+
+from common import FAST_SERVER_DIR, base_parser, dataset_payload, measure, summarize, write_results
+
+
+async def server_times(client, body: bytes, headers: dict, repeat: int) -> list:
+    """Latencies of `repeat` sequential requests, after one untimed request."""
+    latencies = []
+    for i in range(repeat + 1):
+        start = time.perf_counter()
+        response = await client.post("/predict", content=body, headers=headers)
+        if i:
+            latencies.append(time.perf_counter() - start)
+        response.raise_for_status()
+    return latencies
+
+
+async def run_requests(payloads: dict, repeat: int, uplink_mbps: float) -> list:
+    import httpx
+
+    import main
+    from compression import compress, request_encodings
+    from payload import BINARY_CONTENT_TYPE, encode_columns
+
+    results = []
+    async with main.lifespan(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            for payload_name, payload in payloads.items():
+                bodies = {
+                    "json": (json.dumps(payload).encode(), "application/json"),
+                    "binary": (encode_columns(payload), BINARY_CONTENT_TYPE),
+                }
+                for body_format, (raw_body, content_type) in bodies.items():
+                    for encoding in ["identity"] + request_encodings():
+                        if encoding == "identity":
+                            body, compress_s = raw_body, 0.0
+                        else:
+                            compress_s = measure(lambda: compress(raw_body, encoding), repeat)["median_s"]
+                            body = compress(raw_body, encoding)
+                        headers = {"content-type": content_type, "content-encoding": encoding,
+                                   "accept-encoding": "identity"}
+                        server = summarize(await server_times(client, body, headers, repeat))
+                        upload_s = len(body) * 8 / (uplink_mbps * 1e6)
+                        result = {
+                            "name": f"transport/{payload_name}/{body_format}/{encoding}",
+                            "payload": payload_name,
+                            "format": body_format,
+                            "encoding": encoding,
+                            "body_bytes": len(body),
+                            "ratio": len(raw_body) / len(body),
+                            "compress_s": compress_s,
+                            "upload_s": upload_s,
+                            "end_to_end_s": compress_s + upload_s + server["median_s"],
+                            **server,
+                        }
+                        results.append(result)
+                        print(f"{result['name']:<45} {len(body) / 1e6:8.2f} MB (x{result['ratio']:4.1f})  "
+                              f"compress {compress_s * 1000:8.2f} ms  upload {upload_s * 1000:9.1f} ms  "
+                              f"server {server['median_s'] * 1000:8.2f} ms")
+    return results
+
+
+def run_serialization(windows: list, repeat: int) -> list:
+    """Time the timeline responses through FastAPI's encoder and through pydantic-core."""
+    from fastapi.encoders import jsonable_encoder
+    from starlette.responses import JSONResponse
+
+    from main import TimelineOutput, Window
+
+    results = []
+    for count in windows:
+        window = Window(walking=0.3, playing=0.3, reading=0.4, process_data=100, start=0.0, end=1.0)
+        output = TimelineOutput(walking=0.3, playing=0.3, reading=0.4, process_data=100 * count,
+                                windows=[window.model_copy(update={"start": float(i), "end": i + 1.0})
+                                         for i in range(count)])
+        cases = {
+            "fastapi": lambda: JSONResponse(jsonable_encoder(output)).body,
+            "pydantic": lambda: output.model_dump_json().encode(),
+        }
+        for encoder, fn in cases.items():
+            result = {"name": f"serialization/windows{count}/{encoder}", "windows": count, "encoder": encoder,
+                      "body_bytes": len(fn()), **measure(fn, repeat)}
+            results.append(result)
+            print(f"{result['name']:<45} {result['median_s'] * 1000:9.3f} ms  {result['body_bytes'] / 1e3:9.1f} kB")
+    return results
+
+
+if __name__ == "__main__":
+    parser = base_parser(__doc__)
+    parser.add_argument("--model", help="YDF model directory, defaults to $SEETRUE_MODEL_PATH or fast_server/model")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000],
+                        help="Rows of the dataset payloads")
+    parser.add_argument("--uplink-mbps", type=float, default=5.0, help="Upload bandwidth of the simulated link")
+    parser.add_argument("--windows", type=int, nargs="+", default=[100, 10000],
+                        help="Windows of the serialized timelines")
+    args = parser.parse_args()
+
+    model_path = os.path.abspath(args.model or os.environ.get("SEETRUE_MODEL_PATH", os.path.join(FAST_SERVER_DIR, "model")))
+    os.environ["SEETRUE_MODEL_PATH"] = model_path
+
+    dataset = dataset_payload(max(args.sizes))
+    payloads = {f"dataset{size}": {key: values[:size] for key, values in dataset.items()} for size in args.sizes}
+    results = asyncio.run(run_requests(payloads, args.repeat, args.uplink_mbps))
+    results += run_serialization(args.windows, args.repeat)
+    write_results("transport", results, args.output)
@@ -0,0 +1,67 @@
+"""
+Check of the streaming path of the rolling gaze features: random streams, with NaN inputs and padded eye events,
+are added in random chunks with `RollingWindow.add` (short chunks go sample by sample through `update`) and must
+give the features of one `RollingWindow.extend` over the whole stream, up to rounding. Fails on the first mismatch.
+
+    python benchmarks/check_gaze_features.py --streams 200 --seed 0
+"""
+import argparse
+import sys
+
+import numpy as np
+
+import common  # noqa: F401, puts fast_server on sys.path
+from gaze_features import ROLLING_FEATURES, UPDATE_ROWS, RollingWindow
+
+EVENTS = ["S", " FB ", "BB", "FEx1.2y3.4d5.6", "BE", "FE"]
+
+
+def random_stream(rng: np.random.Generator, rows: int) -> dict:
+    columns = {
+        "timestamp": np.cumsum(rng.choice([0.0, 1.0, 2.5], rows)),  # repeated timestamps give zero spans
+        "gazepoint_x": rng.random(rows) * 1000,
+        "gazepoint_y": rng.random(rows) * 1000,
+        "pupil_area_right_sq_mm": rng.random(rows),
+        "pupil_area_left_sq_mm": rng.random(rows),
+        "eye_event": rng.choice(EVENTS, rows),
+    }
+    for key in ["gazepoint_x", "gazepoint_y", "pupil_area_right_sq_mm"]:
+        columns[key][rng.random(rows) < 0.05] = np.nan
+    return columns
+
+
+def chunks(rng: np.random.Generator, rows: int) -> list:
+    """Chunk bounds, mostly short enough for `update`."""
+    bounds = [0]
+    while bounds[-1] < rows:
+        size = rng.integers(1, UPDATE_ROWS + 1) if rng.random() < 0.8 else rng.integers(UPDATE_ROWS + 1, 100)
+        bounds.append(min(bounds[-1] + size, rows))
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--streams", type=int, default=200, help="Random streams to check")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    for stream in range(args.streams):
+        window = int(rng.choice([1, 2, 5, 32]))
+        columns = random_stream(rng, int(rng.integers(1, 400)))
+        expected = RollingWindow(window).extend(columns)
+        streamed = RollingWindow(window)
+        parts = [streamed.add({key: values[start:end] for key, values in columns.items()})
+                 for start, end in chunks(rng, len(columns["timestamp"]))]
+        for name in ROLLING_FEATURES:
+            got = np.concatenate([part[name] for part in parts])
+            if not np.allclose(got, expected[name], rtol=1e-9, atol=1e-9, equal_nan=True):
+                row = int(np.argmax(~np.isclose(got, expected[name], rtol=1e-9, atol=1e-9, equal_nan=True)))
+                print(f"Stream {stream} (window {window}): {name} of row {row} is {got[row]}, "
+                      f"extend gives {expected[name][row]}")
+                sys.exit(1)
+    print(f"{args.streams} streams added in chunks match extend")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Fuzz check of the streaming JSON reader of `/predict`: random bodies, valid or corrupted, are fed to
+`JsonColumnReader` in random chunks and must give the same columns, or be rejected, as `json.loads` and
+`DataBatches` on the whole body, where the last occurrence of a repeated key wins. Fails on the first mismatch
+and prints the body and its chunks.
+
+    python benchmarks/check_ingest.py --bodies 2000 --seed 0
+"""
+import argparse
+import json
+import random
+import sys
+from typing import List
+
+import numpy as np
+from pydantic import ValidationError, create_model
+
+import common  # noqa: F401, puts fast_server on sys.path
+from ingest import InvalidPayload, JsonColumnReader, RowBudget
+from utils import NUMERIC_COLUMNS
+
+# Same schema as `main.DataBatches`, without loading a model
+DataBatches = create_model("DataBatches", **{key: (List[float], []) for key in NUMERIC_COLUMNS},
+                           eye_event=(List[str], []))
+
+# Values of unknown keys, split anywhere they must still be skipped
+# Earlier occurrences of the columns, the last occurrence of a key wins even when they are invalid
+EARLIER_VALUES = [None, 5, "x", ["x"], [[1]], [1, [2, "],"]], {"a": 1}, [1, 2, 3, 4, 5, 6], ["S", 1]]
+EXTRA_VALUES = [2.5, -1e-3, 12345, 0, float("nan"), float("-inf"), True, None, "x", "a\"b,}", "héllo ☃", [], [1, [2, "]"]], {"a": {"b": "}"}}]
+NUMBERS = [0, 1, -2, 2.5, 1e300, -3.25e-5, 123456789]
+EVENTS = ["NA", " FEx1.2y3.4d5.6 ", "S\"\\", "é"]
+
+
+def random_body(rng: random.Random) -> bytes:
+    rows = rng.randint(0, 5)
+    items = [(key, [rng.choice(NUMBERS) for _ in range(rows)]) for key in NUMERIC_COLUMNS]
+    items.append(("eye_event", [rng.choice(EVENTS) for _ in range(rows)]))
+    items = [item for item in items if rng.random() < 0.9]
+    for _ in range(rng.randint(0, 3)):
+        items.insert(rng.randint(0, len(items)), (rng.choice(["meta", "id", "timestamp_"]), rng.choice(EXTRA_VALUES)))
+    for _ in range(rng.choice([0, 0, 1, 2])):
+        key, _ = rng.choice(items) if items and rng.random() < 0.8 else (rng.choice(NUMERIC_COLUMNS), None)
+        position = next((index for index, (other, _) in enumerate(items) if other == key), len(items))
+        items.insert(rng.randint(0, position), (key, rng.choice(EARLIER_VALUES)))
+    separator = rng.choice([(",", ":"), (", ", ": "), (" ,\n", " :\t")])
+    body = "{" + separator[0].join(f"{json.dumps(key)}{separator[1]}{json.dumps(value, ensure_ascii=rng.random() < 0.5)}"
+                                   for key, value in items) + "}"
+    body = body.encode()
+    if rng.random() < 0.3:  # corrupt it
+        position = rng.randint(0, len(body))
+        body = body[:position] + rng.choice([b"", b",", b"]", b"}", b'"', b"x", b"1"]) + body[position + 1:]
+    return body
+
+
+def reference(body: bytes):
+    """Columns validated from the whole body, None when it is rejected."""
+    try:
+        batch = DataBatches.model_validate(json.loads(body))
+    except (ValueError, ValidationError):
+        return None
+    columns = {key: np.asarray(values, dtype=str if key == "eye_event" else float) for key, values in batch}
+    if len({len(values) for values in columns.values()}) > 1:
+        return None
+    return columns
+
+
+def streamed(body: bytes, chunks: list):
+    """Columns read by `JsonColumnReader` from the chunks, None when it rejects them."""
+    reader = JsonColumnReader(RowBudget(0), 0, len(body))
+    try:
+        for chunk in chunks:
+            reader.feed(chunk)
+        return reader.close()
+    except InvalidPayload:
+        return None
+    finally:
+        reader.release()
+
+
+def split(body: bytes, rng: random.Random) -> list:
+    cuts = sorted(rng.sample(range(1, len(body)), min(rng.randint(0, 6), max(len(body) - 1, 0))))
+    return [body[start:end] for start, end in zip([0] + cuts, cuts + [len(body)])]
+
+
+def same(expected, got) -> bool:
+    if expected is None or got is None:
+        return expected is got
+    return expected.keys() == got.keys() and all(
+        np.array_equal(expected[key], got[key], equal_nan=key != "eye_event") for key in expected)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--bodies", type=int, default=2000, help="Random bodies to check")
+    parser.add_argument("--splits", type=int, default=5, help="Random chunkings of each body")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    bodies = [b'{"meta": 2.', b'5, "timestamp": [1]}']  # a number of an unknown key cut in two
+    cases = [(b"".join(bodies), bodies)]
+    bodies = [b'{"gazepoint_y": null, "timestamp": [1], "gazep', b'oint_y": [2]}']  # an invalid earlier occurrence
+    cases.append((b"".join(bodies), bodies))
+    for _ in range(args.bodies):
+        body = random_body(rng)
+        cases += [(body, split(body, rng)) for _ in range(args.splits)]
+    for body, chunks in cases:
+        if not same(reference(body), streamed(body, chunks)):
+            print(f"Mismatch for {body!r} in chunks {chunks!r}")
+            sys.exit(1)
+    print(f"{len(cases)} chunked bodies read like DataBatches")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+import argparse
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import zipfile
+from datetime import datetime
+
+"""
+Shared helpers for the benchmark scripts: timing, dataset payloads and machine-readable results.
+"""
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FAST_SERVER_DIR = os.path.join(REPO_ROOT, "fast_server")
+DATA_PROCESSING_DIR = os.path.join(REPO_ROOT, "data_processing")
+DATASET_ZIP = os.path.join(REPO_ROOT, "full_dataset.zip")
+RESULTS_DIR = os.path.join(REPO_ROOT, "benchmarks", "results")
+
+# The benchmarks import the server modules directly
+sys.path.insert(0, FAST_SERVER_DIR)
+
+# Raw CSV header -> payload column
+RAW_COLUMNS = {
+    " Timestamp ": "timestamp",
+    " Gazepoint X ": "gazepoint_x",
+    " Gazepoint Y ": "gazepoint_y",
+    " Pupil area (right) sq mm ": "pupil_area_right_sq_mm",
+    " Pupil area (left) sq mm ": "pupil_area_left_sq_mm",
+    " Eye event ": "eye_event",
+}
+
+
+def base_parser(description: str) -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("--output", help="Result file, defaults to benchmarks/results/<name>-<time>.json")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed repetitions per case")
+    return parser
+
+
+def summarize(durations: list, rows: int = 0) -> dict:
+    """Latency statistics of a list of durations in seconds, plus throughput when `rows` is given."""
+    durations = sorted(durations)
+    median = statistics.median(durations)
+    summary = {
+        "repeat": len(durations),
+        "min_s": durations[0],
+        "median_s": median,
+        "mean_s": statistics.fmean(durations),
+        "p95_s": durations[min(len(durations) - 1, int(0.95 * len(durations)))],
+        "p99_s": durations[min(len(durations) - 1, int(0.99 * len(durations)))],
+    }
+    if rows:
+        summary["rows"] = rows
+        summary["rows_per_s"] = rows / median if median > 0 else None
+    return summary
+
+
+def measure(fn, repeat: int = 5, warmup: int = 1, rows: int = 0) -> dict:
+    """Time `fn()` `repeat` times after `warmup` untimed calls."""
+    for _ in range(warmup):
+        fn()
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        durations.append(time.perf_counter() - start)
+    return summarize(durations, rows)
+
+
+def dataset_payload(max_rows: int = 0, zip_path: str = DATASET_ZIP) -> dict:
+    """
+    Build a `/predict` payload from the recordings of `full_dataset.zip`.
+    Args:
+        max_rows (int): Stop after this many samples, 0 reads every recording.
+        zip_path (str): Dataset archive.
+    Returns:
+        dict: Payload columns as Python lists, like `csv_2_json_payload.py` produces.
+    """
+    import pandas as pd
+
+    frames = []
+    rows = 0
+    with zipfile.ZipFile(zip_path) as archive:
+        for name in sorted(archive.namelist()):
+            if not name.endswith(".csv") or name == "config_data.csv":
+                continue
+            frame = pd.read_csv(io.BytesIO(archive.read(name))).rename(columns=RAW_COLUMNS)
+            frames.append(frame)
+            rows += len(frame)
+            if max_rows and rows >= max_rows:
+                break
+    data = pd.concat(frames, ignore_index=True)
+    if max_rows:
+        data = data.iloc[:max_rows]
+    payload = {column: data[column].astype(float).tolist() for column in list(RAW_COLUMNS.values())[:5]}
+    payload["eye_event"] = data["eye_event"].str.strip().tolist()
+    return payload
+
+
+def write_results(name: str, results: list, output: str = None) -> str:
+    """
+    Write the results with enough context to compare runs (see compare.py).
+    Args:
+        name (str): Benchmark name.
+        results (list): One dict per case, each with a unique 'name'.
+        output (str): Result file, defaults to benchmarks/results/<name>-<time>.json.
+    Returns:
+        str: The path of the result file.
+    """
+    created = datetime.now()
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f"{name}-{created:%Y%m%d-%H%M%S}.json")
+    document = {
+        "benchmark": name,
+        "created": created.isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "results": results,
+    }
+    with open(output, "w") as file:
+        json.dump(document, file, indent=2)
+    print(f"Saved {len(results)} results to {output}")
+    return output
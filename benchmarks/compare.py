@@ -0,0 +1,45 @@
+"""
+Compare two benchmark result files and report the cases that got slower.
+
+    python benchmarks/compare.py baseline.json candidate.json --threshold 0.1
+
+Exits with status 1 when a case's metric grew by more than the threshold.
+"""
+import argparse
+import json
+import sys
+
+
+def load(path: str) -> dict:
+    with open(path) as file:
+        return {result["name"]: result for result in json.load(file)["results"]}
+
+
+def compare(baseline: dict, candidate: dict, metric: str, threshold: float) -> list:
+    """
+    Return (name, baseline, candidate, ratio, regression) for every case present in both runs, where
+    `regression` tells whether the metric grew by more than `threshold`.
+    """
+    rows = []
+    for name, result in candidate.items():
+        if name in baseline and baseline[name].get(metric) and result.get(metric) is not None:
+            ratio = result[metric] / baseline[name][metric]
+            rows.append((name, baseline[name][metric], result[metric], ratio, ratio > 1 + threshold))
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--metric", default="median_s", help="Lower-is-better metric to compare")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Allowed relative slowdown")
+    args = parser.parse_args()
+
+    rows = compare(load(args.baseline), load(args.candidate), args.metric, args.threshold)
+    for name, before, after, ratio, regression in rows:
+        flag = "  REGRESSION" if regression else ""
+        print(f"{name:<60} {before:12.6f} -> {after:12.6f}  x{ratio:6.2f}{flag}")
+    regressions = sum(regression for *_, regression in rows)
+    print(f"{regressions} regressions above {args.threshold:.0%}")
+    sys.exit(1 if regressions else 0)
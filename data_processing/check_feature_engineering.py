@@ -0,0 +1,173 @@
+"""
+Regression check for the vectorized feature engineering: runs the original row-by-row implementation
+(`iterrows`, kept below as the reference) and `feature_engineering.py` on the same combined activity
+files, and fails unless the results and the written CSV/Parquet files are exactly the same.
+
+    python check_feature_engineering.py [--input ../full_dataset_combined] [--format csv parquet] [--chunksize 5000]
+"""
+import argparse
+import re
+import sys
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from data_io import FORMATS, find_table, read_table, write_table
+from data_path import COMBINED_FILE_PATH
+from feature_engineering import (DEFAULT_WINDOW, logger, remove_na_row, euclidean_distance_cal, add_rolling_features,
+                                 process_file_in_chunks, replace_nan_euclidean_distance)
+
+
+# Regular expression to match and extract x, y, and d coordinates
+legacy_pattern = r' FEx(?P<x>[-+]?\d*\.\d+)y(?P<y>[-+]?\d*\.\d+)d(?P<d>[-+]?\d*\.\d+) '
+
+def legacy_euclidean_distance_cal(dataframe_data, file_name):
+    try:
+        # Process each row to calculate Euclidean Distance where pattern matches
+        distances = []
+        for i, row in dataframe_data.iterrows():
+            eye_event = row[' Eye event ']
+            match = re.match(legacy_pattern, eye_event)
+
+            if match:
+                # Extract x, y, and d as floats
+                x = float(match.group('x'))
+                y = float(match.group('y'))
+                d = float(match.group('d'))
+
+                # Calculate the Euclidean Distance
+                F = np.sqrt(x ** 2 + y ** 2) * d
+                F = round(F, 4)  # Round to 4 decimal places
+                distances.append(F)
+
+                # Update ' Eye event ' to ' FE '
+                dataframe_data.at[i, ' Eye event '] = " FE "
+
+            else:
+                # No change for rows without matching pattern
+                # We will handle this value later
+                distances.append(np.nan)
+        # Add new column 'Euclidean Distance' before 'Result' column
+        dataframe_data.insert(dataframe_data.columns.get_loc('Result'), 'Euclidean Distance', distances)
+
+        logger.info(f"Calculated Euclidean Distances for {file_name} .")
+
+        return dataframe_data
+    except Exception as e:
+        logger.error(f"Error processing file {file_name} : {e}")
+        raise
+
+
+def legacy_replace_nan_euclidean_distance(dataframe_data, file_name):
+    """
+    Now Euclidean Distance is calculated, we still have to handle the NaN values in this rows. For this, we set a rule:
+        * If the eye event is `'S`, `BB`, `BE`
+        * If the eye event is `FB`, we can save it as the previous Euclidean Distance we calculated,
+            if none has been calculated, we set it as `1.0`
+    """
+    try:
+        # Ensure 'Euclidean Distance' column exists
+        if 'Euclidean Distance' not in dataframe_data.columns:
+            return dataframe_data  # If the column doesn't exist, return the DataFrame as is
+
+        previous_value = None  # Start with no previous value
+
+        for i, row in dataframe_data.iterrows():
+            eye_event = row[' Eye event '].strip()  # Stripping any whitespace
+
+            if pd.isna(row['Euclidean Distance']):
+                if eye_event in ['S', 'BB', 'BE']:
+                    # Set NaN to 0.0 for 'S', 'BB', or 'BE'
+                    dataframe_data.at[i, 'Euclidean Distance'] = 0.0
+                elif eye_event == 'FB':
+                    # Set NaN to the previous non-NaN value or 1.0 if not found
+                    if previous_value is not None:
+                        dataframe_data.at[i, 'Euclidean Distance'] = previous_value
+                    else:
+                        dataframe_data.at[i, 'Euclidean Distance'] = 1.0
+            else:
+                # Update previous_value only for non-NaN entries
+                previous_value = row['Euclidean Distance']
+
+        logger.info(f"Replaced all NaN values in Euclidean Distances for {file_name} .")
+
+        return dataframe_data
+    except Exception as e:
+        logger.error(f"Error processing file {file_name} : {e}")
+        raise
+
+
+def reference_features(df, file_name):
+    """Feature engineering with the original row-by-row implementation."""
+    df = remove_na_row(df, file_name)
+    df = legacy_euclidean_distance_cal(df, file_name)
+    return legacy_replace_nan_euclidean_distance(df, file_name)
+
+
+def vectorized_features(df, file_name):
+    """Feature engineering with the current implementation, as `process_files` runs it."""
+    df = remove_na_row(df, file_name)
+    df = euclidean_distance_cal(df, file_name)
+    return replace_nan_euclidean_distance(df, file_name)
+
+
+def check_activity(input_directory, activity, file_formats, chunksize=None):
+    """Return a list of mismatches between the reference and the vectorized output of one activity."""
+    source_path = find_table(input_directory, activity)
+    source = read_table(source_path)
+    source[' Eye event '] = source[' Eye event '].astype(object)
+    expected = reference_features(source.copy(), activity)
+    actual = vectorized_features(source.copy(), activity)
+
+    mismatches = []
+    if list(expected.columns) != list(actual.columns):
+        mismatches.append(f"{activity}: columns {list(actual.columns)} != {list(expected.columns)}")
+    elif not expected.reset_index(drop=True).equals(actual.reset_index(drop=True)):
+        differing = [column for column in expected.columns
+                     if not expected[column].reset_index(drop=True).equals(actual[column].reset_index(drop=True))]
+        mismatches.append(f"{activity}: values differ in {differing}")
+
+    # The written files must be byte for byte the same
+    with tempfile.TemporaryDirectory() as folder:
+        for file_format in file_formats:
+            expected_path = write_table(expected, folder, f"expected_{activity}", file_format)
+            actual_path = write_table(actual, folder, f"actual_{activity}", file_format)
+            with open(expected_path, 'rb') as expected_file, open(actual_path, 'rb') as actual_file:
+                if expected_file.read() != actual_file.read():
+                    mismatches.append(f"{activity}: {file_format} output differs")
+
+        # Chunked processing must write the same CSV as processing the whole file
+        if chunksize:
+            chunked_path, _ = process_file_in_chunks(source_path, folder, f"chunked_{activity}.csv", 'csv', chunksize)
+            with open(write_table(expected, folder, f"expected_{activity}", 'csv'), 'rb') as expected_file, \
+                    open(chunked_path, 'rb') as chunked_file:
+                if expected_file.read() != chunked_file.read():
+                    mismatches.append(f"{activity}: chunked output (chunksize {chunksize}) differs")
+
+            # The rolling windows must continue across chunks too
+            rolling, _ = add_rolling_features(expected.copy(), activity, DEFAULT_WINDOW)
+            chunked_path, _ = process_file_in_chunks(source_path, folder, f"chunked_rolling_{activity}.csv", 'csv',
+                                                     chunksize, DEFAULT_WINDOW)
+            with open(write_table(rolling, folder, f"rolling_{activity}", 'csv'), 'rb') as expected_file, \
+                    open(chunked_path, 'rb') as chunked_file:
+                if expected_file.read() != chunked_file.read():
+                    mismatches.append(f"{activity}: chunked rolling features (chunksize {chunksize}) differ")
+    logger.info(f"Checked {activity}: {len(actual)} rows, {len(mismatches)} mismatches")
+    return mismatches
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Check the vectorized feature engineering against the original.")
+    parser.add_argument('--input', default=COMBINED_FILE_PATH, help="Folder with the combined activity files")
+    parser.add_argument('--format', nargs='+', choices=list(FORMATS), default=['csv'], dest='formats')
+    parser.add_argument('--chunksize', type=int, default=None, help="Also check chunked processing with this chunk size")
+    args = parser.parse_args()
+
+    mismatches = []
+    for activity in ['walking', 'reading', 'playing']:
+        mismatches += check_activity(args.input, activity, args.formats, args.chunksize)
+    for mismatch in mismatches:
+        logger.error(mismatch)
+    logger.info("Feature engineering matches the reference" if not mismatches else "Feature engineering CHANGED")
+    sys.exit(1 if mismatches else 0)
@@ -1,8 +1,21 @@
+"""
+Split the feature files into train and test sets, stratified by activity: each activity file is one class, so
+each one is split on its own with index arrays, 80/20 with a fixed seed. Files are loaded one at a time with
+the simplified headers and appended to the outputs, so only one activity is in memory at once and each output
+is written once.
+`--group-by-recording` keeps the rows of each recording on the same side of the split, so the test set only
+holds recordings the model has not seen.
+
+    python create_train_test_data.py [--format csv|parquet|feather] [--group-by-recording]
+"""
+import argparse
 import os
-import pandas as pd
+import numpy as np
 import logging
 import sys
 from sklearn.model_selection import train_test_split
+from data_io import (FORMATS, RECORDING_COLUMN, SIMPLIFIED_HEADERS, TableWriter, features_path, find_table,
+                     read_rolling_window, read_table, write_features)
 from data_path import FEATURE_FILE_PATH, DATA_SPLIT_PATH
 
 # Set up logging to both file and console
@@ -19,11 +32,6 @@ console_handler = logging.StreamHandler(sys.stdout)
 console_handler.setFormatter(logging.Formatter('%(asctime)s - %(message)s'))
 logger.addHandler(console_handler)
 
-# Directory containing the combined files
-input_folder = FEATURE_FILE_PATH
-output_folder = DATA_SPLIT_PATH
-os.makedirs(output_folder, exist_ok=True)
-
 # Load each activity file with Result column as Y indicator
 activity_files = {
     'walking': 1,
@@ -31,72 +39,87 @@ activity_files = {
     'playing': 3
 }
 
-# List to store all data for concatenation
-all_data = []
 
-# Load each file and append to all_data
-for activity, label in activity_files.items():
-    file_path = os.path.join(input_folder, f"{activity}.csv")
-    if os.path.exists(file_path):
-        try:
-            data = pd.read_csv(file_path)
+def split_indices(data, test_size=0.2, random_state=42, group_by_recording=False):
+    """
+    Train and test row positions of one class.
+    Returns:
+        tuple: The train and test positions, as integer arrays.
+    """
+    if not group_by_recording:
+        # Same shuffle as splitting the rows themselves with `train_test_split`
+        return train_test_split(np.arange(len(data)), test_size=test_size, random_state=random_state)
+
+    if RECORDING_COLUMN not in data.columns:
+        raise ValueError(f"No '{RECORDING_COLUMN}' column, rerun the combination stage to add the recording ids")
+    recordings = data[RECORDING_COLUMN].to_numpy()
+    train_recordings, test_recordings = train_test_split(np.unique(recordings), test_size=test_size,
+                                                         random_state=random_state)
+    test = np.isin(recordings, test_recordings)
+    return np.flatnonzero(~test), np.flatnonzero(test)
+
+
+def split_data(input_folder, output_folder, file_format='csv', group_by_recording=False):
+    """
+    Split the feature files into stratified train and test files with simplified headers. The rolling window
+    of the feature files is recorded next to both, for `train_model.py`.
+    Returns:
+        list: The paths of the written train and test files and of their window records.
+    """
+    os.makedirs(output_folder, exist_ok=True)
+    writers = {name: TableWriter(output_folder, name, file_format) for name in ('train', 'test')}
+    windows = set()  # None for feature files written before windows were recorded
+
+    try:
+        for activity, label in activity_files.items():
+            if not any(os.path.exists(os.path.join(input_folder, activity + extension))
+                       for extension in FORMATS.values()):
+                continue
+            file_path = find_table(input_folder, activity)
+            windows.add(read_rolling_window(file_path))
+            if len(windows - {None}) > 1:
+                raise ValueError(f"The feature files have rolling features over different windows "
+                                 f"{sorted(windows - {None})}, process them again with one window")
+            try:
+                data = read_table(file_path)
+            except Exception as e:
+                logger.error(f"Error loading file {file_path}: {e}")
+                sys.stdout.flush()
+                continue
             data['Result'] = label  # Set the Result column for classification target
-            all_data.append(data)
-            logger.info(f"Loaded data for {activity} with label {label}")
-        except Exception as e:
-            logger.error(f"Error loading file {file_path}: {e}")
-            sys.stdout.flush()
-
-# Concatenate all data into a single DataFrame
-combined_data = pd.concat(all_data, ignore_index=True)
-logger.info("Combined all data for walking, reading, and playing")
-
-# Split each class separately to ensure balanced classes in train and test sets
-train_data = []
-test_data = []
-
-for label in activity_files.values():
-    class_data = combined_data[combined_data['Result'] == label]
-    train, test = train_test_split(class_data, test_size=0.2, random_state=42)
-    train_data.append(train)
-    test_data.append(test)
-    logger.info(f"Split data for label {label} into training and testing")
-
-# Concatenate all classes to form the final train and test datasets
-train_data = pd.concat(train_data, ignore_index=True)
-test_data = pd.concat(test_data, ignore_index=True)
-
-# Save train and test datasets
-train_data.to_csv(os.path.join(output_folder, 'train.csv'), index=False)
-test_data.to_csv(os.path.join(output_folder, 'test.csv'), index=False)
-
-logger.info("Saved train and test datasets to 'dataset_split' folder")
-sys.stdout.flush()
 
-files = ['train.csv', 'test.csv']
-
-# Define the mapping for simplifying headers
-simplified_headers = {
-    ' Timestamp ': 'timestamp',
-    ' Gazepoint X ': 'gazepoint_x',
-    ' Gazepoint Y ': 'gazepoint_y',
-    ' Pupil area (right) sq mm ': 'pupil_area_right_sq_mm',
-    ' Pupil area (left) sq mm ': 'pupil_area_left_sq_mm',
-    ' Eye event ': 'eye_event',
-    'Euclidean Distance': 'euclidean_distance',
-    'Result': 'result'
-}
-
-# Process each file
-for file in files:
-    file_path = os.path.join(DATA_SPLIT_PATH, file)
-
-    # Load the data
-    data = pd.read_csv(file_path)
-
-    # Rename columns
-    data = data.rename(columns=simplified_headers)
-
-    # Save the modified data back to the file
-    data.to_csv(file_path, index=False)
-    logger.info(f"Updated headers and saved {file}")
\ No newline at end of file
+            # Split by position and only copy the selected rows, straight into the outputs
+            train, test = split_indices(data, group_by_recording=group_by_recording)
+            data = data.drop(columns=[RECORDING_COLUMN], errors='ignore')
+            data.columns = [SIMPLIFIED_HEADERS.get(column, column) for column in data.columns]
+            writers['train'].write(data.take(train))
+            writers['test'].write(data.take(test))
+            logger.info(f"Split data for {activity} with label {label} into {len(train)} training "
+                        f"and {len(test)} testing rows")
+            sys.stdout.flush()
+    except Exception:
+        for writer in writers.values():
+            writer.abort()
+        raise
+
+    output_file_paths = [writer.close() for writer in writers.values()]
+    window = None if None in windows else max(windows, default=0)
+    for file_path in list(output_file_paths):
+        if window is not None:
+            output_file_paths.append(write_features(file_path, window))
+        elif os.path.exists(features_path(file_path)):  # unknown window, drop the record of a previous split
+            os.remove(features_path(file_path))
+    logger.info(f"Saved train and test datasets to {output_folder}")
+    sys.stdout.flush()
+    return output_file_paths
+
+
+# Execute when run
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Split the feature files into train and test sets.")
+    parser.add_argument('--format', choices=list(FORMATS), default='csv',
+                        help="Output format, parquet and feather use compact dtypes (require pyarrow)")
+    parser.add_argument('--group-by-recording', action='store_true',
+                        help="Keep the rows of each recording in the same set")
+    args = parser.parse_args()
+    split_data(FEATURE_FILE_PATH, DATA_SPLIT_PATH, args.format, args.group_by_recording)
@@ -1,14 +1,16 @@
 """
 Combine Data for Each Activity: Each activity (walking, reading, and playing)
-has a separate DataFrame to accumulate rows from all corresponding files.
+collects the DataFrames of all corresponding files and concatenates them once.
 Avoid Duplicate Headers: By concatenating DataFrames without resetting headers,
 we ensure only one header row appears in each output file.
 Logging: Logs each file addition and the final save action to track progress.
 """
+import argparse
 import os
 import pandas as pd
 import logging
 import sys
+from data_io import FORMATS, add_recording_id, write_table
 from data_path import LABELLED_DATA_PATH, COMBINED_FILE_PATH
 # Set up logging to both file and console
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
@@ -24,50 +26,61 @@ console_handler = logging.StreamHandler(sys.stdout)
 console_handler.setFormatter(logging.Formatter('%(asctime)s - %(message)s'))
 logger.addHandler(console_handler)
 
-# Directories for input and output
-input_folder = LABELLED_DATA_PATH
-output_folder = COMBINED_FILE_PATH
-
-# Ensure the output folder exists
-os.makedirs(output_folder, exist_ok=True)
-
-# DataFrames to store combined data for each activity
-combined_data = {
-    'walking': pd.DataFrame(),
-    'reading': pd.DataFrame(),
-    'playing': pd.DataFrame()
-}
-
-# Iterate over files in the input folder
-for filename in os.listdir(input_folder):
-    if filename.endswith('.csv'):
-        try:
-            # Identify the activity types from filenames
-            _, activity = filename.split('_')
-            activity = activity.replace('.csv', '')
-
-            # Check if the activity is one of the expected types
-            if activity in combined_data:
-                file_path = os.path.join(input_folder, filename)
-                data = pd.read_csv(file_path)
-
-                # Concatenate daa while avoiding duplicate headers
-                combined_data[activity] = pd.concat([combined_data[activity], data], ignore_index=True)
-
-                logger.info(f'Added data from {filename} to {activity}.csv')
-            else:
-                logger.warning(f'Skipped file {filename} - Unexpected activity type')
-
-        except Exception as e:
-            logger.error(f'Error processing file {filename}: {e}')
-            sys.stdout.flush()
-
-# Save the combined data to separate CSV files
-for activity, df in combined_data.items():
-    output_file_path = os.path.join(output_folder, f'{activity}.csv')
-    df.to_csv(output_file_path, index=False)
-    logger.info(f'Saved combined data to {output_file_path}')
+
+def save_combined_data(frames, output_folder, file_format='csv'):
+    """Concatenate the collected frames of each activity once and save them."""
+    for activity, activity_frames in frames.items():
+        df = pd.concat(activity_frames, ignore_index=True) if activity_frames else pd.DataFrame()
+        output_file_path = write_table(df, output_folder, activity, file_format)
+        logger.info(f'Saved combined data to {output_file_path}')
+        sys.stdout.flush()
+
+
+def combine_files(input_folder, output_folder, file_format='csv'):
+    # Ensure the output folder exists
+    os.makedirs(output_folder, exist_ok=True)
+
+    # DataFrames collected for each activity, concatenated once at the end
+    combined_data = {
+        'walking': [],
+        'reading': [],
+        'playing': []
+    }
+
+    # Iterate over files in the input folder
+    for filename in os.listdir(input_folder):
+        if filename.endswith('.csv'):
+            try:
+                # Identify the activity types from filenames
+                _, activity = filename.split('_')
+                activity = activity.replace('.csv', '')
+
+                # Check if the activity is one of the expected types
+                if activity in combined_data:
+                    file_path = os.path.join(input_folder, filename)
+                    data = pd.read_csv(file_path)
+
+                    combined_data[activity].append(add_recording_id(data, filename))
+
+                    logger.info(f'Added data from {filename} to {activity}{FORMATS[file_format]}')
+                else:
+                    logger.warning(f'Skipped file {filename} - Unexpected activity type')
+
+            except Exception as e:
+                logger.error(f'Error processing file {filename}: {e}')
+                sys.stdout.flush()
+
+    # Save the combined data to separate files
+    save_combined_data(combined_data, output_folder, file_format)
+
+    logger.info(f'Completed combining files into walking, reading, and playing {file_format} files')
     sys.stdout.flush()
 
-logger.info('Completed combining files into walking.csv, reading.csv, and playing.csv')
-sys.stdout.flush()
\ No newline at end of file
+
+# Execute when run
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Combine the labelled recordings into one file per activity.")
+    parser.add_argument('--format', choices=list(FORMATS), default='csv',
+                        help="Output format, parquet and feather use compact dtypes (require pyarrow)")
+    args = parser.parse_args()
+    combine_files(LABELLED_DATA_PATH, COMBINED_FILE_PATH, args.format)
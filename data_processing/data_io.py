@@ -0,0 +1,212 @@
+import json
+import os
+
+import pandas as pd
+
+"""
+Table I/O shared by the data processing scripts. Intermediate datasets are CSV by default, and can be
+written as Parquet or Feather (requires pyarrow) with compact dtypes, which later stages load much faster.
+"""
+# Output format -> file extension
+FORMATS = {
+    'csv': '.csv',
+    'parquet': '.parquet',
+    'feather': '.feather'
+}
+
+# Recording of each row, the '<index>' of its '<index>_<action>.csv' file, added when the recordings are combined
+RECORDING_COLUMN = 'Recording'
+
+# Headers of the train/test split
+SIMPLIFIED_HEADERS = {
+    ' Timestamp ': 'timestamp',
+    ' Gazepoint X ': 'gazepoint_x',
+    ' Gazepoint Y ': 'gazepoint_y',
+    ' Pupil area (right) sq mm ': 'pupil_area_right_sq_mm',
+    ' Pupil area (left) sq mm ': 'pupil_area_left_sq_mm',
+    ' Eye event ': 'eye_event',
+    'Euclidean Distance': 'euclidean_distance',
+    'Result': 'result'
+}
+
+# Compact dtypes used by the columnar formats, under the original and the simplified headers
+FLOAT32_COLUMNS = [' Gazepoint X ', ' Gazepoint Y ', ' Pupil area (right) sq mm ', ' Pupil area (left) sq mm ']
+CATEGORY_COLUMNS = [' Eye event ']
+INTEGER_COLUMNS = [' Timestamp ', 'Result', RECORDING_COLUMN]
+FLOAT32_COLUMNS += [SIMPLIFIED_HEADERS[column] for column in FLOAT32_COLUMNS]
+CATEGORY_COLUMNS += [SIMPLIFIED_HEADERS[column] for column in CATEGORY_COLUMNS]
+INTEGER_COLUMNS += [SIMPLIFIED_HEADERS[column] for column in INTEGER_COLUMNS if column in SIMPLIFIED_HEADERS]
+
+
+def add_recording_id(dataframe_data, filename):
+    """Add the `RECORDING_COLUMN` of a '<index>_<action>.csv' recording, so splits can keep recordings whole."""
+    dataframe_data[RECORDING_COLUMN] = int(os.path.basename(filename).split('_')[0])
+    return dataframe_data
+
+
+def compact_dtypes(dataframe_data):
+    """Downcast the gaze/pupil columns to float32, integers to the smallest type and the eye event to a category."""
+    columns = {}
+    for column in dataframe_data.columns:
+        if column in FLOAT32_COLUMNS:
+            columns[column] = dataframe_data[column].astype('float32')
+        elif column in CATEGORY_COLUMNS:
+            columns[column] = dataframe_data[column].astype('category')
+        elif column in INTEGER_COLUMNS and pd.api.types.is_integer_dtype(dataframe_data[column]):
+            columns[column] = pd.to_numeric(dataframe_data[column], downcast='integer')
+    return dataframe_data.assign(**columns)
+
+
+def write_table(dataframe_data, folder, name, file_format='csv'):
+    """
+    Write `<folder>/<name>.<ext>` in the given format, columnar formats get compact dtypes.
+    Returns:
+        str: The path of the written file.
+    """
+    output_file_path = os.path.join(folder, name + FORMATS[file_format])
+    if file_format == 'parquet':
+        compact_dtypes(dataframe_data).to_parquet(output_file_path, index=False)
+    elif file_format == 'feather':
+        compact_dtypes(dataframe_data).reset_index(drop=True).to_feather(output_file_path)
+    else:
+        dataframe_data.to_csv(output_file_path, index=False)
+    return output_file_path
+
+
+def find_table(folder, name):
+    """Return the path of `<folder>/<name>` in whichever format exists, the most recent one if several do."""
+    candidates = [os.path.join(folder, name + extension) for extension in FORMATS.values()]
+    existing = [path for path in candidates if os.path.exists(path)]
+    if not existing:
+        raise FileNotFoundError(f"No {name} table in {folder}")
+    return max(existing, key=os.path.getmtime)
+
+
+def read_table(file_path):
+    """Read a table written by `write_table`, based on its extension."""
+    if file_path.endswith(FORMATS['parquet']):
+        return pd.read_parquet(file_path)
+    if file_path.endswith(FORMATS['feather']):
+        return pd.read_feather(file_path)
+    return pd.read_csv(file_path)
+
+
+def iter_table(file_path, chunksize):
+    """Read a table written by `write_table` in DataFrames of at most `chunksize` rows."""
+    if file_path.endswith(FORMATS['parquet']):
+        import pyarrow.parquet as pq
+
+        for batch in pq.ParquetFile(file_path).iter_batches(batch_size=chunksize):
+            yield batch.to_pandas()
+    elif file_path.endswith(FORMATS['feather']):
+        import pyarrow as pa
+
+        # Memory-mapped, only the batches being converted are loaded
+        with pa.memory_map(file_path) as source:
+            reader = pa.ipc.open_file(source)
+            for i in range(reader.num_record_batches):
+                batch = reader.get_batch(i)
+                for offset in range(0, batch.num_rows, chunksize):
+                    yield batch.slice(offset, chunksize).to_pandas()
+    else:
+        yield from pd.read_csv(file_path, chunksize=chunksize)
+
+
+class TableWriter:
+    """
+    Append DataFrame chunks to `<folder>/<name>.<ext>`. The columnar formats use the compact dtypes of
+    the first chunk for the whole file, so every chunk must fit them. Feather files store categories as
+    plain strings, because Arrow IPC files cannot change a dictionary between batches.
+    """
+
+    def __init__(self, folder, name, file_format='csv'):
+        self.folder = folder
+        self.name = name
+        self.file_format = file_format
+        self.path = os.path.join(folder, name + FORMATS[file_format])
+        self.rows = 0
+        self._schema = None
+        self._writer = None
+
+    def write(self, dataframe_data):
+        if self.file_format == 'csv':
+            dataframe_data.to_csv(self.path, index=False, mode='w' if self.rows == 0 else 'a', header=self.rows == 0)
+        else:
+            import pyarrow as pa
+
+            if self._schema is None:
+                self._schema = _chunk_schema(compact_dtypes(dataframe_data),
+                                             dictionaries=self.file_format == 'parquet')
+                if self.file_format == 'parquet':
+                    import pyarrow.parquet as pq
+
+                    self._writer = pq.ParquetWriter(self.path, self._schema)
+                else:
+                    self._writer = pa.ipc.new_file(self.path, self._schema,
+                                                   options=pa.ipc.IpcWriteOptions(compression='lz4'))
+            table = pa.Table.from_pandas(dataframe_data, schema=self._schema, preserve_index=False)
+            self._writer.write_table(table)
+        self.rows += len(dataframe_data)
+
+    def abort(self):
+        """Close and delete a partially written file."""
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def close(self):
+        """Finish the file (an empty table if no chunk was written) and return its path."""
+        if self._writer is not None:
+            self._writer.close()
+        elif self.rows == 0:
+            write_table(pd.DataFrame(), self.folder, self.name, self.file_format)
+        return self.path
+
+
+def features_path(table_path):
+    """Sidecar of a table recording how its features were computed, `<folder>/<name>.features.json`."""
+    return os.path.splitext(table_path)[0] + '.features.json'
+
+
+def write_features(table_path, rolling_window):
+    """Record the window of the rolling features of a table (0 without them) and return the sidecar path."""
+    file_path = features_path(table_path)
+    with open(file_path, 'w') as file:
+        json.dump({'rolling_window': rolling_window}, file)
+    return file_path
+
+
+def read_rolling_window(table_path):
+    """Window recorded by `write_features` for a table, None for tables written before windows were recorded."""
+    try:
+        with open(features_path(table_path)) as file:
+            return json.load(file)['rolling_window']
+    except FileNotFoundError:
+        return None
+
+
+def _chunk_schema(dataframe_data, dictionaries=True):
+    """Arrow schema of a compact chunk, with integer widths and dictionaries wide enough for later chunks."""
+    import pyarrow as pa
+
+    fields = []
+    for field in pa.Schema.from_pandas(dataframe_data, preserve_index=False):
+        if pa.types.is_integer(field.type):
+            field = field.with_type(pa.int32())
+        elif pa.types.is_dictionary(field.type):
+            field = field.with_type(pa.dictionary(pa.int32(), pa.string()) if dictionaries else pa.string())
+        fields.append(field)
+    return pa.schema(fields)
+
+
+def rss_mb():
+    """Resident memory of this process in MB (Linux /proc, falls back to the peak from getrusage)."""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1e6
+    except (OSError, ValueError):
+        import resource
+
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1e3
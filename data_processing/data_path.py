@@ -1,6 +1,10 @@
 RAW_DATA_DIR = '../full_dataset'
+RAW_DATA_ZIP = '../full_dataset.zip'
 LABELLED_DATA_PATH = '../full_dataset_labelled'
 COMBINED_FILE_PATH = '../full_dataset_combined'
 FEATURE_FILE_PATH = '../ecl_distance_datasets'
 DATA_SPLIT_PATH = '../train_test_split'
-MODEL_PATH = '../models'
\ No newline at end of file
+MODEL_PATH = '../models'
+SERVING_MODEL_PATH = '../fast_server/model'
+FEATURE_CACHE_PATH = '../feature_cache'
+PIPELINE_STATE_PATH = '../pipeline_state.json'
\ No newline at end of file
@@ -1,8 +1,13 @@
+import argparse
 import os
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
 import pandas as pd
 import logging
 import sys
-from data_path import RAW_DATA_DIR, LABELLED_DATA_PATH
+from data_io import FORMATS, add_recording_id, write_table
+from data_path import RAW_DATA_DIR, RAW_DATA_ZIP, LABELLED_DATA_PATH, COMBINED_FILE_PATH
 # Set up logging to both file and console without overriding flush
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
 logger = logging.getLogger()
@@ -17,13 +22,6 @@ console_handler = logging.StreamHandler(sys.stdout)
 console_handler.setFormatter(logging.Formatter('%(asctime)s - %(message)s'))
 logger.addHandler(console_handler)
 
-# Folders containing your dataset files
-data_folder = RAW_DATA_DIR
-output_folder = LABELLED_DATA_PATH
-
-# Ensure the output folder exists
-os.makedirs(output_folder, exist_ok=True)
-
 # Mapping of action names to numeric codes
 """
 Since we are using TensorFlow in data data_processing and Keras metrics expect integers. 
@@ -36,39 +34,139 @@ action_map = {
     'playing': 3
 }
 
-# Iterate through each file in the folder
-file_count = 0
-for filename in os.listdir(data_folder):
-    if filename.endswith('.csv') and filename != 'config_data.csv':
-        try:
-            index_number, action = filename.split('_')
-            action = action.replace('.csv', '')
 
-            if action in action_map:
-                file_path = os.path.join(data_folder, filename)
-                data = pd.read_csv(file_path)
+def parse_action(filename):
+    """Return the action of a '<index>_<action>.csv' recording, or None if it is not a recording."""
+    if not filename.endswith('.csv') or filename == 'config_data.csv':
+        return None
+    _, action = filename.split('_')
+    return action.replace('.csv', '')
 
-                # Add a 'result' column with the mapped value
-                data['Result'] = action_map[action]
 
-                # Save the modified data to the new directory
-                output_file_path = os.path.join(output_folder, filename)
-                data.to_csv(output_file_path, index=False)
+def log_progress(file_count, filename, action):
+    # Log progress and file processed
+    if file_count % 50 == 0:
+        logger.info(f"Processed {file_count} files so far.")
 
-                # Log progress and file processed
-                file_count += 1
-                if file_count % 50 == 0:
-                    logger.info(f"Processed {file_count} files so far.")
+    logger.info(f"Processed file {filename} - Action: {action}")
+    sys.stdout.flush()  # Ensure immediate output in Jupyter
+
+
+def process_directory(data_folder, output_folder):
+    """Label every extracted recording and write a labelled copy of each file."""
+    # Ensure the output folder exists
+    os.makedirs(output_folder, exist_ok=True)
+
+    # Iterate through each file in the folder
+    file_count = 0
+    for filename in os.listdir(data_folder):
+        if filename.endswith('.csv') and filename != 'config_data.csv':
+            try:
+                action = parse_action(filename)
 
-                logger.info(f"Processed file {filename} - Action: {action}")
+                if action in action_map:
+                    file_path = os.path.join(data_folder, filename)
+                    data = pd.read_csv(file_path)
+
+                    # Add a 'result' column with the mapped value
+                    data['Result'] = action_map[action]
+
+                    # Save the modified data to the new directory
+                    output_file_path = os.path.join(output_folder, filename)
+                    data.to_csv(output_file_path, index=False)
+
+                    file_count += 1
+                    log_progress(file_count, filename, action)
+
+                else:
+                    logger.warning(f"Skipped file {filename} - Action not recognized")
+
+            except Exception as e:
+                logger.error(f"Error processing file {filename}: {e}")
                 sys.stdout.flush()  # Ensure immediate output in Jupyter
 
-            else:
-                logger.warning(f"Skipped file {filename} - Action not recognized")
+    logger.info(f"Completed processing {file_count} files.")
+    sys.stdout.flush()  # Ensure final output is printed
+
+
+# Archive opened once per worker process
+_archive = None
+
+
+def _open_archive(zip_path):
+    global _archive
+    _archive = zipfile.ZipFile(zip_path)
+
+
+def read_labelled_member(member):
+    """Worker: parse one recording straight out of the archive and add its 'Result' column."""
+    action = parse_action(os.path.basename(member))
+    with _archive.open(member) as file:
+        data = pd.read_csv(file)
+    data['Result'] = action_map[action]
+    return data
+
+
+def process_zip(zip_path, output_folder, workers=None, file_format='csv'):
+    """
+    Label the recordings straight out of the dataset archive with a process pool, and write the
+    combined walking/reading/playing files for `feature_engineering.py` directly, without the
+    intermediate labelled copy of every file.
+    """
+    os.makedirs(output_folder, exist_ok=True)
+
+    with zipfile.ZipFile(zip_path) as archive:
+        members = sorted(name for name in archive.namelist()
+                         if name.endswith('.csv') and os.path.basename(name) != 'config_data.csv')
+
+    # Labelled frames of each activity, in archive order
+    labelled = {action: {} for action in action_map}
+    file_count = 0
+    with ProcessPoolExecutor(max_workers=workers, initializer=_open_archive, initargs=(zip_path,)) as executor:
+        futures = {}
+        for member in members:
+            filename = os.path.basename(member)
+            try:
+                action = parse_action(filename)
+                if action in action_map:
+                    futures[executor.submit(read_labelled_member, member)] = (member, filename, action)
+                else:
+                    logger.warning(f"Skipped file {filename} - Action not recognized")
+            except Exception as e:
+                logger.error(f"Error processing file {filename}: {e}")
+                sys.stdout.flush()
+
+        for future in as_completed(futures):
+            member, filename, action = futures[future]
+            try:
+                labelled[action][member] = future.result()
+                file_count += 1
+                log_progress(file_count, filename, action)
+            except Exception as e:
+                logger.error(f"Error processing file {filename}: {e}")
+                sys.stdout.flush()
+
+    logger.info(f"Completed processing {file_count} files.")
+    for action, frames in labelled.items():
+        data = pd.concat([add_recording_id(frames[member], member) for member in sorted(frames)],
+                         ignore_index=True) if frames else pd.DataFrame()
+        output_file_path = write_table(data, output_folder, action, file_format)
+        logger.info(f'Saved combined data to {output_file_path}')
+    sys.stdout.flush()  # Ensure final output is printed
+
 
-        except Exception as e:
-            logger.error(f"Error processing file {filename}: {e}")
-            sys.stdout.flush()  # Ensure immediate output in Jupyter
+# Execute when run
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Add the 'Result' label to every raw recording.")
+    parser.add_argument('--zip', nargs='?', const=RAW_DATA_ZIP, default=None,
+                        help=f"Read the recordings straight from the archive (default {RAW_DATA_ZIP}) "
+                             f"and write the combined activity files, skipping data_concatenation.py")
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes for --zip (default: all cores)")
+    parser.add_argument('--format', choices=list(FORMATS), default='csv',
+                        help="Format of the combined files written by --zip, parquet and feather require pyarrow")
+    args = parser.parse_args()
 
-logger.info(f"Completed processing {file_count} files.")
-sys.stdout.flush()  # Ensure final output is printed
\ No newline at end of file
+    if args.zip:
+        process_zip(args.zip, COMBINED_FILE_PATH, args.workers, args.format)
+    else:
+        process_directory(RAW_DATA_DIR, LABELLED_DATA_PATH)
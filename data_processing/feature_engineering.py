@@ -1,12 +1,22 @@
+import argparse
 import os
-import pandas as pd
 import logging
 import sys
 import numpy as np
-import re
 
+from data_io import (FORMATS, RECORDING_COLUMN, SIMPLIFIED_HEADERS, TableWriter, find_table, iter_table, read_table,
+                     rss_mb, write_features, write_table)
 from data_path import COMBINED_FILE_PATH, FEATURE_FILE_PATH
 
+# The rolling-window gaze features come from the engine the server computes them with, so both agree
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'fast_server'))
+from gaze_features import DEFAULT_WINDOW, ROLLING_FEATURES, RollingWindow
+
+# Columns the rolling-window features are computed from -> payload column
+ROLLING_INPUTS = {column: SIMPLIFIED_HEADERS[column] for column in
+                  [' Timestamp ', ' Gazepoint X ', ' Gazepoint Y ', ' Pupil area (right) sq mm ',
+                   ' Pupil area (left) sq mm ', ' Eye event ']}
+
 # Set up logging to both file and console
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
 logger = logging.getLogger()
@@ -40,33 +50,26 @@ def remove_na_row(dataframe_data, file_name):
 
 # Regular expression to match and extract x, y, and d coordinates
 pattern = r' FEx(?P<x>[-+]?\d*\.\d+)y(?P<y>[-+]?\d*\.\d+)d(?P<d>[-+]?\d*\.\d+) '
+# `str.extract` searches the whole string, anchor it to keep the `re.match` semantics
+anchored_pattern = '^' + pattern
 
 def euclidean_distance_cal(dataframe_data, file_name):
     try:
-        # Process each row to calculate Euclidean Distance where pattern matches
-        distances = []
-        for i, row in dataframe_data.iterrows():
-            eye_event = row[' Eye event ']
-            match = re.match(pattern, eye_event)
-
-            if match:
-                # Extract x, y, and d as floats
-                x = float(match.group('x'))
-                y = float(match.group('y'))
-                d = float(match.group('d'))
-
-                # Calculate the Euclidean Distance
-                F = np.sqrt(x ** 2 + y ** 2) * d
-                F = round(F, 4)  # Round to 4 decimal places
-                distances.append(F)
-
-                # Update ' Eye event ' to ' FE '
-                dataframe_data.at[i, ' Eye event '] = " FE "
-
-            else:
-                # No change for rows without matching pattern
-                # We will handle this value later
-                distances.append(np.nan)
+        # Extract x, y, and d of every row at once, NaN for rows without matching pattern
+        # (we will handle these values later)
+        coordinates = dataframe_data[' Eye event '].str.extract(anchored_pattern).astype(float)
+        x = coordinates['x'].to_numpy()
+        y = coordinates['y'].to_numpy()
+        d = coordinates['d'].to_numpy()
+
+        # Calculate the Euclidean Distance, rounded to 4 decimal places
+        distances = np.round(np.sqrt(x ** 2 + y ** 2) * d, 4)
+
+        # Update ' Eye event ' to ' FE ' for the matched rows
+        matched = coordinates['x'].notna().to_numpy()
+        dataframe_data = dataframe_data.copy()
+        dataframe_data.loc[matched, ' Eye event '] = " FE "
+
         # Add new column 'Euclidean Distance' before 'Result' column
         dataframe_data.insert(dataframe_data.columns.get_loc('Result'), 'Euclidean Distance', distances)
 
@@ -77,36 +80,34 @@ def euclidean_distance_cal(dataframe_data, file_name):
         logger.error(f"Error processing file {file_name} : {e}")
 
 
-def replace_nan_euclidean_distance(dataframe_data, file_name):
+def replace_nan_euclidean_distance(dataframe_data, file_name, previous_value=None):
     """
     Now Euclidean Distance is calculated, we still have to handle the NaN values in this rows. For this, we set a rule:
         * If the eye event is `'S`, `BB`, `BE`
         * If the eye event is `FB`, we can save it as the previous Euclidean Distance we calculated,
             if none has been calculated, we set it as `1.0`
+    `previous_value` is the last distance calculated before this data, when a file is processed in chunks.
     """
     try:
         # Ensure 'Euclidean Distance' column exists
         if 'Euclidean Distance' not in dataframe_data.columns:
             return dataframe_data  # If the column doesn't exist, return the DataFrame as is
 
-        previous_value = None  # Start with no previous value
-
-        for i, row in dataframe_data.iterrows():
-            eye_event = row[' Eye event '].strip()  # Stripping any whitespace
-
-            if pd.isna(row['Euclidean Distance']):
-                if eye_event in ['S', 'BB', 'BE']:
-                    # Set NaN to 0.0 for 'S', 'BB', or 'BE'
-                    dataframe_data.at[i, 'Euclidean Distance'] = 0.0
-                elif eye_event == 'FB':
-                    # Set NaN to the previous non-NaN value or 1.0 if not found
-                    if previous_value is not None:
-                        dataframe_data.at[i, 'Euclidean Distance'] = previous_value
-                    else:
-                        dataframe_data.at[i, 'Euclidean Distance'] = 1.0
-            else:
-                # Update previous_value only for non-NaN entries
-                previous_value = row['Euclidean Distance']
+        distances = dataframe_data['Euclidean Distance']
+        missing = distances.isna()
+        eye_event = dataframe_data[' Eye event '].str.strip()  # Stripping any whitespace
+
+        # Previous calculated value of each row, 1.0 if none has been calculated yet.
+        # Only calculated values carry forward, the values filled below do not
+        previous_value = distances.ffill().fillna(1.0 if previous_value is None else previous_value)
+
+        filled = distances.copy()
+        # Set NaN to 0.0 for 'S', 'BB', or 'BE'
+        filled[missing & eye_event.isin(['S', 'BB', 'BE'])] = 0.0
+        # Set NaN to the previous non-NaN value or 1.0 if not found
+        fixation_begin = missing & (eye_event == 'FB')
+        filled[fixation_begin] = previous_value[fixation_begin]
+        dataframe_data['Euclidean Distance'] = filled
 
         logger.info(f"Replaced all NaN values in Euclidean Distances for {file_name} .")
 
@@ -114,40 +115,168 @@ def replace_nan_euclidean_distance(dataframe_data, file_name):
     except Exception as e:
         logger.error(f"Error processing file {file_name} : {e}")
 
+def add_rolling_features(dataframe_data, file_name, window, state=None):
+    """
+    Add the rolling-window gaze features (see fast_server/gaze_features.py) of every recording before 'Result'.
+    The windows restart with each recording, or with the file when it has no 'Recording' column.
+    `state` is the (recording, RollingWindow) after the last row of the previous chunk, when a file is processed
+    in chunks, so the windows continue across chunk boundaries.
+    Returns:
+        tuple: The data and the state after its last row.
+    """
+    try:
+        if RECORDING_COLUMN in dataframe_data.columns:
+            recordings = dataframe_data[RECORDING_COLUMN].to_numpy()
+        else:
+            recordings = np.zeros(len(dataframe_data), dtype=np.int64)
+        # Runs of consecutive rows of one recording
+        starts = np.flatnonzero(np.r_[True, recordings[1:] != recordings[:-1]])[:len(recordings)]
+        ends = np.r_[starts[1:], len(recordings)]
+
+        columns = {payload: dataframe_data[column].to_numpy() for column, payload in ROLLING_INPUTS.items()}
+        features = {name: np.empty(len(dataframe_data)) for name in ROLLING_FEATURES}
+        for start, end in zip(starts, ends):
+            if state is None or state[0] != recordings[start]:
+                state = (recordings[start], RollingWindow(window))
+            run = state[1].extend({key: values[start:end] for key, values in columns.items()})
+            for name in ROLLING_FEATURES:
+                features[name][start:end] = run[name]
+
+        position = dataframe_data.columns.get_loc('Result')
+        for offset, name in enumerate(ROLLING_FEATURES):
+            dataframe_data.insert(position + offset, name, features[name])
+
+        logger.info(f"Calculated rolling-window features (window {window}) for {file_name} .")
+
+        return dataframe_data, state
+    except Exception as e:
+        logger.error(f"Error processing file {file_name} : {e}")
+        raise
+
+def last_calculated_distance(dataframe_data, previous_value=None):
+    """The last calculated (not filled) Euclidean Distance, to carry the 'FB' rule into the next chunk."""
+    calculated = dataframe_data['Euclidean Distance'].dropna()
+    return calculated.iloc[-1] if len(calculated) else previous_value
+
+
+def process_file_in_chunks(file_path, output_directory, filename, file_format='csv', chunksize=100000,
+                           rolling_window=0):
+    """
+    Process one activity file in chunks of `chunksize` rows with bounded memory, appending each processed
+    chunk to the output. The previous distance of the 'FB' rule and the rolling windows are carried across
+    chunk boundaries, so the output is the same as processing the whole file at once.
+    Returns:
+        tuple: The output file path and the peak resident memory (MB) seen while processing the file.
+    """
+    writer = TableWriter(output_directory, filename.replace('.csv', ''), file_format)
+    try:
+        previous_value, peak_memory = _process_chunks(file_path, filename, writer, chunksize, rolling_window)
+    except Exception:
+        writer.abort()
+        raise
+    return writer.close(), peak_memory
+
+
+def _process_chunks(file_path, filename, writer, chunksize, rolling_window=0):
+    previous_value = None
+    rolling_state = None
+    peak_memory = rss_mb()
+    for chunk_number, df in enumerate(iter_table(file_path, chunksize)):
+        chunk_name = f"{filename} chunk {chunk_number}"
+        # Eye events are relabelled below, a categorical column would reject the new label
+        df[' Eye event '] = df[' Eye event '].astype(object)
+
+        # Step 1: Remove rows with 'NA' in 'Eye event'
+        df = remove_na_row(df, chunk_name)
+
+        # Step 2: Calculate Euclidean Distance
+        df = euclidean_distance_cal(df, chunk_name)
+        carried_value = previous_value
+        previous_value = last_calculated_distance(df, previous_value)
+
+        # Step 3: Replace NaN values in Euclidean Distance, continuing from the previous chunk
+        df = replace_nan_euclidean_distance(df, chunk_name, carried_value)
+
+        # Step 4: Add the rolling-window features, continuing the windows of the previous chunk
+        if rolling_window:
+            df, rolling_state = add_rolling_features(df, chunk_name, rolling_window, rolling_state)
+
+        writer.write(df)
+        peak_memory = max(peak_memory, rss_mb())
+    return previous_value, peak_memory
+
+
+def process_file(file_path, output_directory, filename, file_format='csv', chunksize=None, rolling_window=0):
+    """
+    Add the Euclidean Distance feature, and the rolling-window features of `rolling_window` samples
+    (0 leaves them out), to one combined activity file. The window is recorded next to the output
+    (see `data_io.write_features`) for the split and training.
+    Returns:
+        str: The path of the processed file.
+    """
+    if chunksize:
+        output_file_path, peak_memory = process_file_in_chunks(
+            file_path, output_directory, filename, file_format, chunksize, rolling_window
+        )
+        write_features(output_file_path, rolling_window)
+        logger.info(f"Saved processed file to {output_file_path} (peak memory {peak_memory:.1f} MB)")
+        sys.stdout.flush()
+        return output_file_path
+
+    df = read_table(file_path)
+    # Eye events are relabelled below, a categorical column would reject the new label
+    df[' Eye event '] = df[' Eye event '].astype(object)
+
+    # Step 1: Remove rows with 'NA' in 'Eye event'
+    df = remove_na_row(df, filename)
+
+    # Step 2: Calculate Euclidean Distance
+    df = euclidean_distance_cal(df, filename)
+
+    # Step 3: Replace NaN values in Euclidean Distance
+    df = replace_nan_euclidean_distance(df, filename)
+
+    # Step 4: Add the rolling-window features
+    if rolling_window:
+        df, _ = add_rolling_features(df, filename, rolling_window)
+
+    # Save the processed DataFrame to a new CSV (or columnar) file
+    output_file_path = write_table(df, output_directory, filename.replace('.csv', ''), file_format)
+    write_features(output_file_path, rolling_window)
+
+    logger.info(f"Saved processed file to {output_file_path}")
+    sys.stdout.flush()
+    return output_file_path
+
+
 # Now to call all submodules and process file
-def process_files(input_directory, output_directory):
+def process_files(input_directory, output_directory, file_format='csv', chunksize=None, rolling_window=0):
     # Ensure output directory exists
     os.makedirs(output_directory, exist_ok=True)
     # List of CSV files to process
     files_to_process = ['walking.csv', 'reading.csv', 'playing.csv']
     for filename in files_to_process:
         try:
-            # Read each CSV files
-            file_path = os.path.join(input_directory, filename)
+            # Read each combined file, CSV or the columnar formats written by data_concatenation.py
+            file_path = find_table(input_directory, filename.replace('.csv', ''))
             logger.info(f"Processing {filename}...")
-            df = pd.read_csv(file_path)
-
-            # Step 1: Remove rows with 'NA' in 'Eye event'
-            df = remove_na_row(df, filename)
-
-            # Step 2: Calculate Euclidean Distance
-            df = euclidean_distance_cal(df, filename)
-
-            # Step 3: Replace NaN values in Euclidean Distance
-            df = replace_nan_euclidean_distance(df, filename)
-
-            # Save the processed DataFrame to a new CSV file
-            output_file_path = os.path.join(output_directory, filename)
-            df.to_csv(output_file_path, index=False)
-
-            logger.info(f"Saved processed file to {output_file_path}")
-            sys.stdout.flush()
+            process_file(file_path, output_directory, filename, file_format, chunksize, rolling_window)
         except Exception as e:
             logger.error(f"Error processing file {filename} : {e}")
             sys.stdout.flush()
 
 # Execute when run
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Add the Euclidean Distance feature to the combined activity files.")
+    parser.add_argument('--format', choices=list(FORMATS), default='csv',
+                        help="Output format, parquet and feather use compact dtypes (require pyarrow)")
+    parser.add_argument('--chunksize', type=int, default=None,
+                        help="Process each file in chunks of this many rows with bounded memory")
+    parser.add_argument('--rolling-window', type=int, nargs='?', const=DEFAULT_WINDOW, default=0,
+                        help=f"Also add the rolling-window gaze features over this many samples "
+                             f"({DEFAULT_WINDOW} without a value), for models served with them")
+    args = parser.parse_args()
+
     input_dir = COMBINED_FILE_PATH
     output_dir = FEATURE_FILE_PATH
-    process_files(input_dir, output_dir)
\ No newline at end of file
+    process_files(input_dir, output_dir, args.format, args.chunksize, args.rolling_window)
\ No newline at end of file
@@ -0,0 +1,341 @@
+"""
+Incremental runner for the whole data processing pipeline:
+    label every recording -> combine each activity -> feature engineering of each activity -> train/test split
+
+Every step is keyed by a content hash of its inputs and its configuration (output format, chunk size, rolling
+window and the code of the script it runs), stored in `PIPELINE_STATE_PATH`. A step only runs again when its key changed or
+its outputs are missing, so adding a few recordings relabels only those files and reruns the steps downstream
+of the activities they belong to. Steps whose inputs are ready run in parallel in a process pool.
+
+    python pipeline.py [--zip [path]] [--format csv|parquet|feather] [--chunksize N] [--rolling-window [N]]
+                       [--workers N] [--group-by-recording] [--dry-run] [--force]
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import sys
+import zipfile
+import zlib
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import pandas as pd
+
+import data_processor
+from create_train_test_data import split_data
+from data_io import FORMATS, add_recording_id, features_path, write_table
+from data_path import (COMBINED_FILE_PATH, DATA_SPLIT_PATH, FEATURE_FILE_PATH, LABELLED_DATA_PATH,
+                       PIPELINE_STATE_PATH, RAW_DATA_DIR, RAW_DATA_ZIP)
+from feature_engineering import DEFAULT_WINDOW, process_file
+
+# The stage scripts set up their own log files on import, log to the console and pipeline.log only
+logger = logging.getLogger()
+for handler in list(logger.handlers):
+    logger.removeHandler(handler)
+logger.setLevel(logging.INFO)
+
+file_handler = logging.FileHandler('pipeline.log')
+file_handler.setFormatter(logging.Formatter('%(asctime)s - %(message)s'))
+logger.addHandler(file_handler)
+
+console_handler = logging.StreamHandler(sys.stdout)
+console_handler.setFormatter(logging.Formatter('%(asctime)s - %(message)s'))
+logger.addHandler(console_handler)
+
+ACTIVITIES = list(data_processor.action_map)
+
+# Scripts whose code each stage runs, a change to one of them reruns the stage. This script holds the workers and
+# the arguments of the combine, features and split steps
+STAGE_CODE = {
+    'label': ['data_processor.py'],
+    'combine': ['pipeline.py', 'data_io.py'],
+    'features': ['pipeline.py', 'feature_engineering.py', 'data_io.py',
+                 os.path.join('..', 'fast_server', 'gaze_features.py')],
+    'split': ['pipeline.py', 'create_train_test_data.py', 'data_io.py'],
+}
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def file_digest(file_path):
+    """CRC32 and size of a file's content, the same digest the zip archive stores for its members."""
+    crc = 0
+    size = 0
+    with open(file_path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            crc = zlib.crc32(block, crc)
+            size += len(block)
+    return f"{crc:08x}:{size}"
+
+
+def key_digest(value):
+    """Stable hash of a JSON-serialisable step key."""
+    return hashlib.sha1(json.dumps(value, sort_keys=True).encode()).hexdigest()
+
+
+def code_digest(stage):
+    return {name: file_digest(os.path.join(HERE, name)) for name in STAGE_CODE[stage]}
+
+
+def load_state(state_path):
+    if not os.path.exists(state_path):
+        return {'files': {}, 'steps': {}}
+    with open(state_path) as file:
+        return json.load(file)
+
+
+def save_state(state, state_path):
+    # Write to a temporary file first, an interrupted run must not leave a truncated state behind
+    temporary_path = state_path + '.tmp'
+    with open(temporary_path, 'w') as file:
+        json.dump(state, file, indent=1, sort_keys=True)
+    os.replace(temporary_path, state_path)
+
+
+def cached_file_digest(state, file_path):
+    """Digest of a file on disk, only rehashed when its size or modification time changed since the last run."""
+    stat = os.stat(file_path)
+    cached = state['files'].get(file_path)
+    if cached and cached['size'] == stat.st_size and cached['mtime_ns'] == stat.st_mtime_ns:
+        return cached['digest']
+    digest = file_digest(file_path)
+    state['files'][file_path] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'digest': digest}
+    return digest
+
+
+def list_recordings(state, zip_path=None, data_folder=RAW_DATA_DIR):
+    """
+    The labelled recordings of the dataset, from the archive or the extracted folder.
+    Returns:
+        dict: Recording file name -> (source, action, content digest), sorted by file name.
+    """
+    recordings = {}
+    if zip_path:
+        with zipfile.ZipFile(zip_path) as archive:
+            for info in archive.infolist():
+                filename = os.path.basename(info.filename)
+                action = data_processor.parse_action(filename)
+                if action in data_processor.action_map:
+                    recordings[filename] = (info.filename, action, f"{info.CRC:08x}:{info.file_size}")
+    else:
+        for filename in os.listdir(data_folder):
+            action = data_processor.parse_action(filename)
+            if action in data_processor.action_map:
+                file_path = os.path.join(data_folder, filename)
+                recordings[filename] = (file_path, action, cached_file_digest(state, file_path))
+    return dict(sorted(recordings.items()))
+
+
+def label_recording(source, filename, output_folder, zip_path=None):
+    """Worker: write the labelled copy of one recording, like `data_processor.py` does."""
+    if zip_path:
+        data = data_processor.read_labelled_member(source)
+    else:
+        data = pd.read_csv(source)
+        data['Result'] = data_processor.action_map[data_processor.parse_action(filename)]
+    output_file_path = os.path.join(output_folder, filename)
+    data.to_csv(output_file_path, index=False)
+    return [output_file_path]
+
+
+def combine_activity(labelled_paths, output_folder, activity, file_format):
+    """Worker: concatenate the labelled recordings of one activity, like `data_concatenation.py` does."""
+    frames = [add_recording_id(pd.read_csv(file_path), file_path) for file_path in labelled_paths]
+    data = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+    return [write_table(data, output_folder, activity, file_format)]
+
+
+def engineer_features(combined_path, output_folder, activity, file_format, chunksize, rolling_window=0):
+    """Worker: add the engineered features to one activity, like `feature_engineering.py` does."""
+    output_file_path = process_file(combined_path, output_folder, f"{activity}.csv", file_format, chunksize,
+                                    rolling_window)
+    return [output_file_path, features_path(output_file_path)]
+
+
+class Step:
+    """
+    One unit of work of the pipeline. `key` holds everything the outputs depend on besides the outputs of
+    `deps`, whose digests are added to the key once those steps have finished.
+    """
+
+    def __init__(self, name, stage, function, args, key, deps=()):
+        self.name = name
+        self.stage = stage
+        self.function = function
+        self.args = args
+        self.key = key
+        self.deps = list(deps)
+
+
+def build_steps(recordings, zip_path, file_format, chunksize, group_by_recording=False, rolling_window=0):
+    """The steps of the pipeline, in dependency order."""
+    os.makedirs(LABELLED_DATA_PATH, exist_ok=True)
+    os.makedirs(COMBINED_FILE_PATH, exist_ok=True)
+    os.makedirs(FEATURE_FILE_PATH, exist_ok=True)
+
+    code = {stage: code_digest(stage) for stage in STAGE_CODE}
+    steps = []
+    labelled = {activity: [] for activity in ACTIVITIES}
+    for filename, (source, action, digest) in recordings.items():
+        name = f"label:{filename}"
+        steps.append(Step(name, 'label', label_recording, (source, filename, LABELLED_DATA_PATH, zip_path),
+                          {'content': digest, 'code': code['label']}))
+        labelled[action].append((name, os.path.join(LABELLED_DATA_PATH, filename)))
+
+    for activity in ACTIVITIES:
+        label_steps = [name for name, _ in labelled[activity]]
+        labelled_paths = [file_path for _, file_path in labelled[activity]]
+        steps.append(Step(f"combine:{activity}", 'combine', combine_activity,
+                          (labelled_paths, COMBINED_FILE_PATH, activity, file_format),
+                          {'format': file_format, 'code': code['combine']}, label_steps))
+
+        combined_path = os.path.join(COMBINED_FILE_PATH, activity + FORMATS[file_format])
+        steps.append(Step(f"features:{activity}", 'features', engineer_features,
+                          (combined_path, FEATURE_FILE_PATH, activity, file_format, chunksize, rolling_window),
+                          {'format': file_format, 'chunksize': chunksize, 'rolling_window': rolling_window,
+                           'code': code['features']},
+                          [f"combine:{activity}"]))
+
+    steps.append(Step('split', 'split', split_data, (FEATURE_FILE_PATH, DATA_SPLIT_PATH, 'csv', group_by_recording),
+                      {'group_by_recording': group_by_recording, 'code': code['split']},
+                      [f"features:{activity}" for activity in ACTIVITIES]))
+    return steps
+
+
+def run_pipeline(zip_path=None, file_format='csv', chunksize=None, workers=None, dry_run=False, force=False,
+                 group_by_recording=False, state_path=PIPELINE_STATE_PATH, rolling_window=0):
+    """
+    Run the steps whose inputs or configuration changed since the last run.
+    Returns:
+        dict: Step name -> 'skipped', 'ran', 'would run', 'failed' or 'blocked'.
+    """
+    state = load_state(state_path)
+    recordings = list_recordings(state, zip_path)
+    steps = build_steps(recordings, zip_path, file_format, chunksize, group_by_recording, rolling_window)
+    by_name = {step.name: step for step in steps}
+
+    if not dry_run:
+        remove_stale_outputs(state, by_name)
+
+    results = {}
+    keys = {}
+    pending = list(steps)
+    running = {}
+    initializer, initargs = (data_processor._open_archive, (zip_path,)) if zip_path else (None, ())
+    with ProcessPoolExecutor(max_workers=workers, initializer=initializer, initargs=initargs) as executor:
+        while pending or running:
+            for step in list(pending):
+                dep_results = [results.get(dep) for dep in step.deps]
+                if any(result is None for result in dep_results):
+                    continue
+                pending.remove(step)
+
+                if any(result in ('failed', 'blocked') for result in dep_results):
+                    results[step.name] = 'blocked'
+                    continue
+                if any(result == 'would run' for result in dep_results):
+                    # The outputs of the dependencies are not known without running them
+                    results[step.name] = 'would run'
+                    continue
+
+                key = dict(step.key, deps={dep: state['steps'][dep]['outputs'] for dep in step.deps})
+                keys[step.name] = key_digest(key)
+                if not force and is_up_to_date(state, step.name, keys[step.name]):
+                    results[step.name] = 'skipped'
+                elif dry_run:
+                    results[step.name] = 'would run'
+                else:
+                    running[executor.submit(step.function, *step.args)] = step
+
+            if not running:
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                step = running.pop(future)
+                try:
+                    outputs = future.result()
+                except Exception as e:
+                    logger.error(f"Step {step.name} failed: {e}")
+                    state['steps'].pop(step.name, None)
+                    results[step.name] = 'failed'
+                    continue
+                state['steps'][step.name] = {
+                    'key': keys[step.name],
+                    'outputs': {file_path: cached_file_digest(state, file_path) for file_path in outputs},
+                }
+                results[step.name] = 'ran'
+            if not dry_run:
+                save_state(state, state_path)
+
+    if not dry_run:
+        save_state(state, state_path)
+    log_summary(steps, results, dry_run)
+    return results
+
+
+def is_up_to_date(state, name, key):
+    """A step is up to date when its key is unchanged and its outputs are still on disk, untouched."""
+    recorded = state['steps'].get(name)
+    if recorded is None or recorded['key'] != key:
+        return False
+    return all(os.path.exists(file_path) and cached_file_digest(state, file_path) == digest
+               for file_path, digest in recorded['outputs'].items())
+
+
+def remove_stale_outputs(state, steps):
+    """Forget the steps of recordings removed from the dataset, and delete their labelled copies."""
+    for name in [name for name in state['steps'] if name not in steps]:
+        for file_path in state['steps'].pop(name)['outputs']:
+            if name.startswith('label:') and os.path.exists(file_path):
+                os.remove(file_path)
+            state['files'].pop(file_path, None)
+    # Only keep the digests of files the pipeline still reads or writes
+    tracked = {file_path for step in state['steps'].values() for file_path in step['outputs']}
+    for file_path in list(state['files']):
+        if file_path not in tracked and not os.path.exists(file_path):
+            del state['files'][file_path]
+
+
+def log_summary(steps, results, dry_run):
+    for stage in STAGE_CODE:
+        counts = {}
+        names = []
+        for step in steps:
+            if step.stage == stage:
+                counts[results[step.name]] = counts.get(results[step.name], 0) + 1
+                if results[step.name] != 'skipped':
+                    names.append(f"{step.name} ({results[step.name]})")
+        summary = ', '.join(f"{count} {result}" for result, count in sorted(counts.items()))
+        logger.info(f"{stage}: {summary or 'nothing to do'}")
+        # The labelling stage can have hundreds of steps, only list them individually when few changed
+        if names and (stage != 'label' or len(names) <= 20):
+            for name in names:
+                logger.info(f"    {name}")
+    if dry_run:
+        logger.info("Dry run, nothing was written")
+    sys.stdout.flush()
+
+
+# Execute when run
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run the data processing pipeline, redoing only what changed.")
+    parser.add_argument('--zip', nargs='?', const=RAW_DATA_ZIP, default=None,
+                        help=f"Read the recordings from the archive (default {RAW_DATA_ZIP}) instead of {RAW_DATA_DIR}")
+    parser.add_argument('--format', choices=list(FORMATS), default='csv',
+                        help="Format of the combined and feature files, parquet and feather require pyarrow")
+    parser.add_argument('--chunksize', type=int, default=None,
+                        help="Process each activity file in chunks of this many rows during feature engineering")
+    parser.add_argument('--rolling-window', type=int, nargs='?', const=DEFAULT_WINDOW, default=0,
+                        help=f"Also add the rolling-window gaze features over this many samples ({DEFAULT_WINDOW} "
+                             f"without a value)")
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes (default: all cores)")
+    parser.add_argument('--group-by-recording', action='store_true',
+                        help="Keep the rows of each recording in the same set of the train/test split")
+    parser.add_argument('--dry-run', action='store_true', help="Only show which steps would run")
+    parser.add_argument('--force', action='store_true', help="Run every step, ignoring the recorded state")
+    args = parser.parse_args()
+
+    results = run_pipeline(args.zip, args.format, args.chunksize, args.workers, args.dry_run, args.force,
+                           args.group_by_recording, rolling_window=args.rolling_window)
+    sys.exit(1 if any(result in ('failed', 'blocked') for result in results.values()) else 0)
@@ -0,0 +1,206 @@
+import argparse
+import io
+import os
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from config import MAX_BATCH_ROWS, MODEL_PATH
+from registry import ModelVersion
+from serve import available_cores
+from tuning import thread_budget
+from utils import NUMERIC_COLUMNS, class_means, logger, preprocess_columns
+
+"""
+Offline scoring of recorded sessions with the serving preprocessing and model. Scores every CSV recording of
+zip archives (e.g. full_dataset.zip), directories and single files across a process pool, and writes one row
+of class probabilities per recording:
+
+    python bulk_score.py ../full_dataset.zip --output scores.parquet
+
+Recordings are grouped into batches of about `--batch-rows` samples, so each worker makes few, large
+`model.predict` calls. Each recording is preprocessed on its own, exactly like one `/predict` payload,
+including the rolling-window features of models that use them.
+"""
+# CSV header (stripped) -> payload column, the raw recordings and the payload names are both accepted
+CSV_COLUMNS = {
+    "Timestamp": "timestamp",
+    "Gazepoint X": "gazepoint_x",
+    "Gazepoint Y": "gazepoint_y",
+    "Pupil area (right) sq mm": "pupil_area_right_sq_mm",
+    "Pupil area (left) sq mm": "pupil_area_left_sq_mm",
+    "Eye event": "eye_event",
+}
+CSV_COLUMNS.update({column: column for column in CSV_COLUMNS.values()})
+# CSVs of the dataset archive that are not recordings
+SKIPPED_FILES = {"config_data.csv"}
+# Approximate CSV size of a sample, to batch recordings by size before reading them
+CSV_ROW_BYTES = 40
+OUTPUT_FORMATS = (".parquet", ".feather", ".csv")
+
+# Model of the worker process, loaded once by `load_model`
+model: Optional[ModelVersion] = None
+_archives = {}  # zip path -> open ZipFile of the worker
+
+
+def list_recordings(paths: list) -> list:
+    """
+    Find the CSV recordings of zip archives, directories (recursively) and files.
+    Returns:
+        list: (source, recording name, size in bytes) tuples, source being a path or (zip path, member).
+    """
+    recordings = []
+    for path in paths:
+        if zipfile.is_zipfile(path):
+            with zipfile.ZipFile(path) as archive:
+                for info in archive.infolist():
+                    if info.filename.endswith(".csv") and os.path.basename(info.filename) not in SKIPPED_FILES:
+                        name = os.path.join(os.path.basename(path), info.filename)
+                        recordings.append(((path, info.filename), name, info.file_size))
+        elif os.path.isdir(path):
+            for folder, _, files in sorted(os.walk(path)):
+                for file in sorted(files):
+                    if file.endswith(".csv") and file not in SKIPPED_FILES:
+                        file_path = os.path.join(folder, file)
+                        recordings.append((file_path, os.path.relpath(file_path, path), os.path.getsize(file_path)))
+        else:
+            recordings.append((path, os.path.basename(path), os.path.getsize(path)))
+    return recordings
+
+
+def batch_recordings(recordings: list, batch_rows: int) -> list:
+    """Group consecutive recordings into batches of about `batch_rows` samples."""
+    batches, batch, size = [], [], 0
+    for recording in recordings:
+        batch.append(recording)
+        size += recording[2]
+        if size >= batch_rows * CSV_ROW_BYTES:
+            batches.append(batch)
+            batch, size = [], 0
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def read_recording(source) -> dict:
+    """Read a CSV recording into payload columns."""
+    if isinstance(source, tuple):
+        zip_path, member = source
+        if zip_path not in _archives:
+            _archives[zip_path] = zipfile.ZipFile(zip_path)
+        source = io.BytesIO(_archives[zip_path].read(member))
+    data = pd.read_csv(source)
+    data.columns = [CSV_COLUMNS.get(column.strip(), column) for column in data.columns]
+    missing = [column for column in NUMERIC_COLUMNS + ["eye_event"] if column not in data.columns]
+    if missing:
+        raise ValueError(f"Missing columns {missing}")
+    columns = {key: data[key].to_numpy(dtype=np.float64) for key in NUMERIC_COLUMNS}
+    # Devices send stripped events, the recordings pad them with spaces
+    columns["eye_event"] = np.char.strip(data["eye_event"].fillna("NA").to_numpy(dtype=str))
+    return columns
+
+
+def load_model(model_path: str, num_threads: int):
+    global model
+    model = ModelVersion(os.path.basename(os.path.normpath(model_path)), model_path, num_threads=num_threads)
+
+
+def score_batch(batch: list) -> list:
+    """
+    Score a batch of recordings with one `model.predict` call.
+    Returns:
+        list: One result dict per recording.
+    """
+    results, inputs = [], []
+    for source, name, _ in batch:
+        result = {"recording": name, "samples": 0, "process_data": 0, "error": None}
+        try:
+            columns = read_recording(source)
+            batch_input = model.add_features(preprocess_columns(columns))
+            result["samples"] = len(columns["timestamp"])
+            result["process_data"] = len(batch_input["timestamp"])
+            if result["process_data"]:
+                inputs.append(batch_input)
+        except Exception as e:
+            logger.error(f"Failed to score {name}: {e}")
+            result["error"] = str(e)
+        results.append(result)
+
+    merged = {key: np.concatenate([batch_input[key] for batch_input in inputs]) for key in inputs[0]} if inputs else None
+    predictions = model.predict(merged) if merged else np.empty((0, len(model.class_names)), dtype=np.float32)
+    splits = np.cumsum([result["process_data"] for result in results])[:-1]
+    for result, recording_predictions in zip(results, np.split(predictions, splits)):
+        means = class_means(recording_predictions) if len(recording_predictions) else [np.nan] * len(model.class_names)
+        result.update(zip(model.class_names, np.asarray(means, dtype=np.float64).tolist()))
+    return results
+
+
+def score_recordings(paths: list, model_path: str = MODEL_PATH, workers: int = 0,
+                     batch_rows: int = MAX_BATCH_ROWS) -> pd.DataFrame:
+    """
+    Score every recording found in `paths`.
+    Args:
+        paths (list): Zip archives, directories and CSV files.
+        model_path (str): The YDF model directory.
+        workers (int): Worker processes, 0 uses one per available core, 1 scores in this process.
+        batch_rows (int): Samples per `model.predict` call.
+    Returns:
+        pd.DataFrame: One row per recording, in the order they were found.
+    """
+    recordings = list_recordings(paths)
+    workers = workers or available_cores()
+    # Smaller batches when needed to give every worker a few of them
+    estimated_rows = sum(size for _, _, size in recordings) // CSV_ROW_BYTES
+    batches = batch_recordings(recordings, max(min(batch_rows, estimated_rows // (4 * workers)), 1))
+    workers = min(workers, len(batches)) or 1
+    logger.info(f"Scoring {len(recordings)} recordings in {len(batches)} batches with {workers} workers")
+    # The workers share the cores, so their model.predict calls do not oversubscribe them
+    model_args = (model_path, thread_budget(workers))
+    if workers == 1:
+        load_model(*model_args)
+        results = [result for batch in batches for result in score_batch(batch)]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=load_model, initargs=model_args) as executor:
+            results = [result for batch_results in executor.map(score_batch, batches) for result in batch_results]
+    return pd.DataFrame(results)
+
+
+def write_scores(scores: pd.DataFrame, output: str):
+    """Write the scores, in the columnar format given by the extension of `output` (or CSV)."""
+    extension = os.path.splitext(output)[1].lower()
+    if extension == ".parquet":
+        scores.to_parquet(output, index=False)
+    elif extension == ".feather":
+        scores.to_feather(output)
+    elif extension == ".csv":
+        scores.to_csv(output, index=False)
+    else:
+        raise ValueError(f"Unsupported output format {extension}, use one of {', '.join(OUTPUT_FORMATS)}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Score recorded sessions offline")
+    parser.add_argument("paths", nargs="+", help="Zip archives, directories of CSV recordings or CSV files")
+    parser.add_argument("--output", default="scores.parquet",
+                        help="Per-recording probabilities, .parquet, .feather (both need pyarrow) or .csv")
+    parser.add_argument("--model", default=MODEL_PATH, help="YDF model directory")
+    parser.add_argument("--workers", type=int, default=0, help="Worker processes, 0 uses one per available core")
+    parser.add_argument("--batch-rows", type=int, default=MAX_BATCH_ROWS, help="Samples per model.predict call")
+    args = parser.parse_args()
+    if os.path.splitext(args.output)[1].lower() not in OUTPUT_FORMATS:
+        parser.error(f"--output must end with one of {', '.join(OUTPUT_FORMATS)}")
+
+    started = time.perf_counter()
+    scores = score_recordings(args.paths, args.model, args.workers, args.batch_rows)
+    elapsed = time.perf_counter() - started
+    write_scores(scores, args.output)
+
+    rows = int(scores["samples"].sum())
+    failed = int(scores["error"].notna().sum())
+    logger.info(f"Scored {len(scores) - failed} recordings ({rows} samples) in {elapsed:.2f}s: "
+                f"{rows / elapsed:.0f} rows/s, saved to {args.output}"
+                + (f", {failed} failed" if failed else ""))
@@ -0,0 +1,192 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict, deque
+from itertools import repeat
+from typing import Optional
+
+import numpy as np
+
+from metrics import record_cache
+from utils import NUMERIC_COLUMNS
+
+"""
+In-process caches for repeated and overlapping payloads. Devices retry uploads and resend overlapping
+windows: `ResultCache` returns the scored rows of a payload seen before without preprocessing or inference,
+and `RowCache` keeps the prediction of each feature vector, so only the rows never scored before reach
+`model.predict`. Both are bounded, and each worker process has its own.
+"""
+# Longest eye event a row cache key holds, enough for raw 'FEx..y..d..' events, longer ones are always scored
+ROW_KEY_EVENT_WIDTH = 32
+# Row hash parameters (64-bit FNV offset basis and golden ratio multiplier)
+_HASH_SEED = 0xCBF29CE484222325
+_HASH_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+
+
+def payload_digest(columns: dict, prev_euclidean_distance: Optional[float] = None) -> bytes:
+    """
+    Fast hash of canonical payload columns, identical for JSON and binary bodies of the same samples.
+    Args:
+        columns (dict): Columns as returned by `to_columns`.
+        prev_euclidean_distance (float, optional): Carried distance the payload is preprocessed with.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for key in NUMERIC_COLUMNS:
+        digest.update(np.ascontiguousarray(columns[key], dtype=np.float64).tobytes())
+    # Join the events instead of hashing the array, whose width depends on the longest value
+    digest.update("\x00".join(columns["eye_event"].tolist()).encode())
+    digest.update(repr(prev_euclidean_distance).encode())
+    return digest.digest()
+
+
+class ResultCache:
+    """
+    LRU of scored payloads with a memory budget and a time to live.
+    Entries are (batch_input, predictions) pairs: the preprocessed columns and the model output.
+    """
+
+    def __init__(self, max_bytes: int, ttl_s: float, name: str = "result"):
+        self.max_bytes = max_bytes
+        self.ttl_s = ttl_s
+        self.name = name
+        self.size = 0
+        self._entries: "OrderedDict[bytes, tuple]" = OrderedDict()  # key -> (expiry, size, value)
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def get(self, key: bytes):
+        """Return the cached value, or None if it is missing or expired."""
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] < time.monotonic():
+            self._remove(key)
+            entry = None
+        if entry is None:
+            record_cache(self.name, 0, 1, self.size, len(self._entries))
+            return None
+        self._entries.move_to_end(key)
+        record_cache(self.name, 1, 0, self.size, len(self._entries))
+        return entry[2]
+
+    def put(self, key: bytes, batch_input: dict, predictions: np.ndarray):
+        size = predictions.nbytes + sum(values.nbytes for values in batch_input.values())
+        if not self.enabled or size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (time.monotonic() + self.ttl_s, size, (batch_input, predictions))
+        self.size += size
+        # Make room by dropping the least recently used entries
+        while self.size > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+        record_cache(self.name, 0, 0, self.size, len(self._entries))
+
+    def clear(self):
+        self._entries.clear()
+        self.size = 0
+        record_cache(self.name, 0, 0, self.size, 0)
+
+    def _remove(self, key: bytes):
+        _, size, _ = self._entries.pop(key)
+        self.size -= size
+
+
+class RowCache:
+    """
+    Model predictions of recently scored feature vectors, in a ring of `max_rows` rows: once full, the oldest
+    rows are overwritten first. Lookups run in the thread pool, so the cache has its own lock.
+    """
+
+    def __init__(self, max_rows: int, name: str = "row"):
+        self.max_rows = max_rows
+        self.name = name
+        self._slots = {}  # feature vector hash -> row of the ring
+        self._slot_keys = np.full(max(max_rows, 0), None, dtype=object)  # ring row -> feature vector hash
+        self._predictions: Optional[np.ndarray] = None  # allocated on the first store
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._slots)
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_rows > 0
+
+    @staticmethod
+    def row_keys(batch_input: dict) -> list:
+        """
+        64-bit hash of the feature vector of every row, None for rows whose eye event is too long to be keyed.
+        Hashing whole columns with NumPy is much cheaper than building a bytes key per row, and with a
+        cache of a million rows the odds of a collision stay below one in ten million.
+        """
+        rows = len(batch_input["timestamp"])
+        # Every numeric column, including the rolling-window features of models that use them
+        words = [np.ascontiguousarray(values, dtype=np.float64).view(np.uint64)
+                 for key, values in batch_input.items() if key != "eye_event"]
+        eye_event = batch_input["eye_event"]
+        codes = np.ascontiguousarray(eye_event, dtype=f"<U{ROW_KEY_EVENT_WIDTH}").view(np.uint64)
+        words.extend(codes.reshape(rows, -1).T)
+
+        hashes = np.full(rows, _HASH_SEED, dtype=np.uint64)
+        for word in words:
+            hashes ^= word
+            hashes *= _HASH_MULTIPLIER
+            hashes ^= hashes >> np.uint64(31)
+        keys = hashes.tolist()
+        if eye_event.dtype.itemsize // 4 > ROW_KEY_EVENT_WIDTH:
+            too_long = np.char.str_len(eye_event) > ROW_KEY_EVENT_WIDTH
+            for index in np.flatnonzero(too_long).tolist():
+                keys[index] = None
+        return keys
+
+    def lookup(self, batch_input: dict, num_classes: int) -> tuple:
+        """
+        Args:
+            batch_input (dict): Preprocessed columns.
+            num_classes (int): Width of a prediction row.
+        Returns:
+            tuple: Row keys, predictions filled for the cached rows, and the positions of the rows to score.
+        """
+        keys = self.row_keys(batch_input)
+        predictions = np.empty((len(keys), num_classes), dtype=np.float32)
+        with self._lock:
+            slots = np.fromiter(map(self._slots.get, keys, repeat(-1)), dtype=np.int64, count=len(keys))
+            found = slots >= 0
+            if found.any():
+                predictions[found] = self._predictions[slots[found]]
+        missing = np.flatnonzero(~found)
+        record_cache(self.name, len(keys) - len(missing), len(missing), None, len(self._slots))
+        return keys, predictions, missing
+
+    def store(self, keys: list, predictions: np.ndarray, positions: np.ndarray):
+        """Remember the predictions of the freshly scored rows at `positions`."""
+        # One entry per distinct feature vector, rows cached meanwhile by a concurrent request are skipped
+        fresh = {keys[index]: row for row, index in enumerate(positions.tolist()) if keys[index] is not None}
+        with self._lock:
+            fresh_keys = [key for key in fresh if key not in self._slots][-self.max_rows:]
+            if not fresh_keys:
+                return
+            if self._predictions is None:
+                self._predictions = np.empty((self.max_rows, predictions.shape[1]), dtype=np.float32)
+            slots = (self._next + np.arange(len(fresh_keys))) % self.max_rows
+            self._next = int(slots[-1] + 1) % self.max_rows
+
+            # Overwrite the oldest rows of the ring
+            evicted = [key for key in self._slot_keys[slots].tolist() if key is not None]
+            deque(map(self._slots.pop, evicted), maxlen=0)
+            self._slot_keys[slots] = fresh_keys
+            self._slots.update(zip(fresh_keys, slots.tolist()))
+            self._predictions[slots] = predictions[[fresh[key] for key in fresh_keys]]
+        record_cache(self.name, 0, 0, None, len(self._slots))
+
+    def clear(self):
+        with self._lock:
+            self._slots.clear()
+            self._slot_keys[:] = None
+            self._next = 0
+        record_cache(self.name, 0, 0, None, 0)
@@ -0,0 +1,278 @@
+import zlib
+from typing import AsyncIterator, Iterator, Optional
+
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers, MutableHeaders
+
+from ingest import PayloadTooLarge
+
+try:
+    import zstandard
+except ImportError:  # zstd is optional, gzip is always available
+    zstandard = None
+
+"""
+Compressed transport. Request bodies sent with `Content-Encoding: gzip` or `zstd` are decompressed as they
+arrive, so the JSON reader still parses them chunk by chunk, and the request limits apply to the decompressed
+size. Responses are compressed with the best encoding the client lists in `Accept-Encoding`.
+"""
+GZIP_LEVEL = 5
+ZSTD_LEVEL = 3
+# Most decompressed bytes produced from one step of a gzip body
+GZIP_STEP = 1 << 18
+# Compressed bytes fed to the zstd decoder at once, and most decompressed bytes it hands over at once. A step can
+# expand a lot (1 KiB of zeros holds 32 MB), so the decoder checks the request limit as it writes, not after a step
+ZSTD_STEP = 1 << 14
+ZSTD_WRITE_SIZE = 1 << 18
+ZSTD_MAGIC = 0xFD2FB528
+# Skippable frames have any of the 16 magic numbers from this one
+ZSTD_SKIPPABLE_MAGIC = 0x184D2A50
+# Responses at least this large are compressed in the thread pool, off the event loop
+THREADED_BYTES = 1 << 16
+
+
+class UnsupportedEncoding(ValueError):
+    pass
+
+
+class InvalidEncoding(ValueError):
+    pass
+
+
+class GzipDecoder:
+    """Incremental gzip decoder, including bodies of several concatenated gzip members."""
+
+    def __init__(self):
+        self._decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        self._fed = False
+
+    def feed(self, data: bytes) -> Iterator[bytes]:
+        self._fed = self._fed or bool(data)
+        while data:
+            try:
+                decoded = self._decoder.decompress(data, GZIP_STEP)
+            except zlib.error as e:
+                raise InvalidEncoding(f"Invalid gzip body: {e}")
+            if decoded:
+                yield decoded
+            if self._decoder.eof:
+                data = self._decoder.unused_data
+                if data:
+                    self._decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            else:
+                data = self._decoder.unconsumed_tail
+
+    def close(self):
+        if self._fed and not self._decoder.eof:
+            raise InvalidEncoding("Truncated gzip body")
+
+
+class ZstdFrames:
+    """
+    Follows the frame and block headers of a zstd stream without decoding it, to tell whether the stream stops inside
+    a frame: the stream writer decoding the body does not say.
+    """
+
+    def __init__(self):
+        self._tail = b""  # start of a header split across chunks
+        self._skip = 0  # bytes of block content, checksum or skippable frame left to pass
+        self._in_blocks = False  # the next header is a block header rather than a frame header
+        self._checksum = 0  # bytes of the checksum after the last block of the frame
+
+    @property
+    def in_frame(self) -> bool:
+        return self._in_blocks or self._skip > 0 or bool(self._tail)
+
+    def feed(self, data: bytes):
+        data = self._tail + data if self._tail else data
+        pos = 0
+        while pos < len(data):
+            if self._skip:
+                passed = min(self._skip, len(data) - pos)
+                pos += passed
+                self._skip -= passed
+            elif self._in_blocks:
+                if len(data) - pos < 3:
+                    break
+                header = int.from_bytes(data[pos:pos + 3], "little")
+                pos += 3
+                # An RLE block holds one byte, the others their size
+                self._skip = 1 if (header >> 1) & 3 == 1 else header >> 3
+                if header & 1:  # last block
+                    self._skip += self._checksum
+                    self._in_blocks = False
+            else:
+                if len(data) - pos < 8:
+                    break
+                magic = int.from_bytes(data[pos:pos + 4], "little")
+                if magic & 0xFFFFFFF0 == ZSTD_SKIPPABLE_MAGIC:
+                    self._skip = int.from_bytes(data[pos + 4:pos + 8], "little")
+                    pos += 8
+                    continue
+                if magic != ZSTD_MAGIC:
+                    raise InvalidEncoding("Invalid zstd body: unknown frame")
+                descriptor = data[pos + 4]
+                single_segment = (descriptor >> 5) & 1
+                content_size = [single_segment, 2, 4, 8][descriptor >> 6]
+                size = 5 + (1 - single_segment) + [0, 1, 2, 4][descriptor & 3] + content_size
+                if len(data) - pos < size:
+                    break
+                pos += size
+                self._checksum = 4 if descriptor & 4 else 0
+                self._in_blocks = True
+        self._tail = data[pos:]
+
+
+class ZstdDecoder:
+    """Incremental zstd decoder, including bodies of several frames, refusing to write more than `max_bytes`."""
+
+    def __init__(self, max_bytes: int = 0):
+        self.max_bytes = max_bytes
+        self.produced = 0
+        self._decoded = []  # written by the decoder during the current step
+        self._writer = zstandard.ZstdDecompressor().stream_writer(self, write_size=ZSTD_WRITE_SIZE,
+                                                                  write_return_read=True, closefd=False)
+        self._frames = ZstdFrames()
+
+    def write(self, decoded: bytes) -> int:
+        """Sink of the decoder, called with at most `ZSTD_WRITE_SIZE` bytes at a time."""
+        self.produced += len(decoded)
+        if 0 < self.max_bytes < self.produced:
+            raise PayloadTooLarge(f"Decompressed request body is larger than {self.max_bytes} bytes")
+        self._decoded.append(decoded)
+        return len(decoded)
+
+    def feed(self, data: bytes) -> Iterator[bytes]:
+        for start in range(0, len(data), ZSTD_STEP):
+            step = data[start:start + ZSTD_STEP]
+            try:
+                self._writer.write(step)
+            except zstandard.ZstdError as e:
+                raise InvalidEncoding(f"Invalid zstd body: {e}")
+            self._frames.feed(step)
+            decoded, self._decoded = self._decoded, []
+            yield from decoded
+
+    def close(self):
+        if self._frames.in_frame:
+            raise InvalidEncoding("Truncated zstd body")
+
+
+def request_decoder(encoding: str, max_bytes: int = 0):
+    """
+    Decoder of a `Content-Encoding`, None for uncompressed bodies. A zstd decoder refuses to decompress more than
+    `max_bytes` (0 is unlimited), see `decompressed` for the other encodings.
+    Raises:
+        UnsupportedEncoding: The encoding is unknown, or zstd without the zstandard package.
+    """
+    encoding = encoding.strip().lower()
+    if encoding in ("", "identity"):
+        return None
+    if encoding in ("gzip", "x-gzip"):
+        return GzipDecoder()
+    if encoding == "zstd" and zstandard is not None:
+        return ZstdDecoder(max_bytes)
+    raise UnsupportedEncoding(f"Unsupported Content-Encoding {encoding}, use {' or '.join(request_encodings())}")
+
+
+def request_encodings() -> list:
+    return ["gzip", "zstd"] if zstandard is not None else ["gzip"]
+
+
+async def decompressed(stream: AsyncIterator[bytes], decoder, max_bytes: int) -> AsyncIterator[bytes]:
+    """
+    Decompressed chunks of a request body, raising `PayloadTooLarge` once the decompressed size exceeds
+    `max_bytes` (0 is unlimited) and `InvalidEncoding` for corrupt or truncated data.
+    """
+    produced = 0
+    async for chunk in stream:
+        for decoded in decoder.feed(chunk):
+            produced += len(decoded)
+            if 0 < max_bytes < produced:
+                raise PayloadTooLarge(f"Decompressed request body is larger than {max_bytes} bytes")
+            yield decoded
+    decoder.close()
+
+
+def response_encodings() -> tuple:
+    """Response encodings by preference, ties in the client's q-values go to the first one."""
+    return ("zstd", "gzip") if zstandard is not None else ("gzip",)
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """The response encoding the client prefers among the supported ones, None for no compression."""
+    weights = {}
+    for item in accept_encoding.split(","):
+        name, *parameters = [part.strip() for part in item.split(";")]
+        weight = 1.0
+        for parameter in parameters:
+            key, _, value = parameter.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        if name:
+            weights[name.lower()] = weight
+    default = weights.get("*", 0.0)
+    accepted = [encoding for encoding in response_encodings() if weights.get(encoding, default) > 0]
+    if not accepted:
+        return None
+    return max(accepted, key=lambda encoding: weights.get(encoding, default))
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(body)
+    return zlib.compress(body, GZIP_LEVEL, wbits=16 + zlib.MAX_WBITS)
+
+
+class CompressionMiddleware:
+    """
+    ASGI middleware compressing response bodies of at least `minimum_size` bytes with the encoding negotiated
+    from `Accept-Encoding`. The responses of this server are small and not streamed, so the body is buffered
+    and compressed in one piece.
+    """
+
+    def __init__(self, app, minimum_size: int):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or self.minimum_size <= 0:
+            await self.app(scope, receive, send)
+            return
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start = None
+        chunks = []
+
+        async def send_compressed(message):
+            nonlocal start
+            if message["type"] == "http.response.start":
+                start = message
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+            chunks.append(message.get("body", b""))
+            if message.get("more_body", False):
+                return
+
+            body = b"".join(chunks)
+            headers = MutableHeaders(raw=list(start.get("headers", [])))
+            if len(body) >= self.minimum_size and "content-encoding" not in headers:
+                if len(body) >= THREADED_BYTES:
+                    body = await run_in_threadpool(compress, body, encoding)
+                else:
+                    body = compress(body, encoding)
+                headers["Content-Encoding"] = encoding
+                headers["Content-Length"] = str(len(body))
+            headers.add_vary_header("Accept-Encoding")
+            await send({**start, "headers": headers.raw})
+            await send({"type": "http.response.body", "body": body})
+
+        await self.app(scope, receive, send_compressed)
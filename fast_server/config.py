@@ -0,0 +1,74 @@
+import os
+
+"""
+Serving configuration, every value can be overridden with an environment variable
+"""
+# Directory of the YDF model to serve
+MODEL_PATH = os.environ.get("SEETRUE_MODEL_PATH", "model")
+# Versioned model registry (one model directory per version and a registry.json control file), enables hot
+# reload and canary traffic. Unset serves MODEL_PATH only
+MODEL_REGISTRY = os.environ.get("SEETRUE_MODEL_REGISTRY") or None
+# How often each worker checks the registry control file
+REGISTRY_POLL_S = float(os.environ.get("SEETRUE_REGISTRY_POLL_S", 5))
+# Bearer token required by the /models admin endpoints, which are disabled when it is unset
+ADMIN_TOKEN = os.environ.get("SEETRUE_ADMIN_TOKEN") or None
+# Server address, Cloud Run provides the port in $PORT
+HOST = os.environ.get("SEETRUE_HOST", "0.0.0.0")
+PORT = int(os.environ.get("PORT", 8080))
+# Worker processes forked after the model is loaded, 0 uses one per available core
+WORKERS = int(os.environ.get("SEETRUE_WORKERS", 0))
+# Rows of the synthetic batch used to warm the model up before reporting ready
+WARMUP_ROWS = int(os.environ.get("SEETRUE_WARMUP_ROWS", 1024))
+
+# Inference scheduler: largest merged batch and how long to wait for more requests
+MAX_BATCH_ROWS = int(os.environ.get("SEETRUE_MAX_BATCH_ROWS", 65536))
+MAX_WAIT_MS = float(os.environ.get("SEETRUE_MAX_WAIT_MS", 5))
+
+# Streaming sessions: memory budget in sessions and idle time before a session is evicted
+MAX_SESSIONS = int(os.environ.get("SEETRUE_MAX_SESSIONS", 10000))
+SESSION_IDLE_TIMEOUT_S = float(os.environ.get("SEETRUE_SESSION_IDLE_TIMEOUT_S", 300))
+# Sessions live in the worker process, so with several workers they are refused unless the load balancer routes
+# every request of a session to the same worker (set to 1)
+SESSION_AFFINITY = bool(int(os.environ.get("SEETRUE_SESSION_AFFINITY", 0)))
+
+# Timeline output: max number of windows a single /predict response may contain
+MAX_WINDOWS = int(os.environ.get("SEETRUE_MAX_WINDOWS", 10000))
+
+# Result cache: memory budget per worker (0 disables it) and time to live of a cached payload
+RESULT_CACHE_MB = float(os.environ.get("SEETRUE_RESULT_CACHE_MB", 64))
+RESULT_CACHE_TTL_S = float(os.environ.get("SEETRUE_RESULT_CACHE_TTL_S", 300))
+# Row cache: predictions kept per feature vector per worker, about 150 bytes each. Off by default (0), the lookup
+# costs roughly a third of the inference it saves, so it only pays off when many rows are resent
+ROW_CACHE_ROWS = int(os.environ.get("SEETRUE_ROW_CACHE_ROWS", 0))
+
+# Approximate /predict (tolerance query parameter): rows of the first sample, doubled until the means converge
+APPROX_MIN_ROWS = int(os.environ.get("SEETRUE_APPROX_MIN_ROWS", 1024))
+
+# Request limits: largest body and most samples of a single request, larger ones are refused with 413
+MAX_REQUEST_MB = float(os.environ.get("SEETRUE_MAX_REQUEST_MB", 128))
+MAX_REQUEST_ROWS = int(os.environ.get("SEETRUE_MAX_REQUEST_ROWS", 1000000))
+# Most samples over all the recordings of a /predict/batch request
+MAX_BATCH_REQUEST_ROWS = int(os.environ.get("SEETRUE_MAX_BATCH_REQUEST_ROWS", MAX_REQUEST_ROWS))
+# Samples a worker holds at once over all its requests (0 disables the budget), new requests get a 429 with
+# Retry-After while it is exceeded
+MAX_INFLIGHT_ROWS = int(os.environ.get("SEETRUE_MAX_INFLIGHT_ROWS", 2000000))
+RETRY_AFTER_S = int(os.environ.get("SEETRUE_RETRY_AFTER_S", 1))
+# Responses at least this large are compressed with the encoding negotiated from Accept-Encoding (gzip, or zstd with
+# the zstandard package), 0 disables response compression. Compressed request bodies are always accepted
+MIN_COMPRESS_BYTES = int(os.environ.get("SEETRUE_MIN_COMPRESS_BYTES", 1024))
+
+# Slow-request reports: requests slower than this (0 disables it) are written with a sampled CPU profile, stage
+# timings and payload shape to PROFILE_DIR, which keeps the last PROFILE_REPORTS of them. Admins can also profile
+# single requests with the X-Profile: 1 header. Stacks are sampled every PROFILE_INTERVAL_MS
+SLOW_REQUEST_S = float(os.environ.get("SEETRUE_SLOW_REQUEST_S", 0))
+PROFILE_DIR = os.environ.get("SEETRUE_PROFILE_DIR", "profiles")
+PROFILE_REPORTS = int(os.environ.get("SEETRUE_PROFILE_REPORTS", 50))
+PROFILE_INTERVAL_MS = float(os.environ.get("SEETRUE_PROFILE_INTERVAL_MS", 5))
+
+# YDF inference: threads per model.predict call, 0 picks the fastest count up to the worker's share of the cores
+# (cores / workers), and the engine, unset picks the fastest compatible one
+INFERENCE_THREADS = int(os.environ.get("SEETRUE_INFERENCE_THREADS", 0))
+INFERENCE_ENGINE = os.environ.get("SEETRUE_INFERENCE_ENGINE") or None
+# Startup self-benchmark choosing the settings above: time budget (0 skips it) and rows of its batch
+TUNING_S = float(os.environ.get("SEETRUE_TUNING_S", 2))
+TUNING_ROWS = int(os.environ.get("SEETRUE_TUNING_ROWS", 4096))
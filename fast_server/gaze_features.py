@@ -0,0 +1,184 @@
+from typing import Optional
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+"""
+Rolling-window gaze features, shared by training (data_processing/feature_engineering.py) and serving so the
+two cannot compute them differently. Every feature is computed over the last `window` samples of a recording,
+fewer at its start:
+
+    gaze_velocity     gaze path length over the window's steps divided by their time span, NaN for a zero span
+    gaze_dispersion   sqrt(var(gazepoint_x) + var(gazepoint_y))
+    pupil_mean        mean pupil area, averaged over both eyes
+    pupil_var         variance of the same
+    fixation_rate     share of the samples that begin a fixation (FB)
+    blink_rate        share of the samples that begin a blink (BB)
+
+A feature is NaN while the window holds a NaN input it depends on. `RollingWindow` keeps the last samples in ring
+buffers with running sums, so `update` costs O(1) per sample, and `extend` computes a whole batch at once,
+continuing from the samples already seen. `add` feeds the short chunks of a stream to `update` and the others to
+`extend`, the two agree up to rounding.
+"""
+ROLLING_FEATURES = ["gaze_velocity", "gaze_dispersion", "pupil_mean", "pupil_var", "fixation_rate", "blink_rate"]
+DEFAULT_WINDOW = 32
+# Chunks of a stream up to this many samples are added sample by sample, `extend` costs the same as about 6 updates
+UPDATE_ROWS = 4
+# Payload columns in the order of the arguments of `RollingWindow.update`
+_INPUTS = ["timestamp", "gazepoint_x", "gazepoint_y", "pupil_area_right_sq_mm", "pupil_area_left_sq_mm", "eye_event"]
+
+# Per-sample terms summed over the window, NaN inputs are counted apart and summed as 0
+_TERMS = ["step", "x", "x2", "y", "y2", "pupil", "pupil2", "fixation", "blink", "gaze_nan", "pupil_nan", "step_nan"]
+(_STEP, _X, _X2, _Y, _Y2, _PUPIL, _PUPIL2, _FIXATION, _BLINK, _GAZE_NAN, _PUPIL_NAN, _STEP_NAN) = range(len(_TERMS))
+# Code points stripped before reading the event type, the recordings pad the events with spaces
+_WHITESPACE = np.array([ord(char) for char in " \t\n\r\x0b\x0c"], dtype=np.uint32)
+
+
+def event_begins(eye_event: np.ndarray, prefix: str) -> np.ndarray:
+    """Vectorized `event.strip().startswith(prefix)`."""
+    values = np.asarray(eye_event, dtype=str)
+    if len(values) == 0:
+        return np.zeros(0, dtype=bool)
+    codes = values.view(np.uint32).reshape(len(values), -1)
+    start = np.argmax(~np.isin(codes, _WHITESPACE), axis=1)
+    codes = np.pad(codes, ((0, 0), (0, len(prefix))))
+    positions = start[:, None] + np.arange(len(prefix))
+    return (np.take_along_axis(codes, positions, axis=1) == [ord(char) for char in prefix]).all(axis=1)
+
+
+def _nan_to_zero(values: np.ndarray) -> np.ndarray:
+    return np.where(np.isnan(values), 0.0, values)
+
+
+class RollingWindow:
+    """Rolling-window features of one recording or stream, fed sample by sample or in batches."""
+
+    def __init__(self, window: int = DEFAULT_WINDOW):
+        """
+        Args:
+            window (int): Samples of the window.
+        """
+        self.window = window
+        self.count = 0  # samples seen
+        self._terms = np.zeros((window, len(_TERMS)))  # ring of the per-sample terms of the last samples
+        self._times = np.zeros(window + 1)  # ring of the last timestamps, one more for the span of the steps
+        self._sums = np.zeros(len(_TERMS))
+        self._last_gaze: Optional[tuple] = None
+
+    def update(self, timestamp: float, gazepoint_x: float, gazepoint_y: float, pupil_area_right_sq_mm: float,
+               pupil_area_left_sq_mm: float, eye_event: str) -> dict:
+        """Add one sample in O(1) and return its features."""
+        pupil = (pupil_area_right_sq_mm + pupil_area_left_sq_mm) / 2
+        gaze_nan = np.isnan(gazepoint_x) or np.isnan(gazepoint_y)
+        step, step_nan = 0.0, False
+        if self._last_gaze is not None:
+            step = float(np.hypot(gazepoint_x - self._last_gaze[0], gazepoint_y - self._last_gaze[1]))
+            step_nan = np.isnan(step)
+        self._last_gaze = (gazepoint_x, gazepoint_y)
+        event = eye_event.strip()
+        x, y = (0.0, 0.0) if gaze_nan else (gazepoint_x, gazepoint_y)
+        pupil_nan = np.isnan(pupil)
+        pupil = 0.0 if pupil_nan else pupil
+        terms = np.array([0.0 if step_nan else step, x, x * x, y, y * y, pupil, pupil * pupil,
+                          event.startswith("FB"), event.startswith("BB"), gaze_nan, pupil_nan, step_nan])
+
+        slot = self.count % self.window
+        self._sums += terms - self._terms[slot]
+        self._terms[slot] = terms
+        self._times[self.count % (self.window + 1)] = timestamp
+        self.count += 1
+        if slot == self.window - 1:
+            # Recompute the sums once per turn of the ring, so rounding errors cannot pile up
+            self._sums = self._terms.sum(axis=0)
+
+        n = min(self.count, self.window)
+        first_time = self._times[max(self.count - 1 - self.window, 0) % (self.window + 1)]
+        features = self._features(self._sums[None, :], np.array([n]), np.array([timestamp - first_time]))
+        return {name: float(values[0]) for name, values in features.items()}
+
+    def add(self, columns: dict) -> dict:
+        """Add a chunk of a stream with `update` when it is short, `extend` otherwise. Returns what `extend` does."""
+        if len(columns["timestamp"]) > UPDATE_ROWS:
+            return self.extend(columns)
+        samples = [self.update(*values) for values in zip(*(columns[key] for key in _INPUTS))]
+        return {name: np.array([sample[name] for sample in samples], dtype=np.float64) for name in ROLLING_FEATURES}
+
+    def extend(self, columns: dict) -> dict:
+        """
+        Add a batch of samples, vectorized over the columns.
+        Args:
+            columns (dict): Payload columns (timestamp, gazepoint_x/y, pupil areas and eye_event) of consecutive samples.
+        Returns:
+            dict: Feature name -> float64 array, one value per sample.
+        """
+        timestamps = np.asarray(columns["timestamp"], dtype=np.float64)
+        rows = len(timestamps)
+        if rows == 0:
+            return {name: np.empty(0) for name in ROLLING_FEATURES}
+        gaze_x = np.asarray(columns["gazepoint_x"], dtype=np.float64)
+        gaze_y = np.asarray(columns["gazepoint_y"], dtype=np.float64)
+        pupil = (np.asarray(columns["pupil_area_right_sq_mm"], dtype=np.float64)
+                 + np.asarray(columns["pupil_area_left_sq_mm"], dtype=np.float64)) / 2
+
+        steps = np.empty(rows)
+        steps[1:] = np.hypot(np.diff(gaze_x), np.diff(gaze_y))
+        if self._last_gaze is None:
+            steps[0] = 0.0
+        else:
+            steps[0] = np.hypot(gaze_x[0] - self._last_gaze[0], gaze_y[0] - self._last_gaze[1])
+        gaze_nan = np.isnan(gaze_x) | np.isnan(gaze_y)
+        step_nan = np.isnan(steps)
+        pupil_nan = np.isnan(pupil)
+        x, y = np.where(gaze_nan, 0.0, gaze_x), np.where(gaze_nan, 0.0, gaze_y)
+        pupil = _nan_to_zero(pupil)
+        terms = np.column_stack([
+            _nan_to_zero(steps), x, x * x, y, y * y, pupil, pupil * pupil,
+            event_begins(columns["eye_event"], "FB"), event_begins(columns["eye_event"], "BB"),
+            gaze_nan, pupil_nan, step_nan,
+        ])
+
+        # Window sums over the ring (zeros before the first sample) followed by the batch. Summing each window
+        # rather than differencing cumulative sums keeps the sums exact for long recordings and the same for
+        # any split of a recording into batches
+        ring = (self.count + np.arange(self.window)) % self.window
+        samples = np.concatenate([self._terms[ring], terms])
+        sums = sliding_window_view(samples, self.window, axis=0)[-rows:].sum(axis=-1)
+        counts = np.minimum(self.count + 1 + np.arange(rows), self.window)
+
+        # Span of the window's steps: from the sample before the window, or the first sample of the stream
+        time_history = min(self.count, self.window + 1)
+        time_ring = (self.count - time_history + np.arange(time_history)) % (self.window + 1)
+        times = np.concatenate([self._times[time_ring], timestamps])
+        positions = time_history + np.arange(rows)
+        spans = timestamps - times[np.maximum(positions - self.window, 0)]
+
+        # Keep the last samples for the next batch or update
+        kept = min(rows, self.window)
+        self._terms[(self.count + rows - kept + np.arange(kept)) % self.window] = terms[-kept:]
+        kept_times = min(rows, self.window + 1)
+        self._times[(self.count + rows - kept_times + np.arange(kept_times)) % (self.window + 1)] = timestamps[-kept_times:]
+        self._sums = self._terms.sum(axis=0)
+        self.count += rows
+        self._last_gaze = (gaze_x[-1], gaze_y[-1])
+        return self._features(sums, counts, spans)
+
+    @staticmethod
+    def _features(sums: np.ndarray, counts: np.ndarray, spans: np.ndarray) -> dict:
+        """Features of windows given their term sums (one row per window), sizes and step time spans."""
+        with np.errstate(divide="ignore", invalid="ignore"):
+            velocity = np.where(spans > 0, sums[:, _STEP] / spans, np.nan)
+            velocity[sums[:, _STEP_NAN] > 0] = np.nan
+            variance_x = np.maximum(sums[:, _X2] / counts - (sums[:, _X] / counts) ** 2, 0.0)
+            variance_y = np.maximum(sums[:, _Y2] / counts - (sums[:, _Y] / counts) ** 2, 0.0)
+            dispersion = np.where(sums[:, _GAZE_NAN] > 0, np.nan, np.sqrt(variance_x + variance_y))
+            pupil_mean = sums[:, _PUPIL] / counts
+            pupil_var = np.maximum(sums[:, _PUPIL2] / counts - pupil_mean ** 2, 0.0)
+            pupil_missing = sums[:, _PUPIL_NAN] > 0
+        return {
+            "gaze_velocity": velocity,
+            "gaze_dispersion": dispersion,
+            "pupil_mean": np.where(pupil_missing, np.nan, pupil_mean),
+            "pupil_var": np.where(pupil_missing, np.nan, pupil_var),
+            "fixation_rate": sums[:, _FIXATION] / counts,
+            "blink_rate": sums[:, _BLINK] / counts,
+        }
@@ -0,0 +1,777 @@
+import json
+import re
+import warnings
+from typing import AsyncIterator, Optional
+
+import numpy as np
+
+from metrics import ROWS_IN_FLIGHT
+from utils import NUMERIC_COLUMNS
+
+"""
+Streaming ingestion of /predict bodies. The JSON column arrays are parsed chunk by chunk as the body arrives,
+straight into NumPy buffers sized from the Content-Length, so a request never holds its whole body nor a Python
+list per column. Every request is bounded in bytes and samples, and each worker only admits new samples while
+the ones it already holds fit in its in-flight row budget.
+"""
+# Smallest JSON size of a sample over the six columns, sizes the column buffers from the Content-Length
+ESTIMATED_ROW_BYTES = 48
+# Column buffer size when the Content-Length is unknown, doubled as needed
+DEFAULT_CAPACITY = 4096
+# Column buffer size of the recordings of a batch, which are often short
+RECORDING_CAPACITY = 256
+# Recordings of a batch shorter than this are decoded at once by `json` when they are received whole, the
+# buffer is searched this far for their ends
+SHORT_RECORDING_BYTES = 65536
+# Numeric array segments shorter than this are parsed by `json` rather than NumPy, which costs more per call
+SMALL_SEGMENT_BYTES = 1024
+STRING_COLUMNS = ["eye_event"]
+
+_STRING = re.compile(rb'"(?:[^"\\]|\\.)*"')
+_WHITESPACE = b" \t\r\n"
+# Strings and numbers, decoded without looking at the rest of the buffer
+_SCALAR = re.compile(rb'"(?:[^"\\]|\\.)*"|-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?|-?Infinity|NaN|true|false|null')
+# Bytes that may continue a number, and most of them that may end a chunk
+_NUMBER_BYTES = b"0123456789.eE+-"
+_MAX_NUMBER_TAIL = 64
+_QUOTE, _BACKSLASH, _COMMA, _CLOSE, _OPEN_ARRAY, _OPEN_OBJECT, _CLOSE_OBJECT = (ord(char) for char in '"\\,][{}')
+
+# Byte classes of a JSON array of numbers, see `json_numbers`
+_OTHER, _SEPARATOR, _SPACE, _ZERO, _DIGIT, _DOT, _EXPONENT, _MINUS, _PLUS = range(9)
+_CLASSES = np.full(256, _OTHER, dtype=np.uint8)
+_CLASSES[ord(",")] = _SEPARATOR
+_CLASSES[list(_WHITESPACE)] = _SPACE
+_CLASSES[ord("0")] = _ZERO
+_CLASSES[list(b"123456789")] = _DIGIT
+_CLASSES[ord(".")] = _DOT
+_CLASSES[list(b"eE")] = _EXPONENT
+_CLASSES[ord("-")] = _MINUS
+_CLASSES[ord("+")] = _PLUS
+
+
+def _invalid_pair(first: int, second: int) -> bool:
+    """Whether a byte of class `second` cannot follow one of class `first` in JSON numbers, whitespace aside."""
+    digits = (_ZERO, _DIGIT)
+    return (_OTHER in (first, second)
+            or first == second == _SEPARATOR  # empty element
+            or first == _DOT and second not in digits or second == _DOT and first not in digits  # ".5", "5."
+            or second == _EXPONENT and first not in digits
+            or first in (_MINUS, _PLUS) and second not in digits
+            or second == _PLUS and first != _EXPONENT)  # "+1"
+
+
+_INVALID_PAIRS = np.array([[_invalid_pair(first, second) for second in range(16)] for first in range(16)]).ravel()
+
+# Parser states
+_START, _FIRST_KEY, _KEY, _COLON, _VALUE, _ARRAY, _SKIP, _NEXT, _DONE = range(9)
+# Parser states of the 'recordings' array of a batch
+_FIRST_RECORDING, _RECORDING, _IN_RECORDING, _AFTER_RECORDING = range(9, 13)
+# Parser states of an array or object element of a column, which is decoded on its own
+_ELEMENT, _AFTER_ELEMENT = range(13, 15)
+
+
+class PayloadTooLarge(Exception):
+    """The request is over the per-request byte or sample limit (HTTP 413)."""
+
+
+class OverBudget(Exception):
+    """The worker holds too many samples to admit the request now (HTTP 429)."""
+
+
+class InvalidPayload(ValueError):
+    """The body is not a valid payload, `errors` are in the format of pydantic validation errors."""
+
+    def __init__(self, errors: list):
+        super().__init__(errors[0]["msg"])
+        self.errors = errors
+
+
+class RowBudget:
+    """
+    Samples held by the requests of this worker, from ingestion until they are answered. Requests are served by
+    the event loop, so the budget needs no lock.
+    """
+
+    def __init__(self, max_rows: int):
+        """
+        Args:
+            max_rows (int): In-flight samples of the worker, 0 disables the budget.
+        """
+        self.max_rows = max_rows
+        self.rows = 0
+
+    @property
+    def full(self) -> bool:
+        return 0 < self.max_rows <= self.rows
+
+    def reserve(self, rows: int, held: int = 0):
+        """
+        Hold `rows` more samples for a request already holding `held`. A request is always admitted when the
+        worker holds nothing else, so a request larger than the budget is slow rather than refused forever.
+        """
+        others = self.rows - held
+        if self.max_rows > 0 and others > 0 and others + held + rows > self.max_rows:
+            raise OverBudget(f"Server is over its budget of {self.max_rows} in-flight samples, retry later")
+        self.rows += rows
+        ROWS_IN_FLIGHT.set(self.rows)
+
+    def release(self, rows: int):
+        self.rows -= rows
+        ROWS_IN_FLIGHT.set(self.rows)
+
+
+async def limited(stream: AsyncIterator[bytes], max_bytes: int) -> AsyncIterator[bytes]:
+    """Chunks of a request body, raising `PayloadTooLarge` once more than `max_bytes` arrived (0 is unlimited)."""
+    received = 0
+    async for chunk in stream:
+        received += len(chunk)
+        if 0 < max_bytes < received:
+            raise PayloadTooLarge(f"Request body is larger than {max_bytes} bytes")
+        yield chunk
+
+
+def json_error(position: int, error: str) -> InvalidPayload:
+    return InvalidPayload([{"type": "json_invalid", "loc": ("body", position), "msg": "JSON decode error",
+                            "input": {}, "ctx": {"error": error}}])
+
+
+def check_lengths(columns: dict):
+    """
+    Raise `InvalidPayload` unless every column has as many values as 'timestamp', requests are merged column
+    by column for inference.
+    """
+    rows = len(columns["timestamp"])
+    errors = [{"type": "value_error", "loc": ("body", key),
+               "msg": f"Value error, {key} has {len(values)} values but timestamp has {rows}", "input": None}
+              for key, values in columns.items() if len(values) != rows]
+    if errors:
+        raise InvalidPayload(errors)
+
+
+def json_numbers(segment: bytes) -> bool:
+    """
+    Whether comma separated numbers are valid JSON. NumPy parses them like strtod, which also takes ".5", "+1",
+    "01" or "inf", and reads an empty element as -1.
+    """
+    classes = np.take(_CLASSES, np.frombuffer(b"," + segment + b",", dtype=np.uint8))
+    classes = classes[classes != _SPACE]
+    pairs = classes[:-1] * np.uint8(16) + classes[1:]
+    if np.take(_INVALID_PAIRS, pairs).any():
+        return False
+    # Leading zeros of the integer part, exponents may have some ("1e-05")
+    zeros = np.flatnonzero((pairs == _SEPARATOR * 16 + _ZERO) | (pairs == _MINUS * 16 + _ZERO)) + 1
+    zeros = zeros[(classes[zeros + 1] == _ZERO) | (classes[zeros + 1] == _DIGIT)]
+    return not ((classes[zeros - 1] == _SEPARATOR) | (classes[zeros - 2] != _EXPONENT)).any()
+
+
+def decode_value(buffer: bytes, pos: int, final: bool) -> Optional[tuple]:
+    """
+    Decode the JSON value starting at `pos`, reading no further than its end.
+    Returns:
+        tuple: The value and the position after it, None when it may go on in the next chunk.
+    Raises:
+        ValueError: The value is invalid, or incomplete when `final`.
+    """
+    match = _SCALAR.match(buffer, pos)
+    if match is not None:
+        end = match.end()
+        tail = buffer[end:end + _MAX_NUMBER_TAIL]
+        if not final and len(tail) < _MAX_NUMBER_TAIL and not tail.lstrip(_NUMBER_BYTES):
+            return None  # a number may go on in the next chunk, e.g. "2." decodes as 2
+        return json.loads(match.group()), end
+    if buffer[pos:pos + 1] in (b"{", b"["):
+        size = DEFAULT_CAPACITY
+        while True:
+            ends = value_ends(buffer, pos, size)
+            if len(ends):
+                return json.loads(buffer[pos:ends[0]]), int(ends[0])
+            if pos + size >= len(buffer):
+                break
+            size *= 4
+    # An unterminated string or container, or the start of a literal
+    if final or buffer[pos:pos + 1] not in b'"{[' and len(buffer) - pos >= _MAX_NUMBER_TAIL:
+        raise ValueError("invalid or incomplete value")
+    return None
+
+
+def cut_elements(buffer: bytes, pos: int) -> Optional[tuple]:
+    """
+    Find where the complete elements of the array starting at `pos` end, without decoding them.
+    Returns:
+        tuple: Position of the closing bracket and True, or of the last separator and False while the array
+            continues in the next chunk. None when no element is complete yet.
+    """
+    end = buffer.find(b"]", pos)
+    if buffer.find(b'"', pos, end if end >= 0 else len(buffer)) < 0:
+        # Numbers only, the first bracket closes the array
+        if end >= 0:
+            return end, True
+        comma = buffer.rfind(b",", pos)
+        return (comma, False) if comma >= 0 else None
+
+    # Strings: only brackets and commas outside of them count. The scan stops at a bracket, or at a later one
+    # when it was in a string, so short arrays do not cost the rest of the buffer
+    while 0 <= end < len(buffer) - 1:
+        cut = _cut_strings(buffer, pos, end + 1)
+        if cut is not None and cut[1]:
+            return cut
+        end = buffer.find(b"]", max(end + 1, 2 * end - pos))
+    return _cut_strings(buffer, pos, len(buffer))
+
+
+def first_container(buffer: bytes, pos: int, stop: int) -> int:
+    """Position of the first `[` or `{` outside strings in `buffer[pos:stop]`, -1 if there is none."""
+    region = buffer[pos:stop]
+    if b"[" not in region and b"{" not in region:
+        return -1
+    data = np.frombuffer(buffer, dtype=np.uint8)[pos:stop]
+    found = np.flatnonzero(((data == _OPEN_ARRAY) | (data == _OPEN_OBJECT)) & _outside_strings(data))
+    return pos + int(found[0]) if len(found) else -1
+
+
+def _outside_strings(data: np.ndarray) -> np.ndarray:
+    """Mask of the bytes of JSON text that are not in a string."""
+    quotes = data == _QUOTE
+    backslashes = np.flatnonzero(data == _BACKSLASH)
+    if len(backslashes):
+        escaped = np.zeros(len(data), dtype=bool)
+        for index in backslashes.tolist():
+            if not escaped[index] and index + 1 < len(data):
+                escaped[index + 1] = True
+        quotes &= ~escaped
+    return ~np.logical_xor.accumulate(quotes)
+
+
+def _cut_strings(buffer: bytes, pos: int, stop: int) -> Optional[tuple]:
+    """`cut_elements` of an array of strings, within `buffer[pos:stop]`."""
+    data = np.frombuffer(buffer, dtype=np.uint8)[pos:stop]
+    outside = _outside_strings(data)
+    closing = np.flatnonzero((data == _CLOSE) & outside)
+    if len(closing):
+        return pos + int(closing[0]), True
+    commas = np.flatnonzero((data == _COMMA) & outside)
+    return (pos + int(commas[-1]), False) if len(commas) else None
+
+
+def value_ends(buffer: bytes, pos: int, max_bytes: int) -> np.ndarray:
+    """
+    Positions after the objects or arrays that follow each other from `pos` (e.g. the elements of an array),
+    without decoding them. Only the ends within `max_bytes` of `pos` are found.
+    """
+    data = np.frombuffer(buffer, dtype=np.uint8)[pos:pos + max_bytes]
+    outside = _outside_strings(data)
+    opening = ((data == _OPEN_OBJECT) | (data == _OPEN_ARRAY)) & outside
+    closing = ((data == _CLOSE_OBJECT) | (data == _CLOSE)) & outside
+    depth = np.cumsum(opening.astype(np.int8) - closing, dtype=np.int32)
+    return pos + np.flatnonzero(closing & (depth == 0)) + 1
+
+
+class NumericBuffer:
+    """Preallocated float64 column, doubled when a payload has more samples than estimated."""
+
+    def __init__(self, capacity: int):
+        self.values = np.empty(capacity, dtype=np.float64)
+        self.size = 0
+
+    def extend(self, values: np.ndarray):
+        end = self.size + len(values)
+        if end > len(self.values):
+            grown = np.empty(max(end, 2 * len(self.values)), dtype=np.float64)
+            grown[:self.size] = self.values[:self.size]
+            self.values = grown
+        self.values[self.size:end] = values
+        self.size = end
+
+    def result(self) -> np.ndarray:
+        # Do not keep a mostly empty buffer alive when the estimate was far off
+        values = self.values[:self.size]
+        return values.copy() if self.size < len(self.values) // 2 else values
+
+
+class JsonObjectReader:
+    """
+    Incremental parser of a JSON object: feed it the body chunks as they arrive, then `close` it. Subclasses parse
+    the values of the keys they know in `_value`, the values of the other keys are skipped. Like `json.loads`, the
+    last occurrence of a repeated key wins, so subclasses only report the errors of an earlier one if none follows.
+    """
+    nested = False  # stop after the object, for the recordings of a batch
+
+    def __init__(self):
+        self._buffer = b""
+        self._consumed = 0  # bytes of the body before `_buffer`
+        self._state = _START
+        self._key = None
+
+    def feed(self, chunk: bytes):
+        buffer = self._buffer + chunk if self._buffer else bytes(chunk)
+        pos = self._parse(buffer, final=False)
+        self._buffer = buffer[pos:]
+        self._consumed += pos
+
+    def _close(self):
+        pos = self._parse(self._buffer, final=True)
+        if self._state != _DONE:
+            raise json_error(self._consumed + pos, "EOF while parsing")
+
+    def _parse(self, buffer: bytes, final: bool, pos: int = 0) -> int:
+        """Consume what `buffer` completes from `pos`, returns the position of the first unconsumed byte."""
+        while True:
+            while pos < len(buffer) and buffer[pos] in _WHITESPACE:
+                pos += 1
+            if pos == len(buffer) or self._state == _DONE and self.nested:
+                return pos
+            state = self._state
+            char = buffer[pos:pos + 1]
+            if state == _START:
+                self._expect(char, b"{", pos)
+                pos += 1
+                state = _FIRST_KEY
+            elif state in (_FIRST_KEY, _KEY):
+                if char == b"}" and state == _FIRST_KEY:
+                    pos += 1
+                    state = _DONE
+                else:
+                    self._expect(char, b'"', pos)
+                    match = _STRING.match(buffer, pos)
+                    if match is None:
+                        return pos
+                    self._key = self._items_of(match.group(), self._consumed + pos)[0]
+                    pos = match.end()
+                    state = _COLON
+            elif state == _COLON:
+                self._expect(char, b":", pos)
+                pos += 1
+                state = _VALUE
+            elif state == _SKIP:
+                try:
+                    decoded = decode_value(buffer, pos, final)
+                except ValueError:
+                    raise json_error(self._consumed + pos, f"invalid value of {self._key}")
+                if decoded is None:
+                    return pos
+                self._skipped(decoded[0])
+                pos = decoded[1]
+                state = _NEXT
+            elif state == _NEXT:
+                if char not in (b",", b"}"):
+                    raise json_error(self._consumed + pos, "expected `,` or `}`")
+                pos += 1
+                state = _KEY if char == b"," else _DONE
+            elif state == _DONE:
+                raise json_error(self._consumed + pos, "trailing characters")
+            else:
+                step = self._value(buffer, pos, state, final)
+                if step is None:
+                    return pos
+                pos, state = step
+            self._state = state
+
+    def _value(self, buffer: bytes, pos: int, state: int, final: bool) -> Optional[tuple]:
+        """
+        Parse from `pos` in the `_VALUE` state, and in the states the subclass moves on to.
+        Returns:
+            tuple: The next position and state (`_SKIP` for the values to ignore, `_NEXT` once the value is
+                parsed), None to wait for more of the body.
+        """
+        return pos, _SKIP
+
+    def _skipped(self, value):
+        """Called with the value of a key that is skipped."""
+
+    def _expect(self, char: bytes, expected: bytes, pos: int):
+        if char != expected:
+            raise json_error(self._consumed + pos, f"expected `{expected.decode()}`")
+
+    @staticmethod
+    def _items_of(segment: bytes, position: int) -> list:
+        try:
+            return json.loads(b"[" + segment + b"]")
+        except ValueError as e:
+            raise json_error(position, str(e))
+
+
+class JsonColumnReader(JsonObjectReader):
+    """
+    Incremental parser of a JSON `DataBatches` body: an object of column arrays. Feed it the body chunks as they
+    arrive, then `close` it to get the columns. It accepts what `json.loads` and pydantic accept (numbers as JSON
+    strings, repeated keys whose last occurrence is valid, unknown keys) and reports errors in the same format.
+    """
+
+    def __init__(self, budget: RowBudget, max_rows: int, content_length: int = 0, nested: bool = False,
+                 scalars: tuple = ()):
+        """
+        Args:
+            budget (RowBudget): In-flight budget the parsed samples are reserved in.
+            max_rows (int): Most samples of a column, 0 is unlimited.
+            content_length (int): Body size if known, to preallocate the column buffers.
+            nested (bool): Parse a recording of a batch body, see `BatchReader`: stop after the object and leave
+                the validation errors in `errors` rather than raising them from `close`.
+            scalars (tuple): Other keys whose values are kept in `scalars`, e.g. the id of a recording.
+        """
+        super().__init__()
+        self.budget = budget
+        self.max_rows = max_rows
+        self.reserved = 0
+        if content_length:
+            estimate = content_length // ESTIMATED_ROW_BYTES
+        else:
+            estimate = RECORDING_CAPACITY if nested else DEFAULT_CAPACITY
+        self.capacity = max(min(estimate, max_rows or estimate), 1)
+        self.nested = nested
+        self.location = () if nested else ("body",)  # start of the `loc` of the validation errors
+        self._errors = {}  # key -> validation errors of its last occurrence
+        self.scalar_keys = scalars
+        self.scalars = {}
+        self.columns = {}
+        self._items = 0  # elements of the current array
+
+    def close(self) -> dict:
+        """
+        Returns:
+            dict: float64 arrays for the numeric columns and a str array for 'eye_event', empty when missing.
+        Raises:
+            InvalidPayload: The body is incomplete, has invalid values, or its columns have different lengths.
+        """
+        self._close()
+        return self.result()
+
+    @property
+    def errors(self) -> list:
+        """Validation errors of the last occurrence of each key."""
+        return [error for errors in self._errors.values() for error in errors]
+
+    def result(self) -> dict:
+        """The columns of the parsed object, see `close`."""
+        if self._errors:
+            raise InvalidPayload(self.errors)
+        columns = {key: np.empty(0, dtype=np.float64) for key in NUMERIC_COLUMNS}
+        columns["eye_event"] = np.empty(0, dtype=str)
+        for key, values in self.columns.items():
+            if key in STRING_COLUMNS:
+                columns[key] = np.concatenate(values) if len(values) > 1 else (values[0] if values else columns[key])
+            else:
+                columns[key] = values.result()
+        self.columns = {}
+        check_lengths(columns)
+        return columns
+
+    def release(self):
+        """Give back the samples reserved by the request."""
+        self.budget.release(self.reserved)
+        self.reserved = 0
+
+    def _value(self, buffer: bytes, pos: int, state: int, final: bool) -> Optional[tuple]:
+        char = buffer[pos:pos + 1]
+        if state == _VALUE:
+            if self._key not in NUMERIC_COLUMNS and self._key not in STRING_COLUMNS:
+                return pos, _SKIP
+            self._replace()
+            if char != b"[":
+                self._invalid([{"type": "list_type", "loc": (*self.location, self._key),
+                                "msg": "Input should be a valid list", "input": None}])
+                return pos, _SKIP
+            self._start_array()
+            return pos + 1, _ARRAY
+        if state == _ELEMENT:
+            try:
+                decoded = decode_value(buffer, pos, final)
+            except ValueError:
+                raise json_error(self._consumed + pos, f"invalid element of {self._key}")
+            if decoded is None:
+                return None
+            self._add(self._strings([decoded[0]]) if self._key in STRING_COLUMNS else self._floats([decoded[0]]))
+            return decoded[1], _AFTER_ELEMENT
+        if state == _AFTER_ELEMENT:
+            if char not in (b",", b"]"):
+                raise json_error(self._consumed + pos, "expected `,` or `]`")
+            return pos + 1, _ARRAY if char == b"," else _NEXT
+
+        cut = cut_elements(buffer, pos)
+        if cut is None:
+            return None
+        end, closed = cut
+        # An array or object element is invalid, and its brackets and commas are not the column's: the elements
+        # before it are added, then it is decoded on its own
+        opener = first_container(buffer, pos, end)
+        if opener >= 0:
+            before = buffer[pos:opener].rstrip(_WHITESPACE)
+            if before:
+                if not before.endswith(b","):
+                    raise json_error(self._consumed + opener, "expected `,` or `]`")
+                if not before[:-1].strip(_WHITESPACE):
+                    raise json_error(self._consumed + opener, "expected value")
+                self._append(before[:-1], self._consumed + pos)
+            return opener, _ELEMENT
+        segment = buffer[pos:end]
+        if segment.strip(_WHITESPACE):
+            self._append(segment, self._consumed + pos)
+        elif self._items or not closed:
+            raise json_error(self._consumed + end, "expected value")
+        return end + 1, _NEXT if closed else _ARRAY
+
+    def _skipped(self, value):
+        if self._key in self.scalar_keys:
+            self.scalars[self._key] = value
+
+    def _invalid(self, errors: list):
+        """Keep validation errors of the current key until the end of the object, another occurrence drops them."""
+        self._errors.setdefault(self._key, []).extend(errors)
+
+    def add_object(self, document: dict):
+        """
+        Take an object decoded at once instead of parsing its text, e.g. a short recording of a batch. Its values
+        are validated like the parsed ones.
+        """
+        for self._key, value in document.items():
+            if self._key not in NUMERIC_COLUMNS and self._key not in STRING_COLUMNS:
+                self._skipped(value)
+            elif not isinstance(value, list):
+                self._invalid([{"type": "list_type", "loc": (*self.location, self._key),
+                                "msg": "Input should be a valid list", "input": value}])
+            else:
+                self._start_array(len(value))
+                if value:
+                    self._add(self._strings(value) if self._key in STRING_COLUMNS else self._floats(value))
+        self._state = _DONE
+
+    def _replace(self):
+        """Forget an earlier occurrence of the current key, its errors and samples: the last occurrence wins."""
+        self._errors.pop(self._key, None)
+        if self.columns.pop(self._key, None) is not None:
+            rows = max((values.size if isinstance(values, NumericBuffer) else sum(map(len, values))
+                        for values in self.columns.values()), default=0)
+            if rows < self.reserved:
+                self.budget.release(self.reserved - rows)
+                self.reserved = rows
+
+    def _start_array(self, capacity: int = 0):
+        if self._key in STRING_COLUMNS:
+            self.columns[self._key] = []
+        else:
+            self.columns[self._key] = NumericBuffer(capacity or self.capacity)
+        self._items = 0
+
+    def _append(self, segment: bytes, position: int):
+        """Parse complete array elements and add them to the current column."""
+        if self._key in STRING_COLUMNS:
+            self._add(self._strings(self._items_of(segment, position)))
+        else:
+            self._add(self._numbers(segment, position))
+
+    def _add(self, values: np.ndarray):
+        self._reserve(self._items + len(values))
+        if self._key in STRING_COLUMNS:
+            self.columns[self._key].append(values)
+        else:
+            self.columns[self._key].extend(values)
+        self._items += len(values)
+
+    def _strings(self, items: list) -> np.ndarray:
+        if set(map(type, items)) - {str}:
+            index = next(index for index, item in enumerate(items) if type(item) is not str)
+            self._invalid([{"type": "string_type", "loc": (*self.location, self._key, self._items + index),
+                            "msg": "Input should be a valid string", "input": items[index]}])
+            items = [item if type(item) is str else "" for item in items]
+        return np.array(items, dtype=str)
+
+    def _numbers(self, segment: bytes, position: int) -> np.ndarray:
+        if b'"' not in segment and len(segment) >= SMALL_SEGMENT_BYTES:
+            try:
+                with warnings.catch_warnings():
+                    # NumPy only warns when it stops before the end of the text
+                    warnings.simplefilter("error", DeprecationWarning)
+                    values = np.fromstring(segment, dtype=np.float64, sep=",")
+                if len(values) == segment.count(b",") + 1 and json_numbers(segment):
+                    return values
+            except (DeprecationWarning, ValueError):
+                pass
+        # Anything else is converted like pydantic does, e.g. numbers sent as strings
+        return self._floats(self._items_of(segment, position))
+
+    def _floats(self, items: list) -> np.ndarray:
+        if set(map(type, items)) <= {int, float}:
+            return np.array(items, dtype=np.float64)
+        values = np.empty(len(items), dtype=np.float64)
+        for index, item in enumerate(items):
+            try:
+                if not isinstance(item, (int, float, str)):
+                    raise TypeError
+                values[index] = float(item)
+            except (TypeError, ValueError):
+                parsing = isinstance(item, str)
+                self._invalid([{
+                    "type": "float_parsing" if parsing else "float_type",
+                    "loc": (*self.location, self._key, self._items + index),
+                    "msg": "Input should be a valid number" + (", unable to parse string as a number" if parsing else ""),
+                    "input": item,
+                }])
+                values[index:] = np.nan
+                break
+        return values
+
+    def _reserve(self, rows: int):
+        """Check the sample limit and grow the reservation to the longest column so far."""
+        if 0 < self.max_rows < rows:
+            raise PayloadTooLarge(f"Payload has more than {self.max_rows} samples")
+        if rows > self.reserved:
+            self.budget.reserve(rows - self.reserved, held=self.reserved)
+            self.reserved = rows
+
+
+class BatchBudget:
+    """The in-flight budget as seen by the recordings of a batch, which hold at most `max_rows` samples together."""
+
+    def __init__(self, budget: RowBudget, max_rows: int):
+        self.budget = budget
+        self.max_rows = max_rows
+        self.rows = 0
+
+    def reserve(self, rows: int, held: int = 0):
+        if 0 < self.max_rows < self.rows + rows:
+            raise PayloadTooLarge(f"Batch has more than {self.max_rows} samples")
+        self.budget.reserve(rows, held=self.rows)
+        self.rows += rows
+
+    def release(self, rows: int):
+        self.budget.release(rows)
+        self.rows -= rows
+
+
+class BatchReader(JsonObjectReader):
+    """
+    Incremental parser of a /predict/batch body: an object whose 'recordings' are `DataBatches` objects with an
+    'id' and a 'prev_euclidean_distance'. Each recording is parsed by its own nested `JsonColumnReader` and an
+    invalid one only fails itself. The samples are reserved as they are parsed, so a batch over its sample limit
+    is refused before it is read whole.
+    """
+
+    def __init__(self, budget: RowBudget, max_rows: int):
+        """
+        Args:
+            budget (RowBudget): In-flight budget the parsed samples are reserved in.
+            max_rows (int): Most samples over all the recordings, 0 is unlimited.
+        """
+        super().__init__()
+        self.budget = BatchBudget(budget, max_rows)
+        self.recordings = None  # None until the 'recordings' key
+        self._invalid_recordings = False  # the last 'recordings' is not a list
+        self._reader = None  # of the recording being parsed
+        self._ends = None  # buffer and ends of the next recordings found in it by `value_ends`
+
+    @property
+    def reserved(self) -> int:
+        return self.budget.rows
+
+    def close(self) -> list:
+        """
+        Returns:
+            list: (recording id, payload columns, previous Euclidean distance, error) of every recording,
+                columns is None for the recordings that were rejected.
+        Raises:
+            InvalidPayload: The body is not a JSON object with a list of recordings.
+        """
+        self._close()
+        if self._invalid_recordings:
+            raise InvalidPayload([{"type": "list_type", "loc": ("body", "recordings"),
+                                   "msg": "Input should be a valid list", "input": None}])
+        if self.recordings is None:
+            raise InvalidPayload([{"type": "missing", "loc": ("body", "recordings"), "msg": "Field required",
+                                   "input": None}])
+        return self.recordings
+
+    def release(self):
+        """Give back the samples reserved by the request."""
+        self.budget.release(self.budget.rows)
+
+    def _value(self, buffer: bytes, pos: int, state: int, final: bool) -> Optional[tuple]:
+        char = buffer[pos:pos + 1]
+        if state == _VALUE:
+            if self._key != "recordings":
+                return pos, _SKIP
+            # The last occurrence of a repeated key wins, an invalid one is only refused at `close`
+            self.release()
+            self._invalid_recordings = char != b"["
+            if self._invalid_recordings:
+                self.recordings = None
+                return pos, _SKIP
+            self.recordings = []
+            return pos + 1, _FIRST_RECORDING
+        if state == _FIRST_RECORDING:
+            return (pos + 1, _NEXT) if char == b"]" else (pos, _RECORDING)
+        if state == _RECORDING:
+            if char == b"{":
+                self._reader = JsonColumnReader(self.budget, 0, nested=True, scalars=("id", "prev_euclidean_distance"))
+                end = self._recording_end(buffer, pos)
+                if end is None or end - pos > SHORT_RECORDING_BYTES:
+                    return pos, _IN_RECORDING
+                # Short recordings already received are decoded at once, which is faster
+                try:
+                    document = json.loads(buffer[pos:end])
+                except ValueError as e:
+                    raise json_error(self._consumed + pos + getattr(e, "pos", 0), str(e))
+                self._reader.add_object(document)
+                self.recordings.append(self._recording(self._reader))
+                self._reader = None
+                return end, _AFTER_RECORDING
+            try:
+                decoded = decode_value(buffer, pos, final)
+            except ValueError:
+                raise json_error(self._consumed + pos, "invalid recording")
+            if decoded is None:
+                return None
+            self.recordings.append((None, None, None, "Invalid recording: Input should be a valid dictionary or "
+                                                      "instance of Recording"))
+            return decoded[1], _AFTER_RECORDING
+        if state == _IN_RECORDING:
+            self._reader._consumed = self._consumed
+            end = self._reader._parse(buffer, final, pos)
+            if self._reader._state != _DONE:
+                # The reader consumed what it could of the recording
+                return (end, _IN_RECORDING) if end > pos else None
+            self.recordings.append(self._recording(self._reader))
+            self._reader = None
+            return end, _AFTER_RECORDING
+        if char not in (b",", b"]"):
+            raise json_error(self._consumed + pos, "expected `,` or `]`")
+        return (pos + 1, _RECORDING) if char == b"," else (pos + 1, _NEXT)
+
+    def _recording_end(self, buffer: bytes, pos: int) -> Optional[int]:
+        """Position after the recording starting at `pos`, None when it does not end soon enough in the buffer."""
+        # The ends of the next recordings are found at once
+        if self._ends is not None and self._ends[0] is buffer:
+            index = np.searchsorted(self._ends[1], pos, side="right")
+            if index < len(self._ends[1]):
+                return int(self._ends[1][index])
+        ends = value_ends(buffer, pos, SHORT_RECORDING_BYTES)
+        self._ends = (buffer, ends)
+        return int(ends[0]) if len(ends) else None
+
+    @staticmethod
+    def _recording(reader: JsonColumnReader) -> tuple:
+        """The recording parsed by `reader`, its samples are given back if it is invalid."""
+        errors = list(reader.errors)
+        recording_id = reader.scalars.get("id")
+        if recording_id is not None and not isinstance(recording_id, str):
+            errors.append({"loc": ("id",), "msg": "Input should be a valid string"})
+            recording_id = None
+        prev_euclidean_distance = reader.scalars.get("prev_euclidean_distance")
+        if prev_euclidean_distance is not None:
+            try:
+                if not isinstance(prev_euclidean_distance, (int, float, str)):
+                    raise TypeError
+                prev_euclidean_distance = float(prev_euclidean_distance)
+            except (TypeError, ValueError):
+                errors.append({"loc": ("prev_euclidean_distance",), "msg": "Input should be a valid number"})
+        error = None
+        if errors:
+            error = "Invalid recording: " + "; ".join(f"{'.'.join(map(str, error['loc']))}: {error['msg']}"
+                                                      for error in errors)
+        else:
+            try:
+                columns = reader.result()
+            except InvalidPayload:
+                error = "The columns of the recording have different lengths"
+        if error is not None:
+            reader.release()
+            return recording_id, None, None, error
+        return recording_id, columns, prev_euclidean_distance, None
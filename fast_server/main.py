@@ -1,28 +1,109 @@
+import hmac
+import json
+import time
 import traceback
-from typing import List
+from contextlib import asynccontextmanager, contextmanager
+from statistics import NormalDist
+from typing import List, Optional
 
-import uvicorn
-import ydf
-from fastapi import FastAPI, status, Response
+import numpy as np
+from fastapi import FastAPI, Header, HTTPException, Query, Request, status, Response
+from fastapi.exceptions import RequestValidationError
 from pydantic import BaseModel
-from starlette.responses import JSONResponse
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse, PlainTextResponse
 
-from utils import logger, preprocess_data
+from cache import ResultCache, payload_digest
+from compression import (CompressionMiddleware, InvalidEncoding, UnsupportedEncoding, decompressed,
+                         request_decoder)
+from config import (ADMIN_TOKEN, APPROX_MIN_ROWS, HOST, INFERENCE_ENGINE, INFERENCE_THREADS, MAX_BATCH_REQUEST_ROWS,
+                    MAX_BATCH_ROWS, MAX_INFLIGHT_ROWS, MAX_REQUEST_MB, MAX_REQUEST_ROWS, MAX_WAIT_MS, MAX_SESSIONS,
+                    MAX_WINDOWS, MIN_COMPRESS_BYTES, MODEL_PATH, MODEL_REGISTRY, PORT, PROFILE_DIR, PROFILE_INTERVAL_MS,
+                    PROFILE_REPORTS, REGISTRY_POLL_S, RESULT_CACHE_MB, RESULT_CACHE_TTL_S, RETRY_AFTER_S,
+                    ROW_CACHE_ROWS, SESSION_AFFINITY, SESSION_IDLE_TIMEOUT_S, SLOW_REQUEST_S, TUNING_ROWS, TUNING_S, WARMUP_ROWS, WORKERS)
+from gaze_features import RollingWindow
+from ingest import (BatchReader, InvalidPayload, JsonColumnReader, OverBudget, PayloadTooLarge, RowBudget, check_lengths,
+                    limited)
+from metrics import MetricsMiddleware, record_rejection, record_rows, render as render_metrics, timed
+from payload import BINARY_CONTENT_TYPE, decode_columns
+from profiling import SAMPLE_AFTER, Profiler, ProfilingMiddleware, ReportStore, folded, note_payload
+from registry import ModelRegistry, ModelVersion
+from scheduler import InferenceScheduler
+from serve import available_cores, serve
+from sessions import SessionStore
+from tuning import thread_budget
+from utils import (class_means, logger, preprocess_columns, sample_margin, stratified_order, to_columns,
+                   window_means)
 
-app = FastAPI()
+started = time.perf_counter()
+worker_count = WORKERS or available_cores()
+# Each model.predict call gets the worker's share of the cores at most
+inference_tuning = {"rows": TUNING_ROWS, "max_threads": thread_budget(worker_count),
+                    "engine": INFERENCE_ENGINE, "num_threads": INFERENCE_THREADS, "duration_s": TUNING_S}
+registry = ModelRegistry(MODEL_REGISTRY, MODEL_PATH, warmup_rows=WARMUP_ROWS, row_cache_rows=ROW_CACHE_ROWS,
+                         poll_s=REGISTRY_POLL_S, tuning=inference_tuning)
 
-model = ydf.load_model("model")
-label_classes = model.label_classes()
-logger.info(f"Current label_classes: {label_classes}")
+# Startup timings reported by /ready, in seconds since the model started loading
+startup = {"model_load_s": time.perf_counter() - started, "tuning_s": None, "first_prediction_s": None,
+           "warmup_s": None}
+
+
+def warmup():
+    """Run the full preprocessing and inference path on synthetic data before taking traffic."""
+    if startup["warmup_s"] is not None:
+        return
+    # Pick the inference engine and threads before the first prediction
+    registry.active.tune(**inference_tuning)
+    startup["tuning_s"] = time.perf_counter() - started
+
+    def on_first_prediction():
+        startup["first_prediction_s"] = time.perf_counter() - started
+
+    registry.active.warmup(WARMUP_ROWS, on_first_prediction)
+    startup["warmup_s"] = time.perf_counter() - started
+    logger.info(f"Model warmed up: load {startup['model_load_s']:.3f}s, "
+                f"time to first prediction {startup['first_prediction_s']:.3f}s, "
+                f"ready after {startup['warmup_s']:.3f}s")
+
+# Requests pass the version they chose, the default follows the active version without holding on to old ones
+scheduler = InferenceScheduler(lambda columns: registry.active.predict(columns), max_batch_rows=MAX_BATCH_ROWS,
+                               max_wait_ms=MAX_WAIT_MS)
+sessions = SessionStore(len(registry.active.label_classes), max_sessions=MAX_SESSIONS,
+                        idle_timeout_s=SESSION_IDLE_TIMEOUT_S)
+result_cache = ResultCache(int(RESULT_CACHE_MB * 1e6), ttl_s=RESULT_CACHE_TTL_S)
+# Samples held by the requests of this worker, from ingestion until they are answered
+row_budget = RowBudget(MAX_INFLIGHT_ROWS)
+max_request_bytes = int(MAX_REQUEST_MB * 1e6)
+# Slow-request reports, the sampler only runs when slow requests are reported or admins may ask for profiles
+profiler = Profiler(PROFILE_INTERVAL_MS / 1000, SLOW_REQUEST_S * SAMPLE_AFTER)
+profile_store = ReportStore(PROFILE_DIR, PROFILE_REPORTS)
 
-# Label mapping
-label_mapping = {
-    "1": "walking",
-    "3": "playing",
-    "2": "reading"
-}
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Already done before forking when served by `serve`
+    await run_in_threadpool(warmup)
+    scheduler.start()
+    registry.start()
+    if SLOW_REQUEST_S > 0 or ADMIN_TOKEN is not None:
+        profiler.start()
+    yield
+    profiler.stop()
+    registry.stop()
+    scheduler.stop()
 
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(ProfilingMiddleware, profiler=profiler, store=profile_store, slow_s=SLOW_REQUEST_S,
+                   admin_token=ADMIN_TOKEN)
+app.add_middleware(CompressionMiddleware, minimum_size=MIN_COMPRESS_BYTES)
+app.add_middleware(MetricsMiddleware)
+
+# Response header naming the model version that produced the predictions
+MODEL_VERSION_HEADER = "X-Model-Version"
+
+
+# JSON payload schema, parsed incrementally by `JsonColumnReader`
 class DataBatches(BaseModel):
     timestamp: List[float] = []
     gazepoint_x: List[float] = []
@@ -39,54 +120,545 @@ class Output(BaseModel):
     process_data: int  # Amount of processed data
 
 
+class Window(Output):
+    start: float  # First timestamp of the window
+    end: float  # Window end, exclusive
+
+
+class TimelineOutput(Output):
+    windows: List[Window]
+
+
+class ApproximateOutput(Output):
+    scored_rows: int  # Rows actually scored by the model, out of process_data
+    margin: float  # Largest half-width of the per-class confidence intervals
+
+
+class Recording(DataBatches):
+    id: Optional[str] = None  # Echoed in the result of the recording
+    prev_euclidean_distance: Optional[float] = None  # Last distance of the previous payload of the same stream
+
+
+class RecordingOutput(BaseModel):
+    id: Optional[str] = None
+    result: Optional[Output] = None
+    last_euclidean_distance: Optional[float] = None  # prev_euclidean_distance of the next payload of the stream
+    error: Optional[str] = None
+
+
+class BatchOutput(BaseModel):
+    results: List[RecordingOutput]  # In the order of the recordings
+    process_data: int  # Amount of processed data over all the recordings
+
+
+def class_probabilities(version: ModelVersion, means) -> dict:
+    """Map the per-class means onto the activity names of the model version."""
+    return {name: float(value) for name, value in zip(version.class_names, means)}
+
+
+def json_response(output: BaseModel, response: Response) -> Response:
+    """
+    Serialize a response model with pydantic-core, keeping the headers set on `response`. FastAPI's generic
+    encoder is about 20 times slower on large timelines.
+    """
+    with timed("serialization"):
+        return Response(output.model_dump_json(), media_type="application/json", headers=response.headers)
+
+
+# /predict reads its body itself to accept both JSON and binary columnar payloads
+payload_openapi = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "application/json": {"schema": DataBatches.model_json_schema()},
+            BINARY_CONTENT_TYPE: {"schema": {"type": "string", "format": "binary"}},
+        },
+    }
+}
+
+# Recording has no nested models, so its schema is inlined without references
+batch_openapi = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "application/json": {"schema": {
+                "title": "BatchPayload",
+                "type": "object",
+                "properties": {"recordings": {"type": "array", "items": Recording.model_json_schema()}},
+                "required": ["recordings"],
+            }},
+        },
+    }
+}
+
+
+@contextmanager
+def ingestion_errors():
+    """Answer the request limit, budget and payload errors raised while reading a body with their HTTP status."""
+    try:
+        yield
+    except UnsupportedEncoding as e:
+        raise HTTPException(status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE, detail=str(e))
+    except PayloadTooLarge as e:
+        record_rejection("too_large")
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e))
+    except OverBudget as e:
+        record_rejection("over_budget")
+        raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail=str(e),
+                            headers={"Retry-After": str(RETRY_AFTER_S)})
+    except InvalidEncoding as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except InvalidPayload as e:
+        raise RequestValidationError(e.errors)
+
+
+def body_stream(request: Request) -> tuple:
+    """
+    Chunks of the request body within `max_request_bytes`, decompressed when it is compressed. What is known
+    to be too much is refused before reading anything.
+    Returns:
+        tuple: The async iterator of the chunks and whether the body is compressed.
+    """
+    content_length = int(request.headers.get("content-length") or 0)
+    decoder = request_decoder(request.headers.get("content-encoding", ""), max_request_bytes)
+    if 0 < max_request_bytes < content_length:
+        raise PayloadTooLarge(f"Request body is larger than {max_request_bytes} bytes")
+    if row_budget.full:
+        raise OverBudget(f"Server is over its budget of {row_budget.max_rows} in-flight samples, retry later")
+    chunks = limited(request.stream(), max_request_bytes)
+    if decoder is not None:
+        chunks = decompressed(chunks, decoder, max_request_bytes)
+    return chunks, decoder is not None
+
+
+async def read_columns(request: Request) -> tuple:
+    """
+    Read the payload columns from a JSON body (default) or a binary columnar body, within the request limits
+    and the in-flight row budget. Bodies are decompressed (Content-Encoding gzip or zstd) and JSON bodies are
+    parsed as they arrive, so "receive" includes both.
+    Args:
+        request (Request): The incoming request.
+    Returns:
+        tuple: Mapping of column name to values, ready for `preprocess_columns`, and the samples reserved in
+            `row_budget`, to release once the request is answered.
+    """
+    content_type = request.headers.get("content-type", "").split(";")[0].strip()
+    with ingestion_errors():
+        chunks, compressed = body_stream(request)
+        if content_type == BINARY_CONTENT_TYPE:
+            with timed("receive"):
+                body = b"".join([chunk async for chunk in chunks])
+            with timed("validation"):
+                try:
+                    columns = decode_columns(body)
+                except ValueError as e:
+                    raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+            check_lengths(columns)
+            rows = len(columns["timestamp"])
+            if 0 < MAX_REQUEST_ROWS < rows:
+                raise PayloadTooLarge(f"Payload has more than {MAX_REQUEST_ROWS} samples")
+            row_budget.reserve(rows)
+            return columns, rows
+
+        # The compressed length says little about the number of samples
+        content_length = 0 if compressed else int(request.headers.get("content-length") or 0)
+        reader = JsonColumnReader(row_budget, MAX_REQUEST_ROWS, content_length)
+        try:
+            with timed("receive"):
+                async for chunk in chunks:
+                    reader.feed(chunk)
+            with timed("validation"):
+                return reader.close(), reader.reserved
+        except BaseException:
+            # Including a client disconnect, the samples parsed so far are dropped
+            reader.release()
+            raise
+
+
+async def read_recordings(request: Request) -> tuple:
+    """
+    Read the recordings of a batch request, within the request limits, `MAX_BATCH_REQUEST_ROWS` and the
+    in-flight row budget. Like JSON payloads, the recordings are parsed as the body arrives.
+    Returns:
+        tuple: The recordings (see `BatchReader.close`) and the samples reserved in `row_budget`, to release
+            once the request is answered.
+    """
+    with ingestion_errors():
+        chunks, _ = body_stream(request)
+        reader = BatchReader(row_budget, MAX_BATCH_REQUEST_ROWS)
+        try:
+            with timed("receive"):
+                async for chunk in chunks:
+                    reader.feed(chunk)
+            with timed("validation"):
+                return reader.close(), reader.reserved
+        except BaseException:
+            reader.release()
+            raise
+
+
+def columns_and_digest(payload: dict, version: ModelVersion) -> tuple:
+    """Convert the payload to columns and hash them for the version's results (None when the cache is disabled)."""
+    columns = to_columns(payload)
+    if not result_cache.enabled:
+        return columns, None
+    with timed("payload_hash"):
+        return columns, payload_digest(columns) + version.name.encode()
+
+
+async def score(version: ModelVersion, batch_input: dict) -> np.ndarray:
+    """
+    Predictions of the model version for the preprocessed rows. Rows found in the version's row cache
+    are not scored again, the others are batched with concurrent requests by the scheduler.
+    """
+    row_cache = version.row_cache
+    if not row_cache.enabled:
+        return await scheduler.predict(batch_input, version.predict)
+    with timed("row_cache"):
+        keys, predictions, missing = await run_in_threadpool(
+            row_cache.lookup, batch_input, len(version.label_classes)
+        )
+    if len(missing) == 0:
+        return predictions
+    if len(missing) < len(keys):
+        batch_input = {key: values[missing] for key, values in batch_input.items()}
+    scored = await scheduler.predict(batch_input, version.predict)
+    predictions[missing] = scored
+    await run_in_threadpool(row_cache.store, keys, scored, missing)
+    return predictions
+
+
+def preprocess_recordings(version: ModelVersion, recordings: list) -> tuple:
+    """
+    Preprocess each valid recording on its own, as one `/predict` payload.
+    Returns:
+        tuple: The model input of the recordings merged into one batch (None without samples), and the samples
+            and error of every recording.
+    """
+    inputs, process_data, errors = [], [], []
+    for recording_id, columns, prev_euclidean_distance, error in recordings:
+        rows = 0
+        if error is None:
+            try:
+                batch_input = preprocess_columns(columns, prev_euclidean_distance)
+                rows = len(batch_input["timestamp"])
+                if rows == 0:
+                    raise ValueError("No valid samples to process")
+                if version.rolling_features:
+                    with timed("rolling_features"):
+                        batch_input = version.add_features(batch_input)
+                inputs.append(batch_input)
+            except Exception as e:
+                rows, error = 0, str(e)
+        process_data.append(rows)
+        errors.append(error)
+    if not inputs:
+        return None, process_data, errors
+    merged = {key: np.concatenate([batch_input[key] for batch_input in inputs]) for key in inputs[0]}
+    return merged, process_data, errors
+
+
+def check_admin(authorization: Optional[str]):
+    """Only callers holding the admin token may change the served models and read the profile reports."""
+    if ADMIN_TOKEN is None:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
+                            detail="Administration is disabled, set SEETRUE_ADMIN_TOKEN to enable it")
+    if authorization is None or not hmac.compare_digest(authorization, f"Bearer {ADMIN_TOKEN}"):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid admin token")
+
+
+def check_sessions():
+    """Sessions live in one worker, refuse them when the chunks of a session may reach different workers."""
+    if worker_count > 1 and not SESSION_AFFINITY:
+        raise HTTPException(status_code=status.HTTP_501_NOT_IMPLEMENTED,
+                            detail=f"Sessions are disabled with {worker_count} workers, set SEETRUE_WORKERS=1 or "
+                                   f"route each session to one worker and set SEETRUE_SESSION_AFFINITY=1")
+
+
+async def apply_control(**changes) -> dict:
+    """
+    Write the registry control file, then load, warm and swap in this worker. The other workers
+    apply the change on their next poll of the control file.
+    """
+    try:
+        registry.write_control(**changes)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    await run_in_threadpool(registry.reconcile)
+    model_status = registry.status()
+    if model_status["errors"]:
+        return JSONResponse(content=model_status, status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    return model_status
+
+
+async def score_until(version: ModelVersion, batch_input: dict, tolerance: float, confidence: float) -> tuple:
+    """
+    Score growing stratified samples of the rows, doubling from `APPROX_MIN_ROWS`, until the confidence
+    interval of every class mean is within `tolerance`.
+    Returns:
+        tuple: The estimated class means, the number of rows scored and the largest interval half-width.
+    """
+    rows = len(batch_input["timestamp"])
+    order = await run_in_threadpool(stratified_order, batch_input["eye_event"], batch_input["timestamp"])
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    sums = squares = 0.0
+    scored = 0
+    size = APPROX_MIN_ROWS
+    while True:
+        sample = order[scored:size]
+        predictions = await score(version, {key: values[sample] for key, values in batch_input.items()})
+        predictions = predictions.astype(np.float64)
+        sums = sums + predictions.sum(axis=0)
+        squares = squares + (predictions ** 2).sum(axis=0)
+        scored += len(sample)
+        margin = float(sample_margin(sums, squares, scored, rows, z).max())
+        if scored >= rows or margin <= tolerance:
+            return sums / scored, scored, margin
+        size *= 2
+
+
 @app.get('/hello', status_code=status.HTTP_200_OK)
 def hello_world(response: Response):
     return {'Welcome to SeeTrue AI!': "data"}
 
 
-@app.post("/predict")
-async def predict(payload: DataBatches):
+@app.get('/metrics', response_class=PlainTextResponse)
+def metrics():
+    """Prometheus text exposition of the serving metrics of this worker."""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+
+@app.get('/ready')
+def ready():
+    """Readiness probe, only succeeds once the model is warmed up and the scheduler is running."""
+    if startup["warmup_s"] is None or not scheduler.running:
+        return JSONResponse(content={"ready": False}, status_code=status.HTTP_503_SERVICE_UNAVAILABLE)
+    return {"ready": True, **startup}
+
+
+@app.post("/predict", openapi_extra=payload_openapi)
+async def predict(request: Request, response: Response,
+                  window: Optional[float] = Query(None, gt=0, description="Timeline window length in timestamp units"),
+                  stride: Optional[float] = Query(None, gt=0, description="Timeline window stride, defaults to window"),
+                  tolerance: Optional[float] = Query(None, gt=0, lt=1, description="Approximate mode: stop scoring "
+                                                     "once every class mean is known within this margin"),
+                  confidence: float = Query(0.95, gt=0, lt=1, description="Confidence level of the tolerance")):
+    if tolerance is not None and window is not None:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="The approximate mode (tolerance) does not support timelines (window)")
+    payload, reserved = await read_columns(request)
+    note_payload(payload)
+    # The version chosen here serves the whole request, even if another one is swapped in meanwhile
+    version = registry.choose()
+    response.headers[MODEL_VERSION_HEADER] = version.name
     try:
-        # Preprocess the payload into individual records
-        data = payload.model_dump()
-        processed_data = preprocess_data(data)
-        process_data = len(processed_data)
-        # Aggregate processed data into a single batch input
-        batch_input = {
-            key: [record[key] for record in processed_data if key != "prev_euclidean_distance"]
-            for key in processed_data[0] if key != "prev_euclidean_distance"
-        }
-        prediction_batch = model.predict(batch_input).tolist()
+        columns, digest = await run_in_threadpool(columns_and_digest, payload, version)
+        cached = result_cache.get(digest) if digest is not None else None
+        if cached is not None:
+            # Same samples as a recent payload, e.g. a retried upload
+            batch_input, predictions = cached
+            process_data = len(batch_input["timestamp"])
+            record_rows(len(columns["timestamp"]), process_data)
+        else:
+            # Preprocess the payload columns off the event loop
+            batch_input = await run_in_threadpool(preprocess_columns, columns)
+            if version.rolling_features:
+                with timed("rolling_features"):
+                    batch_input = await run_in_threadpool(version.add_features, batch_input)
+            process_data = len(batch_input["timestamp"])
+            record_rows(len(columns["timestamp"]), process_data)
+            if process_data == 0:
+                raise ValueError("No valid samples to process")
+            if tolerance is not None:
+                # Approximate means are not cached, only exact results are
+                with timed("inference"):
+                    means, scored_rows, margin = await score_until(version, batch_input, tolerance, confidence)
+                return json_response(ApproximateOutput(**class_probabilities(version, means),
+                                                       process_data=process_data, scored_rows=scored_rows,
+                                                       margin=margin), response)
+            with timed("inference"):
+                predictions = await score(version, batch_input)
+            if digest is not None:
+                result_cache.put(digest, batch_input, predictions)
 
         # Calculate means for each label class
-        means = {label_mapping[label]: 0.0 for label in label_mapping.keys()}
-        counts = {label_mapping[label]: 0 for label in label_mapping.keys()}
-
-        for prediction in prediction_batch:
-            for i, value in enumerate(prediction):
-                class_label = label_classes[i]
-                mapped_label = label_mapping[class_label]
-                means[mapped_label] += value
-                counts[mapped_label] += 1
-
-        # Calculate averages of each prediction
-        for label in means:
-            if counts[label] > 0:
-                means[label] /= counts[label]
-
-        # Construct response
-        response = Output(
-            walking=means["walking"],
-            playing=means["playing"],
-            reading=means["reading"],
-            process_data=process_data
-        )
-        return response
+        with timed("aggregation"):
+            output = Output(**class_probabilities(version, class_means(predictions)), process_data=process_data)
+        if tolerance is not None:
+            # Exact result of the same payload from the cache
+            return json_response(ApproximateOutput(**output.model_dump(), scored_rows=process_data, margin=0.0),
+                                 response)
+        if window is None:
+            return json_response(output, response)
+
+        # Per-window probabilities over the timestamp axis
+        timestamps = batch_input["timestamp"]
+        stride = stride or window
+        if (timestamps.max() - timestamps.min()) / stride >= MAX_WINDOWS:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                detail=f"More than {MAX_WINDOWS} windows requested, increase the stride")
+        with timed("timeline"):
+            starts, means, counts = window_means(predictions, timestamps, window, stride)
+            windows = [
+                Window(start=start, end=start + window, **class_probabilities(version, window_mean),
+                       process_data=count)
+                for start, window_mean, count in zip(starts.tolist(), means, counts.tolist())
+            ]
+        return json_response(TimelineOutput(**output.model_dump(), windows=windows), response)
+    except HTTPException:
+        raise
+    except Exception as e:
+        trace_back_msg = traceback.format_exc()
+        logger.error(f"{str(e)} \n {trace_back_msg}")
+        return JSONResponse(content={"Error": str(e)}, status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    finally:
+        row_budget.release(reserved)
+
+
+@app.post("/sessions/{session_id}/predict", openapi_extra=payload_openapi)
+async def predict_session(session_id: str, request: Request, response: Response):
+    """Score only the new samples of a continuous feed and return the running means of the session."""
+    check_sessions()
+    payload, reserved = await read_columns(request)
+    note_payload(payload)
+    # A session sticks to one version while the canary settings do not change
+    version = registry.choose(session_id)
+    response.headers[MODEL_VERSION_HEADER] = version.name
+    try:
+        session = sessions.get(session_id)
+        async with session.lock:
+            batch_input = await run_in_threadpool(
+                preprocess_columns, payload, session.prev_euclidean_distance
+            )
+            record_rows(len(payload["timestamp"]), len(batch_input["timestamp"]))
+            if len(batch_input["timestamp"]) > 0:
+                if version.rolling_features:
+                    session.window = session.window or RollingWindow(version.rolling_window)
+                    with timed("rolling_features"):
+                        await run_in_threadpool(version.add_features, batch_input, session.window)
+                with timed("inference"):
+                    predictions = await score(version, batch_input)
+                session.update(batch_input, predictions)
+
+            return json_response(Output(**class_probabilities(version, session.means()), process_data=session.count),
+                                 response)
+    except Exception as e:
+        trace_back_msg = traceback.format_exc()
+        logger.error(f"{str(e)} \n {trace_back_msg}")
+        return JSONResponse(content={"Error": str(e)}, status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    finally:
+        row_budget.release(reserved)
+
+
+@app.post("/predict/batch", openapi_extra=batch_openapi)
+async def predict_batch(request: Request, response: Response):
+    """
+    Score many independent recordings with one inference call. Each recording is preprocessed with its own
+    `prev_euclidean_distance` and gets its own result, or its own error without failing the others.
+    """
+    recordings, reserved = await read_recordings(request)
+    for _, columns, _, _ in recordings:
+        if columns is not None:
+            note_payload(columns)
+    version = registry.choose()
+    response.headers[MODEL_VERSION_HEADER] = version.name
+    try:
+        merged, process_data, errors = await run_in_threadpool(preprocess_recordings, version, recordings)
+        record_rows(sum(len(columns["timestamp"]) for _, columns, _, _ in recordings if columns is not None),
+                    sum(process_data))
+        if merged is None:
+            predictions = np.empty((0, len(version.label_classes)), dtype=np.float32)
+        else:
+            with timed("inference"):
+                predictions = await score(version, merged)
+
+        with timed("aggregation"):
+            results = []
+            end = 0
+            for (recording_id, _, _, _), rows, error in zip(recordings, process_data, errors):
+                if error is not None:
+                    results.append(RecordingOutput(id=recording_id, error=error))
+                    continue
+                start, end = end, end + rows
+                last_distance = float(merged["euclidean_distance"][end - 1])
+                results.append(RecordingOutput(
+                    id=recording_id,
+                    result=Output(**class_probabilities(version, class_means(predictions[start:end])),
+                                  process_data=rows),
+                    last_euclidean_distance=None if np.isnan(last_distance) else last_distance,
+                ))
+        return json_response(BatchOutput(results=results, process_data=sum(process_data)), response)
     except Exception as e:
         trace_back_msg = traceback.format_exc()
         logger.error(f"{str(e)} \n {trace_back_msg}")
         return JSONResponse(content={"Error": str(e)}, status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    finally:
+        row_budget.release(reserved)
+
+
+@app.get('/models')
+def models():
+    """Model versions of the registry and the ones serving traffic in this worker."""
+    return registry.status()
+
+
+@app.post('/models/{version}/activate')
+async def activate_model(version: str, authorization: Optional[str] = Header(None)):
+    """Load and warm a version, then make it serve all the traffic (it also stops being the candidate)."""
+    check_admin(authorization)
+    changes = {"active": version}
+    if registry.read_control().get("candidate") == version:
+        changes["candidate"] = None
+    return await apply_control(**changes)
+
+
+@app.post('/models/{version}/canary')
+async def canary_model(version: str, authorization: Optional[str] = Header(None),
+                       fraction: float = Query(..., ge=0, le=1, description="Share of the traffic sent to the version")):
+    """Load and warm a candidate version, then route a fraction of the traffic to it."""
+    check_admin(authorization)
+    return await apply_control(candidate=version, canary_fraction=fraction)
+
+
+@app.delete('/models/canary')
+async def stop_canary(authorization: Optional[str] = Header(None)):
+    """Send all the traffic back to the active version."""
+    check_admin(authorization)
+    return await apply_control(candidate=None)
+
+
+@app.get('/profiles')
+async def profiles(authorization: Optional[str] = Header(None)):
+    """Slow-request reports kept on disk, newest first."""
+    check_admin(authorization)
+    return {"reports": await run_in_threadpool(profile_store.list)}
+
+
+@app.get('/profiles/{report_id}')
+async def profile(report_id: str, authorization: Optional[str] = Header(None),
+                  format: str = Query("json", pattern="^(json|folded)$",
+                                      description="json for the whole report, folded for its stacks only")):
+    """Download a slow-request report, or its sampled stacks for flame graph tools (flamegraph.pl, speedscope)."""
+    check_admin(authorization)
+    report = await run_in_threadpool(profile_store.read, report_id)
+    if report is None:
+        return JSONResponse(content={"Error": f"Unknown report {report_id}"}, status_code=status.HTTP_404_NOT_FOUND)
+    if format == "folded":
+        return PlainTextResponse(folded(json.loads(report)))
+    return Response(report, media_type="application/json",
+                    headers={"Content-Disposition": f'attachment; filename="{report_id}.json"'})
+
+
+@app.delete("/sessions/{session_id}", status_code=status.HTTP_200_OK)
+def close_session(session_id: str):
+    check_sessions()
+    session = sessions.pop(session_id)
+    if session is None:
+        return JSONResponse(content={"Error": f"Unknown session {session_id}"}, status_code=status.HTTP_404_NOT_FOUND)
+    return {"session_id": session_id, "process_data": session.count}
 
 
 if __name__ == '__main__':
-    uvicorn.run("main:app", host="0.0.0.0", port=8080, workers=1, access_log=True)
+    # Load and warm the model once, then fork the workers
+    warmup()
+    serve(app, host=HOST, port=PORT, workers=worker_count)
@@ -0,0 +1,237 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+"""
+Lightweight in-process metrics rendered in the Prometheus text format on /metrics.
+Recording a value costs a lock and a few additions, so instrumentation stays on in production.
+Each worker process keeps its own values.
+"""
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+ROW_BUCKETS = (10, 100, 1000, 10000, 100000, 1000000)
+
+registry = []
+
+
+def _format_labels(labelnames: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+        registry.append(self)
+
+    def inc(self, amount: float = 1.0, *labels):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def value(self, *labels) -> float:
+        return self._values.get(labels, 0.0)
+
+    def render(self) -> list:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, labels)} {value}" for labels, value in items]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, amount: float = 1.0, *labels):
+        self.inc(-amount, *labels)
+
+    def set(self, value: float, *labels):
+        with self._lock:
+            self._values[labels] = value
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self._values = {}  # labels -> [per-bucket counts (last one is +Inf), sum]
+        self._lock = threading.Lock()
+        registry.append(self)
+
+    def observe(self, value: float, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                state = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    def render(self) -> list:
+        with self._lock:
+            items = sorted((labels, (list(counts), total)) for labels, (counts, total) in self._values.items())
+        lines = []
+        for labels, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                bucket_labels = _format_labels(self.labelnames, labels, 'le="%s"' % bound)
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+def render() -> str:
+    """Render every registered metric in the Prometheus text exposition format."""
+    lines = []
+    for metric in registry:
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+REQUEST_SECONDS = Histogram("seetrue_request_seconds", "Request latency by route.", ("route",))
+REQUESTS_IN_FLIGHT = Gauge("seetrue_requests_in_flight", "Requests currently being served.")
+STAGE_SECONDS = Histogram("seetrue_stage_seconds", "Time spent in each processing stage.", ("stage",))
+REQUEST_ROWS = Histogram("seetrue_request_rows", "Samples received per request.", buckets=ROW_BUCKETS)
+ROWS_RECEIVED = Counter("seetrue_rows_received_total", "Samples received.")
+ROWS_DROPPED_NA = Counter("seetrue_rows_dropped_na_total", "Samples dropped because eye_event is NA.")
+INFERENCE_ROWS = Counter("seetrue_inference_rows_total", "Rows scored by the model.")
+INFERENCE_SECONDS = Counter("seetrue_inference_seconds_total", "Time spent in model.predict.")
+INFERENCE_BATCH_ROWS = Histogram("seetrue_inference_batch_rows", "Rows per model.predict call.", buckets=ROW_BUCKETS)
+CACHE_LOOKUPS = Counter("seetrue_cache_lookups_total", "Cache lookups by cache and result (hit or miss).",
+                        ("cache", "result"))
+CACHE_ENTRIES = Gauge("seetrue_cache_entries", "Entries held by each cache.", ("cache",))
+CACHE_BYTES = Gauge("seetrue_cache_bytes", "Memory held by each cache, for caches with a byte budget.", ("cache",))
+MODEL_INFERENCE_ROWS = Counter("seetrue_model_inference_rows_total", "Rows scored by each model version.", ("version",))
+MODEL_INFERENCE_SECONDS = Counter("seetrue_model_inference_seconds_total", "Time spent in model.predict by version.",
+                                  ("version",))
+MODEL_PROBABILITY_SUM = Counter("seetrue_model_probability_sum",
+                                "Predicted probabilities summed by version and class, divide by the rows scored "
+                                "to compare the outputs of versions.", ("version", "class"))
+ROWS_IN_FLIGHT = Gauge("seetrue_rows_in_flight", "Samples held by the requests being served.")
+REQUESTS_REJECTED = Counter("seetrue_requests_rejected_total",
+                            "Requests refused before processing, by reason (too_large or over_budget).", ("reason",))
+MODEL_ROLE = Gauge("seetrue_model_role", "Model versions serving traffic, by role (active or candidate).",
+                   ("version", "role"))
+
+# Stage timings of the current request, only set while a request is served
+_request_timings = ContextVar("request_timings", default=None)
+
+
+@contextmanager
+def timed(stage: str):
+    """Record the duration of a processing stage, and add it to the request's Server-Timing breakdown."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start
+        STAGE_SECONDS.observe(duration, stage)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + duration
+
+
+def request_timings() -> Optional[dict]:
+    """Stage timings of the current request so far, None outside of a request."""
+    return _request_timings.get()
+
+
+def record_rows(received: int, processed: int):
+    """Count the samples of a request and the ones dropped by the NA filter."""
+    REQUEST_ROWS.observe(received)
+    ROWS_RECEIVED.inc(received)
+    ROWS_DROPPED_NA.inc(received - processed)
+
+
+def record_inference(rows: int, duration: float):
+    """Count one model.predict call, the inference throughput is rows_total / seconds_total."""
+    INFERENCE_ROWS.inc(rows)
+    INFERENCE_SECONDS.inc(duration)
+    INFERENCE_BATCH_ROWS.observe(rows)
+
+
+def record_cache(cache: str, hits: int, misses: int, size: Optional[int], entries: int):
+    """Count cache hits and misses, and update the cache's entries (and bytes, if it has a byte budget)."""
+    if hits:
+        CACHE_LOOKUPS.inc(hits, cache, "hit")
+    if misses:
+        CACHE_LOOKUPS.inc(misses, cache, "miss")
+    CACHE_ENTRIES.set(entries, cache)
+    if size is not None:
+        CACHE_BYTES.set(size, cache)
+
+
+def record_model_inference(version: str, class_names: list, predictions, duration: float):
+    """Count the rows, time and predicted probabilities of one model.predict call of a model version."""
+    MODEL_INFERENCE_ROWS.inc(len(predictions), version)
+    MODEL_INFERENCE_SECONDS.inc(duration, version)
+    if len(predictions):
+        for name, total in zip(class_names, predictions.sum(axis=0, dtype="float64").tolist()):
+            MODEL_PROBABILITY_SUM.inc(total, version, name)
+
+
+def record_rejection(reason: str):
+    REQUESTS_REJECTED.inc(1, reason)
+
+
+def record_model_roles(active: str, candidate: Optional[str]):
+    MODEL_ROLE.clear()
+    MODEL_ROLE.set(1, active, "active")
+    if candidate is not None:
+        MODEL_ROLE.set(1, candidate, "candidate")
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware tracking request latency and in-flight requests. Requests sent with the
+    `X-Server-Timing: 1` header get a `Server-Timing` response header with their stage breakdown.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        timings = {}
+        token = _request_timings.set(timings)
+        server_timing = (b"x-server-timing", b"1") in scope["headers"]
+
+        async def send_with_timing(message):
+            if server_timing and message["type"] == "http.response.start":
+                timings["total"] = time.perf_counter() - start
+                value = ", ".join(f"{stage};dur={duration * 1000:.3f}" for stage, duration in timings.items())
+                message = {**message, "headers": list(message.get("headers", [])) + [(b"server-timing", value.encode())]}
+            await send(message)
+
+        REQUESTS_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_with_timing if server_timing else send)
+        finally:
+            REQUESTS_IN_FLIGHT.dec()
+            route = scope.get("route")
+            REQUEST_SECONDS.observe(time.perf_counter() - start, route.path if route is not None else "unmatched")
+            _request_timings.reset(token)
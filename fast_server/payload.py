@@ -0,0 +1,71 @@
+import struct
+
+import numpy as np
+
+from utils import NUMERIC_COLUMNS
+
+"""
+Binary columnar payload for /predict, an alternative to the JSON `DataBatches` body for large uploads.
+It is decoded straight into NumPy arrays without building Python lists.
+
+Layout (little-endian, content type `application/x-seetrue-columns`):
+    16 bytes header   magic b"STC1", uint32 row count n, uint32 eye_event width w, uint32 reserved
+    5 x float64[n]    timestamp, gazepoint_x, gazepoint_y, pupil_area_right_sq_mm, pupil_area_left_sq_mm
+    bytes[n * w]      eye_event, ASCII strings NUL-padded to w bytes
+"""
+BINARY_CONTENT_TYPE = "application/x-seetrue-columns"
+MAGIC = b"STC1"
+HEADER = struct.Struct("<4sIII")
+
+
+def decode_columns(body: bytes) -> dict:
+    """
+    Decode a binary columnar payload. The numeric columns are read-only views of `body`.
+    Args:
+        body (bytes): The raw request body.
+    Returns:
+        dict: float64 arrays for the numeric columns and a str array for 'eye_event'.
+    Raises:
+        ValueError: If the body does not follow the layout or an eye event is not ASCII.
+    """
+    if len(body) < HEADER.size:
+        raise ValueError("Binary payload is shorter than its header")
+    magic, rows, width, _ = HEADER.unpack_from(body)
+    if magic != MAGIC:
+        raise ValueError(f"Unknown binary payload format {magic!r}")
+    expected = HEADER.size + rows * (8 * len(NUMERIC_COLUMNS) + width)
+    if len(body) != expected:
+        raise ValueError(f"Binary payload of {rows} rows should be {expected} bytes, got {len(body)}")
+
+    columns = {}
+    offset = HEADER.size
+    for key in NUMERIC_COLUMNS:
+        columns[key] = np.frombuffer(body, dtype="<f8", count=rows, offset=offset)
+        offset += 8 * rows
+    events = np.frombuffer(body, dtype=f"S{max(width, 1)}", count=rows, offset=offset)
+    try:
+        columns["eye_event"] = events.astype("U")
+    except UnicodeDecodeError as e:
+        raise ValueError(f"eye_event values must be ASCII, got byte {e.object[e.start:e.end]!r}") from None
+    return columns
+
+
+def encode_columns(payload: dict) -> bytes:
+    """
+    Encode a JSON-like batch payload into the binary columnar format, for clients and benchmarks.
+    Args:
+        payload (dict): Mapping of column name to a sequence of values.
+    Returns:
+        bytes: The binary payload.
+    """
+    events = np.asarray(payload.get("eye_event", []), dtype="S")
+    rows = len(events)
+    width = events.dtype.itemsize if rows else 0
+    parts = [HEADER.pack(MAGIC, rows, width, 0)]
+    for key in NUMERIC_COLUMNS:
+        values = np.asarray(payload.get(key, []), dtype="<f8")
+        if len(values) != rows:
+            raise ValueError(f"Column {key} has {len(values)} values, expected {rows}")
+        parts.append(values.tobytes())
+    parts.append(events.tobytes())
+    return b"".join(parts)
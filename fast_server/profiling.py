@@ -0,0 +1,295 @@
+import hmac
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+from typing import Optional
+
+import numpy as np
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers
+
+from metrics import request_timings
+from utils import logger
+
+"""
+Slow-request reports. A sampler thread takes the Python stacks of every thread of the worker while a
+request is running for longer than half the slow threshold, or from its start for the requests an admin
+sends with the `X-Profile: 1` header. Requests slower than the threshold then get a report with the sampled
+stacks (folded, for flame graph tools), their stage timings and the shape of their payload, written to a
+directory that keeps the last reports. The sampler does nothing while no request is long enough, so other
+requests only pay for registering themselves.
+"""
+# Share of the slow threshold after which the stacks of a running request are sampled
+SAMPLE_AFTER = 0.5
+# Most distinct stacks kept in a report, the rarest are dropped
+MAX_STACKS = 500
+# Most eye event types listed in the payload shape of a report
+MAX_EVENT_TYPES = 20
+PROFILE_HEADER = "x-profile"
+REPORT_ID = re.compile(r"^\d+-\d+$")
+
+# Trace of the current request, only set while a profiled request is served
+_current_trace = ContextVar("current_trace", default=None)
+
+
+class Trace:
+    """Samples and payloads of one request."""
+
+    def __init__(self, forced: bool):
+        self.id = f"{time.time_ns()}-{os.getpid()}"
+        self.forced = forced  # profiled from its start on request of an admin
+        self.start = time.perf_counter()
+        self.stacks = Counter()  # folded stack -> samples
+        self.samples = 0
+        self.payloads = []  # payload columns of the request, described only if it is reported
+
+
+class Profiler:
+    """Sampling profiler of the running requests, see the module docstring."""
+
+    def __init__(self, interval_s: float, sample_after_s: float):
+        """
+        Args:
+            interval_s (float): Time between two samples.
+            sample_after_s (float): Running time after which a request is sampled, unless it is forced.
+        """
+        self.interval_s = interval_s
+        self.sample_after_s = sample_after_s
+        self._traces = set()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self._thread is None:
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stopped.set()
+            self._thread.join()
+            self._thread = None
+
+    def begin(self, forced: bool) -> Trace:
+        trace = Trace(forced)
+        with self._lock:
+            self._traces.add(trace)
+        return trace
+
+    def end(self, trace: Trace):
+        """Stop sampling for the request, no sample is added to its trace afterwards."""
+        with self._lock:
+            self._traces.discard(trace)
+
+    def _run(self):
+        while not self._stopped.wait(self.interval_s):
+            now = time.perf_counter()
+            with self._lock:
+                traces = [trace for trace in self._traces if trace.forced or now - trace.start >= self.sample_after_s]
+            if not traces:
+                continue
+            stacks = self._sample()
+            with self._lock:
+                for trace in traces:
+                    if trace in self._traces:
+                        trace.stacks.update(stacks)
+                        trace.samples += 1
+
+    @staticmethod
+    def _sample() -> list:
+        """Folded stacks ("thread;outer function;...;inner function") of every other thread."""
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        own = threading.get_ident()
+        stacks = []
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            functions = []
+            while frame is not None:
+                code = frame.f_code
+                functions.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            functions.append(names.get(ident, str(ident)))
+            stacks.append(";".join(reversed(functions)))
+        return stacks
+
+
+def note_payload(columns: dict):
+    """Keep the payload columns of the current request for its report, if it is profiled."""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.payloads.append(columns)
+
+
+def describe_payloads(payloads: list) -> dict:
+    """Shape of the payloads of a request: samples, share of NA eye events and the mix of event types."""
+    events = [np.char.strip(np.asarray(columns["eye_event"], dtype=str)) for columns in payloads]
+    events = np.concatenate(events) if events else np.empty(0, dtype=str)
+    rows = len(events)
+    # Event type is the first two letters, e.g. FE for "FEx1.2y3.4d5.6"
+    types, counts = np.unique(events.astype("<U2"), return_counts=True)
+    order = np.argsort(-counts, kind="stable")[:MAX_EVENT_TYPES]
+    return {
+        "payloads": len(payloads),
+        "rows": rows,
+        "na_fraction": float(np.mean(events == "NA")) if rows else 0.0,
+        "events": {str(types[i]): int(counts[i]) for i in order},
+    }
+
+
+def folded(report: dict) -> str:
+    """The sampled stacks of a report in the folded format of flamegraph.pl and speedscope."""
+    return "".join(f"{stack} {count}\n" for stack, count in report["profile"]["stacks"].items())
+
+
+class ReportStore:
+    """Directory keeping the last `max_reports` reports, shared by the workers."""
+
+    def __init__(self, directory: str, max_reports: int):
+        self.directory = directory
+        self.max_reports = max_reports
+
+    def _ids(self) -> list:
+        """Report ids, oldest first."""
+        try:
+            files = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        ids = [name[:-len(".json")] for name in files if name.endswith(".json")]
+        return sorted((report_id for report_id in ids if REPORT_ID.match(report_id)),
+                      key=lambda report_id: [int(part) for part in report_id.split("-")])
+
+    def path(self, report_id: str) -> Optional[str]:
+        """Path of a report, None for invalid ids."""
+        if not REPORT_ID.match(report_id):
+            return None
+        return os.path.join(self.directory, f"{report_id}.json")
+
+    def save(self, report: dict):
+        """Write a report atomically, then drop the oldest ones beyond `max_reports`."""
+        os.makedirs(self.directory, exist_ok=True)
+        temporary_path = os.path.join(self.directory, f".{report['id']}.tmp")
+        with open(temporary_path, "w") as file:
+            json.dump(report, file)
+        os.replace(temporary_path, os.path.join(self.directory, f"{report['id']}.json"))
+        ids = self._ids()
+        for report_id in ids[:max(len(ids) - self.max_reports, 0)]:
+            try:
+                os.remove(os.path.join(self.directory, f"{report_id}.json"))
+            except FileNotFoundError:  # removed by another worker meanwhile
+                pass
+
+    def read(self, report_id: str) -> Optional[bytes]:
+        """The JSON of a stored report, None for unknown ids."""
+        path = self.path(report_id)
+        if path is None:
+            return None
+        try:
+            with open(path, "rb") as file:
+                return file.read()
+        except FileNotFoundError:  # unknown, or dropped from the ring
+            return None
+
+    def load(self, report_id: str) -> Optional[dict]:
+        report = self.read(report_id)
+        return None if report is None else json.loads(report)
+
+    def list(self) -> list:
+        """Summaries of the stored reports, newest first."""
+        summaries = []
+        for report_id in reversed(self._ids()):
+            report = self.load(report_id)
+            if report is not None:
+                summaries.append({key: report[key] for key in ("id", "time", "method", "path", "status",
+                                                               "duration_s", "trigger", "model_version")})
+                summaries[-1]["samples"] = report["profile"]["samples"]
+        return summaries
+
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware reporting the requests slower than `slow_s` (0 only reports the ones profiled by admins).
+    Admins profile a single request by sending `X-Profile: 1` with their bearer token, the response then names
+    its report in an `X-Profile-Report` header.
+    """
+
+    def __init__(self, app, profiler: Profiler, store: ReportStore, slow_s: float, admin_token: Optional[str]):
+        self.app = app
+        self.profiler = profiler
+        self.store = store
+        self.slow_s = slow_s
+        self.admin_token = admin_token
+
+    def _forced(self, headers: Headers) -> bool:
+        if self.admin_token is None or headers.get(PROFILE_HEADER) != "1":
+            return False
+        return hmac.compare_digest(headers.get("authorization", ""), f"Bearer {self.admin_token}")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.profiler.running:
+            await self.app(scope, receive, send)
+            return
+        headers = Headers(scope=scope)
+        forced = self._forced(headers)
+        if not forced and self.slow_s <= 0:
+            await self.app(scope, receive, send)
+            return
+
+        trace = self.profiler.begin(forced)
+        context = _current_trace.set(trace)
+        response = {"status": 500, "model_version": None}
+
+        async def send_traced(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+                response["model_version"] = Headers(raw=message.get("headers", [])).get("x-model-version")
+                if forced:
+                    message = {**message, "headers": list(message.get("headers", []))
+                               + [(b"x-profile-report", trace.id.encode())]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_traced)
+        finally:
+            self.profiler.end(trace)
+            _current_trace.reset(context)
+            duration = time.perf_counter() - trace.start
+            if forced or duration >= self.slow_s:
+                request = {"method": scope["method"], "path": scope["path"],
+                           "query": scope.get("query_string", b"").decode("latin-1")}
+                await run_in_threadpool(self._save, trace, request, response, duration,
+                                        dict(request_timings() or {}))
+
+    def _save(self, trace: Trace, request: dict, response: dict, duration: float, stages: dict):
+        """Build and store the report of a request, failures are logged and never reach the client."""
+        try:
+            self.store.save({
+                "id": trace.id,
+                "time": time.time() - duration,
+                "pid": os.getpid(),
+                **request,
+                **response,
+                "duration_s": duration,
+                "trigger": "header" if trace.forced else "slow",
+                "stages": stages,
+                "payload": describe_payloads(trace.payloads),
+                "profile": {
+                    "interval_s": self.profiler.interval_s,
+                    "sampled_after_s": 0.0 if trace.forced else self.profiler.sample_after_s,
+                    "samples": trace.samples,
+                    "stacks": dict(trace.stacks.most_common(MAX_STACKS)),
+                },
+            })
+        except Exception as e:
+            logger.error(f"Failed to save the profile report {trace.id}: {e}")
@@ -0,0 +1,301 @@
+import json
+import os
+import random
+import threading
+import time
+import traceback
+import zlib
+from typing import Optional
+
+import numpy as np
+import ydf
+
+from cache import RowCache
+from gaze_features import DEFAULT_WINDOW, ROLLING_FEATURES, RollingWindow
+from metrics import record_model_inference, record_model_roles
+from tuning import tune_inference
+from utils import logger, preprocess_columns, synthetic_payload
+
+"""
+Versioned model registry with hot reload. A registry directory holds one YDF model directory per
+version and a `registry.json` control file naming the active version and, optionally, a candidate
+that receives a fraction of the traffic:
+
+    models/
+        2024-11-02/            <- ydf model directory, optionally with a labels.json label mapping and a
+                                  features.json with the rolling window of its features ({"rolling_window": 32})
+        2024-12-15/
+        registry.json          {"active": "2024-11-02", "candidate": "2024-12-15", "canary_fraction": 0.1}
+
+Every worker process watches the control file, loads and warms new versions in a background thread,
+and swaps them in atomically: a request keeps the version it picked until it is answered, so no
+in-flight request is dropped.
+"""
+CONTROL_FILE = "registry.json"
+LABELS_FILE = "labels.json"
+FEATURES_FILE = "features.json"
+
+# Activity of each model label, used when a version has no labels.json
+DEFAULT_LABEL_MAPPING = {
+    "1": "walking",
+    "3": "playing",
+    "2": "reading"
+}
+
+
+class ModelVersion:
+    def __init__(self, name: str, path: str, row_cache_rows: int = 0, num_threads: Optional[int] = None):
+        """
+        Load one model version.
+        Args:
+            name (str): Version name, the model directory name in a registry.
+            path (str): The YDF model directory.
+            row_cache_rows (int): Size of this version's row cache, 0 disables it.
+            num_threads (int, optional): Threads per `model.predict` call, None uses every core.
+        """
+        started = time.perf_counter()
+        self.name = name
+        self.path = path
+        self.model = ydf.load_model(path)
+        self.label_classes = self.model.label_classes()
+        label_mapping = DEFAULT_LABEL_MAPPING
+        labels_path = os.path.join(path, LABELS_FILE)
+        if os.path.exists(labels_path):
+            with open(labels_path) as file:
+                label_mapping = json.load(file)
+        # Activity name of each column of the model predictions
+        self.class_names = [label_mapping[label] for label in self.label_classes]
+        # Rolling-window features the model was trained with, computed on the preprocessed rows
+        self.rolling_features = [name for name in self.model.input_feature_names() if name in ROLLING_FEATURES]
+        self.rolling_window = DEFAULT_WINDOW
+        features_path = os.path.join(path, FEATURES_FILE)
+        if os.path.exists(features_path):
+            with open(features_path) as file:
+                self.rolling_window = json.load(file).get("rolling_window", DEFAULT_WINDOW)
+        # Predictions depend on the model, so each version caches its own rows
+        self.row_cache = RowCache(row_cache_rows, name=f"row:{name}")
+        self.num_threads = num_threads
+        self.engine: Optional[str] = None  # None until `tune` picks one, YDF uses the fastest compatible engine
+        self.load_s = time.perf_counter() - started
+        self.warmup_s: Optional[float] = None
+        logger.info(f"Loaded model {name} from {path} in {self.load_s:.3f}s, label_classes: {self.label_classes}")
+
+    def predict(self, columns: dict) -> np.ndarray:
+        """`model.predict`, recording the latency and the outputs of this version."""
+        start = time.perf_counter()
+        predictions = self.model.predict(columns, num_threads=self.num_threads)
+        record_model_inference(self.name, self.class_names, predictions, time.perf_counter() - start)
+        return predictions
+
+    def add_features(self, batch_input: dict, window: Optional[RollingWindow] = None) -> dict:
+        """
+        Add the rolling-window features of the model to preprocessed columns, in place.
+        Args:
+            batch_input (dict): Preprocessed columns of consecutive samples of one recording.
+            window (RollingWindow, optional): State of the stream the samples continue, e.g. a session,
+                None starts a new one.
+        Returns:
+            dict: The same columns.
+        """
+        if self.rolling_features:
+            if window is None:
+                features = RollingWindow(self.rolling_window).extend(batch_input)
+            else:  # a stream adds its short chunks sample by sample
+                features = window.add(batch_input)
+            batch_input.update((name, features[name]) for name in self.rolling_features)
+        return batch_input
+
+    def warmup(self, rows: int, on_first_prediction=None):
+        """Run the full preprocessing and inference path on synthetic data before taking traffic."""
+        started = time.perf_counter()
+        batch_input = self.add_features(preprocess_columns(synthetic_payload(rows)))
+        for i in range(3):
+            self.model.predict(batch_input, num_threads=self.num_threads)
+            if i == 0 and on_first_prediction is not None:
+                on_first_prediction()
+        self.warmup_s = time.perf_counter() - started
+
+    def tune(self, rows: int, max_threads: int, engine: Optional[str] = None, num_threads: int = 0,
+             duration_s: float = 2.0):
+        """
+        Pick the inference engine and the threads per call by benchmarking a synthetic batch (see `tune_inference`).
+        A `duration_s` of 0 skips the benchmark and applies `engine` and `num_threads` (or `max_threads`).
+        """
+        if duration_s <= 0:
+            if engine:
+                self.model.force_engine(engine)
+            self.engine, self.num_threads = engine, num_threads or max_threads
+            return
+        batch_input = self.add_features(preprocess_columns(synthetic_payload(rows)))
+        self.engine, self.num_threads, report = tune_inference(self.model, batch_input, max_threads, engine,
+                                                               num_threads, duration_s)
+        measured = ", ".join(
+            [f"{name} {duration * 1e6:.3f}us/example" for name, duration in report.get("engines", {}).items()]
+            + [f"{count} threads {duration * 1e3:.2f}ms" for count, duration in report.get("threads", {}).items()]
+        )
+        logger.info(f"Model {self.name} inference: engine {self.engine}, {self.num_threads} threads per call "
+                    f"(of {max_threads})" + (f", measured {measured} on {rows} rows" if measured else ""))
+
+
+class ModelRegistry:
+    def __init__(self, root: Optional[str], model_path: str, warmup_rows: int, row_cache_rows: int = 0,
+                 poll_s: float = 5.0, tuning: Optional[dict] = None):
+        """
+        Args:
+            root (str, optional): Registry directory, None serves `model_path` as the only version.
+            model_path (str): Model directory used without a registry, or when the registry names no version.
+            warmup_rows (int): Rows of the synthetic batch used to warm a version before it takes traffic.
+            row_cache_rows (int): Row cache size of each version.
+            poll_s (float): How often each worker checks the control file for changes.
+            tuning (dict, optional): `ModelVersion.tune` arguments applied to every version before it takes
+                traffic, None keeps the YDF defaults.
+        """
+        self.root = root
+        self.warmup_rows = warmup_rows
+        self.row_cache_rows = row_cache_rows
+        self.poll_s = poll_s
+        self.tuning = tuning
+        self.candidate: Optional[ModelVersion] = None
+        self.canary_fraction = 0.0
+        self.errors = {}  # version -> error of its last failed load
+        self._applied = None  # last control state fully applied
+        self._reconcile_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        control = self.read_control()
+        active = control.get("active") or (self.versions()[-1] if self.versions() else None)
+        if active is None:
+            self.active = ModelVersion(os.path.basename(os.path.normpath(model_path)), model_path, row_cache_rows)
+        else:
+            self.active = ModelVersion(active, self.version_path(active), row_cache_rows)
+        record_model_roles(self.active.name, None)
+
+    @property
+    def hot_reload(self) -> bool:
+        return self.root is not None
+
+    def version_path(self, name: str) -> str:
+        return os.path.join(self.root, name)
+
+    def versions(self) -> list:
+        """Names of the model versions in the registry, oldest first by name."""
+        if not self.hot_reload or not os.path.isdir(self.root):
+            return []
+        return sorted(name for name in os.listdir(self.root) if os.path.isdir(self.version_path(name)))
+
+    def read_control(self) -> dict:
+        if not self.hot_reload:
+            return {}
+        try:
+            with open(os.path.join(self.root, CONTROL_FILE)) as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return {}
+
+    def write_control(self, **changes) -> dict:
+        """Update the control file atomically, every worker applies it within `poll_s`."""
+        if not self.hot_reload:
+            raise ValueError("Hot reload is disabled, set SEETRUE_MODEL_REGISTRY to a registry directory")
+        for key in ("active", "candidate"):
+            version = changes.get(key)
+            if version is not None and version not in self.versions():
+                raise ValueError(f"Unknown model version {version}")
+        control = {"active": self.active.name, "candidate": None, "canary_fraction": 0.0}
+        control.update(self.read_control())
+        control.update(changes)
+        if control["candidate"] is None:
+            control["canary_fraction"] = 0.0
+        temporary_path = os.path.join(self.root, f".{CONTROL_FILE}.{os.getpid()}")
+        with open(temporary_path, "w") as file:
+            json.dump(control, file)
+        os.replace(temporary_path, os.path.join(self.root, CONTROL_FILE))
+        return control
+
+    def choose(self, key: Optional[str] = None) -> ModelVersion:
+        """
+        Version that serves a request. A `key` (e.g. a session id) always gets the same version,
+        in every worker, while the canary settings are unchanged.
+        """
+        candidate = self.candidate
+        if candidate is None or self.canary_fraction <= 0:
+            return self.active
+        draw = random.random() if key is None else zlib.crc32(key.encode()) / 2 ** 32
+        return candidate if draw < self.canary_fraction else self.active
+
+    def load(self, name: str) -> ModelVersion:
+        """Load and warm a version of the registry, reusing it if it is already serving."""
+        for version in (self.active, self.candidate):
+            if version is not None and version.name == name:
+                return version
+        version = ModelVersion(name, self.version_path(name), self.row_cache_rows)
+        if self.tuning is not None:
+            version.tune(**self.tuning)
+        version.warmup(self.warmup_rows)
+        logger.info(f"Model {name} warmed up in {version.warmup_s:.3f}s")
+        return version
+
+    def reconcile(self):
+        """Bring this worker in line with the control file. Blocking, runs in the watcher thread."""
+        with self._reconcile_lock:
+            control = self.read_control()
+            state = (control.get("active"), control.get("candidate"), float(control.get("canary_fraction") or 0))
+            if state == self._applied:
+                return
+            active_name, candidate_name, fraction = state
+            try:
+                # Load and warm everything before changing what serves traffic
+                active = self.load(active_name) if active_name else self.active
+                candidate = self.load(candidate_name) if candidate_name else None
+            except Exception as e:
+                failed = active_name if active_name and active_name != self.active.name else candidate_name
+                self.errors[failed] = str(e)
+                self._applied = state  # Do not retry the same broken state on every poll
+                logger.error(f"Failed to load model {failed}: {e} \n {traceback.format_exc()}")
+                return
+            # Each assignment is atomic, requests that already chose a version keep using it
+            self.candidate = None
+            self.active = active
+            self.canary_fraction = fraction
+            self.candidate = candidate
+            self._applied = state
+            for name in (active_name, candidate_name):
+                self.errors.pop(name, None)
+            record_model_roles(self.active.name, candidate.name if candidate else None)
+            logger.info(f"Serving model {self.active.name}"
+                        + (f", canary {candidate.name} at {fraction:.1%}" if candidate else ""))
+
+    def start(self):
+        """Start watching the control file (in each worker, threads do not survive the fork)."""
+        if self.hot_reload and self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._watch, name="model-registry", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def _watch(self):
+        while not self._stop.is_set():
+            try:
+                self.reconcile()
+            except Exception as e:
+                logger.error(f"Model registry error : {str(e)} \n {traceback.format_exc()}")
+            self._stop.wait(self.poll_s)
+
+    def status(self) -> dict:
+        candidate = self.candidate
+        return {
+            "pid": os.getpid(),
+            "hot_reload": self.hot_reload,
+            "active": self.active.name,
+            "engine": self.active.engine,
+            "inference_threads": self.active.num_threads,
+            "candidate": candidate.name if candidate else None,
+            "canary_fraction": self.canary_fraction if candidate else 0.0,
+            "versions": self.versions(),
+            "errors": dict(self.errors),
+        }
@@ -0,0 +1,140 @@
+import asyncio
+import queue
+import threading
+import time
+import traceback
+from typing import Callable, Optional
+
+import numpy as np
+
+from metrics import record_inference
+from utils import logger
+
+"""
+Micro-batching scheduler for model inference. Requests are queued and a worker thread merges
+the requests that arrive together into a single `model.predict` call, so the event loop is never
+blocked by inference and many small uploads share the per-call overhead.
+"""
+_STOP = object()  # Queue sentinel that shuts the worker thread down
+
+
+class InferenceScheduler:
+    def __init__(self, predict_fn: Callable[[dict], np.ndarray], max_batch_rows: int, max_wait_ms: float):
+        """
+        Args:
+            predict_fn (Callable): Runs the model on a dict of columns and returns one row per sample.
+            max_batch_rows (int): Stop merging once a batch holds this many rows.
+            max_wait_ms (float): Longest time the first request of a batch waits for others.
+        """
+        self.predict_fn = predict_fn
+        self.max_batch_rows = max_batch_rows
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+        self._carry = None  # Request taken from the queue that did not fit in the previous batch
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="inference-scheduler", daemon=True)
+            self._thread.start()
+            logger.info(f"Inference scheduler started: max_batch_rows={self.max_batch_rows}, "
+                        f"max_wait_ms={self.max_wait * 1000.0}")
+
+    def stop(self):
+        if self._thread is not None:
+            self._queue.put(_STOP)
+            self._thread.join()
+            self._thread = None
+
+    async def predict(self, columns: dict, predict_fn: Optional[Callable[[dict], np.ndarray]] = None) -> np.ndarray:
+        """
+        Queue the columns for inference and wait for their predictions.
+        Args:
+            columns (dict): Model-ready columns of a single request.
+            predict_fn (Callable, optional): Model to use instead of the default one, e.g. a candidate version.
+                Only requests for the same model are merged.
+        Returns:
+            np.ndarray: The predictions for these rows only.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._queue.put((columns, len(columns["timestamp"]), loop, future, predict_fn or self.predict_fn))
+        return await future
+
+    def _next_batch(self) -> Optional[list]:
+        """Block until a request arrives, then collect more until the batch is full or the wait is over."""
+        first = self._carry if self._carry is not None else self._queue.get()
+        self._carry = None
+        if first is _STOP:
+            return None
+        batch = [first]
+        rows = first[1]
+        deadline = time.monotonic() + self.max_wait
+        while rows < self.max_batch_rows:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is _STOP or rows + item[1] > self.max_batch_rows or item[4] != first[4]:
+                self._carry = item
+                break
+            batch.append(item)
+            rows += item[1]
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            try:
+                if len(batch) == 1:
+                    merged = batch[0][0]
+                else:
+                    merged = {key: np.concatenate([item[0][key] for item in batch]) for key in batch[0][0]}
+                start = time.perf_counter()
+                predictions = batch[0][4](merged)
+                record_inference(len(predictions), time.perf_counter() - start)
+                offsets = np.cumsum([item[1] for item in batch])[:-1]
+                for (_, _, loop, future, _), result in zip(batch, np.split(predictions, offsets)):
+                    loop.call_soon_threadsafe(_set_result, future, result)
+            except Exception as e:
+                trace_back_msg = traceback.format_exc()
+                logger.error(f"Error during batched inference : {str(e)} \n {trace_back_msg}")
+                if len(batch) == 1:
+                    loop, future = batch[0][2:4]
+                    loop.call_soon_threadsafe(_set_exception, future, e)
+                else:
+                    # Score the requests one by one, so a bad one only fails itself
+                    for item in batch:
+                        self._predict_one(item)
+
+    @staticmethod
+    def _predict_one(item: tuple):
+        columns, _, loop, future, predict_fn = item
+        try:
+            start = time.perf_counter()
+            predictions = predict_fn(columns)
+            record_inference(len(predictions), time.perf_counter() - start)
+            loop.call_soon_threadsafe(_set_result, future, predictions)
+        except Exception as e:
+            logger.error(f"Error during inference : {str(e)}")
+            loop.call_soon_threadsafe(_set_exception, future, e)
+
+
+def _set_result(future: asyncio.Future, result):
+    # The request may have been cancelled while waiting (e.g. client disconnected)
+    if not future.done():
+        future.set_result(result)
+
+
+def _set_exception(future: asyncio.Future, exception: Exception):
+    if not future.done():
+        future.set_exception(exception)
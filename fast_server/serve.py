@@ -0,0 +1,74 @@
+import os
+import signal
+
+import uvicorn
+
+from utils import logger
+
+"""
+Pre-fork serving. The model is loaded and warmed once in the parent process, then the workers are
+forked and share it copy-on-write, so adding workers costs neither extra model loads nor startup time.
+"""
+
+
+def available_cores() -> int:
+    """Number of cores this process may run on (respects container CPU affinity)."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def serve(app, host: str, port: int, workers: int):
+    """
+    Serve the app with `workers` forked processes sharing one listening socket.
+    Args:
+        app: The ASGI application, already holding the loaded model.
+        host (str): Interface to bind.
+        port (int): Port to bind.
+        workers (int): Number of worker processes, 1 serves in this process.
+    """
+    config = uvicorn.Config(app, host=host, port=port, access_log=True)
+    if workers <= 1 or not hasattr(os, "fork"):
+        uvicorn.Server(config).run()
+        return
+
+    sock = config.bind_socket()
+    children = set()
+    stopping = False
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            # Worker: uvicorn installs its own signal handlers
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            try:
+                uvicorn.Server(config).run(sockets=[sock])
+            finally:
+                os._exit(0)
+        children.add(pid)
+
+    def shutdown(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in children:
+            os.kill(pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    for _ in range(workers):
+        spawn()
+    logger.info(f"Started {workers} workers on {host}:{port}")
+
+    while children:
+        try:
+            pid, exit_status = os.wait()
+        except ChildProcessError:
+            break
+        children.discard(pid)
+        if not stopping:
+            logger.error(f"Worker {pid} exited with status {exit_status}, restarting it")
+            spawn()
+    sock.close()
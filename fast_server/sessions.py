@@ -0,0 +1,91 @@
+import asyncio
+import math
+import time
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+
+from gaze_features import RollingWindow
+from utils import logger
+
+"""
+Per-session state for continuous gaze feeds. A session carries the last Euclidean distance
+across payloads, so the 'FB' rule continues where the previous chunk stopped, the rolling window of the
+gaze features, so they continue too, and running per-class probability sums, so each update only scores
+the new samples.
+"""
+
+
+class SessionState:
+    __slots__ = ("prev_euclidean_distance", "window", "probability_sums", "count", "last_seen", "lock")
+
+    def __init__(self, num_classes: int):
+        self.prev_euclidean_distance: Optional[float] = None
+        self.window: Optional[RollingWindow] = None  # created by the first chunk, for models with rolling features
+        self.probability_sums = np.zeros(num_classes)
+        self.count = 0  # Amount of processed data over the whole session
+        self.last_seen = time.monotonic()
+        self.lock = asyncio.Lock()  # Chunks of one session are processed in order
+
+    def update(self, columns: dict, predictions: np.ndarray):
+        """Fold the predictions of a processed chunk into the running state."""
+        if len(predictions) == 0:
+            return
+        last_distance = float(columns["euclidean_distance"][-1])
+        self.prev_euclidean_distance = None if math.isnan(last_distance) else last_distance
+        self.probability_sums += predictions.sum(axis=0, dtype=np.float64)
+        self.count += len(predictions)
+
+    def means(self) -> np.ndarray:
+        """Mean probability of each class over every sample seen by the session."""
+        if self.count == 0:
+            return np.zeros_like(self.probability_sums)
+        return self.probability_sums / self.count
+
+
+class SessionStore:
+    def __init__(self, num_classes: int, max_sessions: int, idle_timeout_s: float):
+        """
+        Args:
+            num_classes (int): Number of model label classes.
+            max_sessions (int): Memory budget, the least recently used sessions are evicted above it.
+            idle_timeout_s (float): Sessions without updates for this long are evicted.
+        """
+        self.num_classes = num_classes
+        self.max_sessions = max_sessions
+        self.idle_timeout_s = idle_timeout_s
+        self._sessions: "OrderedDict[str, SessionState]" = OrderedDict()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def get(self, session_id: str) -> SessionState:
+        """Return the session, creating it if needed, and mark it as most recently used."""
+        now = time.monotonic()
+        self.evict_idle(now)
+        session = self._sessions.get(session_id)
+        if session is None:
+            # Make room by dropping the least recently used sessions
+            while len(self._sessions) >= self.max_sessions:
+                self._sessions.popitem(last=False)
+            session = SessionState(self.num_classes)
+            self._sessions[session_id] = session
+        else:
+            self._sessions.move_to_end(session_id)
+        session.last_seen = now
+        return session
+
+    def pop(self, session_id: str) -> Optional[SessionState]:
+        return self._sessions.pop(session_id, None)
+
+    def evict_idle(self, now: Optional[float] = None):
+        """Drop the sessions that have not been updated within the idle timeout."""
+        now = time.monotonic() if now is None else now
+        evicted = 0
+        # Sessions are kept in last-used order, so idle ones are at the front
+        while self._sessions and now - next(iter(self._sessions.values())).last_seen >= self.idle_timeout_s:
+            self._sessions.popitem(last=False)
+            evicted += 1
+        if evicted:
+            logger.info(f"Evicted {evicted} idle sessions, {len(self._sessions)} active")
@@ -0,0 +1,93 @@
+import statistics
+import time
+from typing import Optional
+
+from serve import available_cores
+from utils import logger
+
+"""
+Startup self-benchmark of the YDF inference settings. YDF runs every `model.predict` call on all the cores of the
+machine by default, so worker processes that predict at the same time oversubscribe them. Each worker gets an
+equal share of the cores, and the benchmark picks, within that share, the fastest inference engine and the
+thread count with the lowest latency on a representative batch.
+"""
+# A thread count is only picked over a smaller one when it is faster by more than this fraction
+THREAD_GAIN = 0.05
+
+
+def thread_budget(workers: int) -> int:
+    """Inference threads per `model.predict` call that keep `workers` processes from oversubscribing the cores."""
+    return max(available_cores() // max(workers, 1), 1)
+
+
+def benchmark_engines(model, batch_input: dict, engines: list, duration_s: float) -> dict:
+    """
+    Single-threaded time per example of each engine, measured by YDF's C++ inference benchmark.
+    Returns:
+        dict: Engine name -> seconds per example, for the engines that ran.
+    """
+    timings = {}
+    for engine in engines:
+        try:
+            model.force_engine(engine)
+            result = model.benchmark(batch_input, benchmark_duration=duration_s, warmup_duration=duration_s / 4,
+                                     batch_size=len(batch_input["timestamp"]), num_threads=1)
+            timings[engine] = result.duration_per_example
+        except Exception as e:
+            logger.warning(f"Inference engine {engine} failed its benchmark: {e}")
+    return timings
+
+
+def benchmark_threads(model, batch_input: dict, max_threads: int, duration_s: float) -> dict:
+    """
+    Median latency of `model.predict` on the batch with 1, 2, 4... up to `max_threads` threads, the way
+    requests are served (including the conversion of the columns).
+    Returns:
+        dict: Thread count -> seconds per call.
+    """
+    counts = sorted({min(2 ** power, max_threads) for power in range(max_threads.bit_length() + 1)})
+    start = time.perf_counter()
+    model.predict(batch_input, num_threads=max_threads)
+    # Share the time budget between the thread counts, at least 3 calls each
+    repeat = min(max(int(duration_s / len(counts) / (time.perf_counter() - start + 1e-9)), 3), 50)
+    timings = {}
+    for num_threads in counts:
+        durations = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            model.predict(batch_input, num_threads=num_threads)
+            durations.append(time.perf_counter() - start)
+        timings[num_threads] = statistics.median(durations)
+    return timings
+
+
+def tune_inference(model, batch_input: dict, max_threads: int, engine: Optional[str] = None,
+                   num_threads: int = 0, duration_s: float = 2.0) -> tuple:
+    """
+    Pick the inference engine and the threads per call of a model, leaving fixed the ones that are set.
+    Args:
+        model: The YDF model, its engine is forced to the chosen one.
+        batch_input (dict): Representative preprocessed batch.
+        max_threads (int): Most threads a call may use.
+        engine (str, optional): Engine to use, None benchmarks every compatible engine.
+        num_threads (int): Threads per call, 0 benchmarks 1 to `max_threads`.
+        duration_s (float): Approximate time budget of the benchmark.
+    Returns:
+        tuple: The engine, the threads per call and the measurements (engine and thread timings).
+    """
+    engines = [engine] if engine else model.list_compatible_engines()
+    report = {}
+    if len(engines) > 1:
+        report["engines"] = benchmark_engines(model, batch_input, engines, duration_s / 2 / len(engines))
+        if report["engines"]:
+            engines = [min(report["engines"], key=report["engines"].get)]
+    model.force_engine(engines[0])
+
+    if not num_threads:
+        num_threads = max_threads
+        if max_threads > 1:
+            report["threads"] = benchmark_threads(model, batch_input, max_threads, duration_s / 2)
+            best = min(report["threads"].values())
+            num_threads = min(count for count, duration in report["threads"].items()
+                              if duration <= best * (1 + THREAD_GAIN))
+    return engines[0], num_threads, report
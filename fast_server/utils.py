@@ -5,6 +5,8 @@ from typing import Optional
 import numpy as np
 import re
 
+from metrics import timed
+
 # Set up logging to both file and console
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
 logger = logging.getLogger()
@@ -112,3 +114,313 @@ def preprocess_data(payload: dict) -> list:
         logger.error(f"Error processing data : {str(e)} \n {trace_back_msg}")
         # print(f"Error Error processing data: {e}")
         raise
+
+
+"""
+Columnar preprocessing. The functions below work on whole NumPy columns instead of
+per-sample dicts and produce exactly the same features as `preprocess_data`.
+"""
+# Column order expected by the model
+FEATURE_COLUMNS = [
+    "timestamp",
+    "gazepoint_x",
+    "gazepoint_y",
+    "pupil_area_right_sq_mm",
+    "pupil_area_left_sq_mm",
+    "eye_event",
+    "euclidean_distance",
+]
+NUMERIC_COLUMNS = FEATURE_COLUMNS[:5]
+
+# Anchored version of `pattern`, so the bulk extraction keeps the `re.match` semantics
+anchored_pattern = re.compile("^" + pattern)
+# Code points `str.strip` removes
+WHITESPACE_CODES = np.array([c for c in range(0x3001) if chr(c).isspace()], dtype=np.uint32)
+
+
+def char_codes(values: np.ndarray) -> np.ndarray:
+    """View a str array as a (rows, width) matrix of code points, NUL-padded, without copying."""
+    return values.view(np.uint32).reshape(len(values), values.dtype.itemsize // 4)
+
+
+def starts_with(values: np.ndarray, prefix: str) -> np.ndarray:
+    """Vectorized `str.startswith` for a str array (np.char.startswith loops in Python)."""
+    codes = char_codes(values)
+    if codes.shape[1] < len(prefix):
+        return np.zeros(len(values), dtype=bool)
+    return (codes[:, :len(prefix)] == [ord(char) for char in prefix]).all(axis=1)
+
+
+def stripped_equal(values: np.ndarray, target: str) -> np.ndarray:
+    """Vectorized `value.strip() == target`, only the values padded with whitespace are stripped."""
+    equal = values == target
+    codes = char_codes(values)
+    if codes.shape[1] == 0:
+        return equal
+    lengths = codes.shape[1] - np.argmax(codes[:, ::-1] != 0, axis=1)
+    last = codes[np.arange(len(values)), np.maximum(lengths - 1, 0)]
+    padded = ~equal & (np.isin(codes[:, 0], WHITESPACE_CODES) | np.isin(last, WHITESPACE_CODES))
+    if padded.any():
+        equal[padded] = np.char.strip(values[padded]) == target
+    return equal
+
+
+def to_columns(payload: dict) -> dict:
+    """
+    Convert a JSON-like batch payload into NumPy columns.
+    Args:
+        payload (dict): Mapping of column name to a sequence of values.
+    Returns:
+        dict: float64 arrays for the numeric columns and a str array for 'eye_event'.
+    """
+    columns = {key: np.asarray(payload.get(key, []), dtype=np.float64) for key in NUMERIC_COLUMNS}
+    columns["eye_event"] = np.asarray(payload.get("eye_event", []), dtype=str)
+    return columns
+
+
+def remove_na_columns(columns: dict) -> dict:
+    """
+    Vectorized counterpart of `remove_na_row` for NumPy columns.
+    Args:
+        columns (dict): Columns as returned by `to_columns`.
+    Returns:
+        dict: The columns with rows where 'eye_event' is 'NA' removed.
+    """
+    try:
+        keep = ~stripped_equal(columns["eye_event"], "NA")
+        if keep.all():
+            return dict(columns)
+        return {key: values[keep] for key, values in columns.items()}
+    except Exception as e:
+        trace_back_msg = traceback.format_exc()
+        logger.error(f"Error during NA removal : {str(e)} \n {trace_back_msg}")
+        raise
+
+
+def extract_fixation_components(eye_event: np.ndarray) -> tuple:
+    """
+    Extract the x, y and d components of every 'FEx..y..d..' event in one pass.
+    Args:
+        eye_event (np.ndarray): Eye event strings.
+    Returns:
+        tuple: Three float64 arrays (x, y, d), NaN where the event does not match.
+    """
+    components = np.full((3, len(eye_event)), np.nan)
+    # Only events starting with 'FEx' can match, skip the regex for everything else
+    candidates = np.flatnonzero(starts_with(eye_event, "FEx"))
+    if len(candidates):
+        matches = [anchored_pattern.match(event) for event in eye_event[candidates].tolist()]
+        matched = [i for i, match in enumerate(matches) if match]
+        if matched:
+            components[:, candidates[matched]] = np.array(
+                [matches[i].groups() for i in matched], dtype=np.float64
+            ).T
+    return components[0], components[1], components[2]
+
+
+def calculate_euclidean_distances(eye_event: np.ndarray) -> np.ndarray:
+    """
+    Vectorized counterpart of `calculate_euclidean_distance`.
+    Args:
+        eye_event (np.ndarray): Eye event strings.
+    Returns:
+        np.ndarray: The rounded distances, NaN where the event carries no coordinates.
+    """
+    try:
+        x, y, d = extract_fixation_components(eye_event)
+        return np.round(np.sqrt(x ** 2 + y ** 2) * d, 4)
+    except Exception as e:
+        trace_back_msg = traceback.format_exc()
+        logger.error(f"Error while calculating euclidean distance : {str(e)} \n {trace_back_msg}")
+        raise
+
+
+def fill_missing_distances(eye_event: np.ndarray, distances: np.ndarray,
+                           prev_euclidean_distance: Optional[float] = None) -> np.ndarray:
+    """
+    Apply the `preprocess_data` fallback rules to the NaN distances in place:
+        * 'S', 'BB' and 'BE' events get 0.0
+        * 'FB' events get the distance of the previous row, or 1.0 if it is missing or 0.0
+    Args:
+        eye_event (np.ndarray): Eye event strings.
+        distances (np.ndarray): Distances from `calculate_euclidean_distances`.
+        prev_euclidean_distance (float, optional): Distance of the row before the first one,
+            used to continue a stream that was split into several payloads.
+    Returns:
+        np.ndarray: The filled distances.
+    """
+    missing = np.isnan(distances)
+    distances[missing & np.isin(eye_event, ["S", "BB", "BE"])] = 0.0
+
+    fixation_begin = missing & (eye_event == "FB")
+    if fixation_begin.any():
+        # A run of 'FB' rows repeats the value of the last row before the run,
+        # so forward-fill the index of the last non-'FB' row
+        positions = np.arange(len(distances))
+        source = np.maximum.accumulate(np.where(fixation_begin, -1, positions))[fixation_begin]
+        initial = np.nan if prev_euclidean_distance is None else prev_euclidean_distance
+        previous = np.where(source >= 0, distances[np.maximum(source, 0)], initial)
+        # Same truthiness as `prev_euclidean_distance or 1.0`
+        distances[fixation_begin] = np.where(np.isnan(previous) | (previous == 0.0), 1.0, previous)
+    return distances
+
+
+def preprocess_columns(payload: dict, prev_euclidean_distance: Optional[float] = None) -> dict:
+    """
+    Columnar counterpart of `preprocess_data`.
+    Args:
+        payload (dict): The JSON-like batch payload, or columns from `to_columns`.
+        prev_euclidean_distance (float, optional): Last distance of the previous payload of the same stream.
+    Returns:
+        dict: Model-ready columns (see `FEATURE_COLUMNS`), missing distances are NaN.
+    """
+    try:
+        # Step 1: Remove rows with 'NA' in 'eye_event'
+        with timed("na_removal"):
+            columns = remove_na_columns(to_columns(payload))
+
+        # Step 2: Calculate Euclidean Distance for every row at once
+        with timed("euclidean_distance"):
+            distances = calculate_euclidean_distances(columns["eye_event"])
+
+        # Step 3: Fill the rows without coordinates
+        with timed("distance_fill"):
+            columns["euclidean_distance"] = fill_missing_distances(
+                columns["eye_event"], distances, prev_euclidean_distance
+            )
+
+        return {key: columns[key] for key in FEATURE_COLUMNS}
+    except Exception as e:
+        trace_back_msg = traceback.format_exc()
+        logger.error(f"Error processing data : {str(e)} \n {trace_back_msg}")
+        raise
+
+
+def class_means(predictions: np.ndarray) -> np.ndarray:
+    """
+    Mean probability of each class over all the predicted rows.
+    Args:
+        predictions (np.ndarray): Model output, one row per sample and one column per label class.
+    Returns:
+        np.ndarray: The per-class means, zeros when there are no rows.
+    """
+    if len(predictions) == 0:
+        return np.zeros(predictions.shape[1:])
+    return predictions.sum(axis=0, dtype=np.float64) / len(predictions)
+
+
+def window_means(predictions: np.ndarray, timestamps: np.ndarray, window: float, stride: float) -> tuple:
+    """
+    Mean probability of each class over sliding windows of the timestamp axis, using cumulative sums.
+    Windows are [start, start + window) with start going from the first timestamp by `stride`.
+    Args:
+        predictions (np.ndarray): Model output, one row per sample and one column per label class.
+        timestamps (np.ndarray): Timestamp of every predicted row.
+        window (float): Window length in timestamp units.
+        stride (float): Distance between the starts of two windows.
+    Returns:
+        tuple: Window starts, per-window class means (zeros for empty windows) and per-window row counts.
+    """
+    if np.any(np.diff(timestamps) < 0):
+        order = np.argsort(timestamps, kind="stable")
+        timestamps, predictions = timestamps[order], predictions[order]
+
+    starts = timestamps[0] + stride * np.arange(int((timestamps[-1] - timestamps[0]) // stride) + 1)
+    cumulative = np.zeros((len(predictions) + 1,) + predictions.shape[1:])
+    np.cumsum(predictions, axis=0, dtype=np.float64, out=cumulative[1:])
+
+    lower = np.searchsorted(timestamps, starts, side="left")
+    upper = np.searchsorted(timestamps, starts + window, side="left")
+    counts = upper - lower
+    sums = cumulative[upper] - cumulative[lower]
+    means = np.divide(sums, counts[:, None], out=np.zeros_like(sums), where=counts[:, None] > 0)
+    return starts, means, counts
+
+
+# Eye events with a sampling stratum each, fixation ends ('FEx..y..d..') and any other value get one more each
+SAMPLING_EVENTS = ["S", "FB", "BB", "BE"]
+
+
+def stratified_order(eye_event: np.ndarray, timestamps: np.ndarray, time_bins: int = 8, seed: int = 0) -> np.ndarray:
+    """
+    Order the rows so that every prefix of the order is a stratified random sample: strata are the eye
+    event crossed with `time_bins` equal-count bins of the timestamp axis, and each stratum is represented
+    in proportion to its size whatever the prefix length.
+    Args:
+        eye_event (np.ndarray): Eye event strings.
+        timestamps (np.ndarray): Timestamp of every row.
+        time_bins (int): Number of time strata.
+        seed (int): Random seed, fixed so the same payload gets the same sample.
+    Returns:
+        np.ndarray: Row positions, in sampling order.
+    """
+    rng = np.random.default_rng(seed)
+    rows = len(eye_event)
+    events = np.full(rows, len(SAMPLING_EVENTS) + 1)
+    events[starts_with(eye_event, "FEx")] = len(SAMPLING_EVENTS)
+    for code, event in enumerate(SAMPLING_EVENTS):
+        events[eye_event == event] = code
+    time_rank = np.empty(rows, dtype=np.int64)
+    time_rank[np.argsort(timestamps, kind="stable")] = np.arange(rows)
+    strata = events * time_bins + time_rank * time_bins // max(rows, 1)
+
+    # Random position of each row within its stratum
+    permutation = rng.permutation(rows)
+    grouped = permutation[np.argsort(strata[permutation], kind="stable")]
+    sizes = np.bincount(strata)
+    firsts = np.cumsum(sizes) - sizes
+    position = np.empty(rows)
+    position[grouped] = np.arange(rows) - firsts[strata[grouped]]
+    # Interleave the strata by the fraction of their rows already taken
+    return np.argsort((position + rng.random(rows)) / sizes[strata], kind="stable")
+
+
+def sample_margin(sums: np.ndarray, squares: np.ndarray, sampled: int, population: int, z: float) -> np.ndarray:
+    """
+    Half-width of the confidence interval of each class mean estimated from a random sample.
+    Args:
+        sums (np.ndarray): Per-class sums of the sampled predictions.
+        squares (np.ndarray): Per-class sums of the squared sampled predictions.
+        sampled (int): Rows in the sample.
+        population (int): Rows the sample is drawn from, the interval is 0 once all of them are sampled.
+        z (float): Standard normal quantile of the confidence level, e.g. 1.96 for 95%.
+    Returns:
+        np.ndarray: The per-class half-widths.
+    """
+    mean = sums / sampled
+    variance = np.maximum(squares / sampled - mean ** 2, 0.0) * sampled / max(sampled - 1, 1)
+    finite_population = (population - sampled) / max(population - 1, 1)
+    return z * np.sqrt(variance / sampled * finite_population)
+
+
+# Approximate share of each eye event in the raw dataset
+RECORDED_EVENT_MIX = {"NA": 0.52, "S": 0.28, "FB": 0.09, "FE": 0.09, "BE": 0.01, "BB": 0.01}
+
+
+def synthetic_payload(rows: int, seed: int = 0, event_mix: Optional[dict] = None) -> dict:
+    """
+    Build a representative payload for warmup and benchmarks.
+    Args:
+        rows (int): Number of samples.
+        seed (int): Random seed.
+        event_mix (dict, optional): Share of each eye event, 'FE' rows get coordinates.
+            Defaults to `RECORDED_EVENT_MIX`.
+    Returns:
+        dict: NumPy columns in the `DataBatches` layout.
+    """
+    rng = np.random.default_rng(seed)
+    event_mix = event_mix or RECORDED_EVENT_MIX
+    events = np.array(list(event_mix), dtype=object)
+    weights = np.array(list(event_mix.values()), dtype=np.float64)
+    eye_event = events[rng.choice(len(events), size=rows, p=weights / weights.sum())]
+    fixations = eye_event == "FE"
+    x, y, d = rng.uniform(-1, 1, rows), rng.uniform(-1, 1, rows), rng.uniform(300, 900, rows)
+    eye_event[fixations] = [f"FEx{a:.4f}y{b:.4f}d{c:.4f}" for a, b, c in zip(x[fixations], y[fixations], d[fixations])]
+    return {
+        "timestamp": np.arange(1, rows + 1, dtype=np.float64),
+        "gazepoint_x": rng.uniform(0, 1, rows),
+        "gazepoint_y": rng.uniform(0, 1, rows),
+        "pupil_area_right_sq_mm": rng.uniform(0.2, 0.6, rows),
+        "pupil_area_left_sq_mm": rng.uniform(0.2, 0.6, rows),
+        "eye_event": eye_event,
+    }
@@ -0,0 +1,303 @@
+"""
+Train the serving model from the train/test split written by `create_train_test_data.py`, then export it in
+the layout `fast_server/model` expects.
+
+The split tables are converted once into a feature cache: one raw binary file per column, memory-mapped when
+training, so later runs skip parsing the CSV (or Parquet/Feather) files. Numeric columns are stored as float64
+(the label as int64) and text columns as int32 codes into a vocabulary kept in the cache manifest. A cache is
+rebuilt when its table changed (size or modification time).
+
+The random forest is trained on all the cores. Training time, memory, test accuracy and the inference
+latency on the test split are logged and saved in `training.json` next to the exported model, which also gets
+the `labels.json` label mapping and, for models with rolling features, the `features.json` read by the server
+with the window recorded next to the split by `create_train_test_data.py`.
+
+    python train_model.py [--split ../train_test_split] [--cache ../feature_cache] [--output ../fast_server/model]
+                          [--num-trees N] [--threads N] [--rolling-window N] [--chunksize N] [--rebuild-cache]
+"""
+import argparse
+import json
+import logging
+import os
+import shutil
+import statistics
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(HERE, '..', 'data_processing'))
+sys.path.append(os.path.join(HERE, '..', 'fast_server'))
+from create_train_test_data import activity_files
+from data_io import find_table, iter_table, read_rolling_window, rss_mb
+from data_path import DATA_SPLIT_PATH, FEATURE_CACHE_PATH, SERVING_MODEL_PATH
+from gaze_features import ROLLING_FEATURES
+from serve import available_cores
+
+# The split script and the server utils set up their own logging on import, log to the console and train_model.log only
+logger = logging.getLogger()
+for handler in list(logger.handlers):
+    logger.removeHandler(handler)
+logger.setLevel(logging.INFO)
+
+file_handler = logging.FileHandler('train_model.log')
+file_handler.setFormatter(logging.Formatter('%(asctime)s - %(message)s'))
+logger.addHandler(file_handler)
+
+console_handler = logging.StreamHandler(sys.stdout)
+console_handler.setFormatter(logging.Formatter('%(asctime)s - %(message)s'))
+logger.addHandler(console_handler)
+
+LABEL = 'result'
+# Bumped when the layout of the cache changes, older caches are rebuilt
+CACHE_VERSION = 1
+MANIFEST_FILE = 'manifest.json'
+# Files of the exported model read by fast_server/registry.py, and the training report
+LABELS_FILE = 'labels.json'
+FEATURES_FILE = 'features.json'
+REPORT_FILE = 'training.json'
+# Rows of the request-sized batch the inference latency is measured on, the server's warmup batch size
+LATENCY_ROWS = 1024
+
+
+def source_stamp(file_path):
+    stat = os.stat(file_path)
+    return {'path': os.path.abspath(file_path), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def read_manifest(cache_folder):
+    try:
+        with open(os.path.join(cache_folder, MANIFEST_FILE)) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def cache_is_fresh(cache_folder, file_path):
+    """Whether the cache folder holds a complete cache of the current content of the table."""
+    manifest = read_manifest(cache_folder)
+    if manifest is None or manifest.get('version') != CACHE_VERSION or manifest['source'] != source_stamp(file_path):
+        return False
+    return all(os.path.exists(os.path.join(cache_folder, column['file'])) for column in manifest['columns'].values())
+
+
+def build_cache(file_path, cache_folder, chunksize=100000):
+    """
+    Convert a table into the column files of a cache, reading it in chunks. The manifest is written last, so an
+    interrupted conversion is rebuilt by the next run.
+    Returns:
+        dict: The manifest of the cache.
+    """
+    shutil.rmtree(cache_folder, ignore_errors=True)
+    os.makedirs(cache_folder)
+    columns = {}
+    vocabularies = {}  # text column -> {value: code}
+    rows = 0
+    for chunk in iter_table(file_path, chunksize):
+        for name in chunk.columns:
+            values = chunk[name]
+            if name not in columns:
+                if name == LABEL:
+                    dtype = 'int64'
+                elif pd.api.types.is_numeric_dtype(values) or pd.api.types.is_bool_dtype(values):
+                    dtype = 'float64'
+                else:
+                    dtype = 'int32'
+                    vocabularies[name] = {}
+                columns[name] = {'file': f"{len(columns)}.bin", 'dtype': dtype}
+            if name in vocabularies:
+                # Codes into the vocabulary, -1 for missing values
+                vocabulary = vocabularies[name]
+                categorical = pd.Categorical(values.astype(object).where(values.notna(), None))
+                for category in categorical.categories:
+                    vocabulary.setdefault(str(category), len(vocabulary))
+                mapping = np.array([vocabulary[str(category)] for category in categorical.categories] + [-1],
+                                   dtype=np.int32)
+                data = mapping[categorical.codes]
+            else:
+                data = pd.to_numeric(values).to_numpy(dtype=columns[name]['dtype'])
+            with open(os.path.join(cache_folder, columns[name]['file']), 'ab') as file:
+                data.tofile(file)
+        rows += len(chunk)
+    for name, vocabulary in vocabularies.items():
+        columns[name]['categories'] = list(vocabulary)
+
+    manifest = {'version': CACHE_VERSION, 'source': source_stamp(file_path), 'rows': rows, 'columns': columns}
+    with open(os.path.join(cache_folder, MANIFEST_FILE), 'w') as file:
+        json.dump(manifest, file)
+    return manifest
+
+
+def load_cache(cache_folder):
+    """
+    Columns of a cache, memory-mapped except the text columns, which are decoded into string arrays (missing
+    values are empty strings, which YDF reads as missing).
+    Returns:
+        dict: Column name -> array.
+    """
+    manifest = read_manifest(cache_folder)
+    rows = manifest['rows']
+    columns = {}
+    for name, column in manifest['columns'].items():
+        path = os.path.join(cache_folder, column['file'])
+        if rows == 0:
+            data = np.empty(0, dtype=column['dtype'])
+        else:
+            data = np.memmap(path, dtype=column['dtype'], mode='r', shape=(rows,))
+        if 'categories' in column:
+            data = np.array(column['categories'] + [''], dtype=str)[data]
+        columns[name] = data
+    return columns
+
+
+def cached_split(split_folder, name, cache_root, chunksize=100000, rebuild=False):
+    """
+    Columns of the `name` table of the split, converting it into the cache first if needed.
+    Returns:
+        tuple: The columns and the time spent converting the table (0 when the cache was fresh).
+    """
+    file_path = find_table(split_folder, name)
+    cache_folder = os.path.join(cache_root, name)
+    build_s = 0.0
+    if rebuild or not cache_is_fresh(cache_folder, file_path):
+        start = time.perf_counter()
+        manifest = build_cache(file_path, cache_folder, chunksize)
+        build_s = time.perf_counter() - start
+        logger.info(f"Cached {manifest['rows']} {name} rows of {file_path} in {cache_folder} in {build_s:.2f}s")
+    return load_cache(cache_folder), build_s
+
+
+def measure_latency(model, features, num_threads, repeat=5):
+    """
+    Inference latency on the test split: one prediction of the whole split and the median of `repeat`
+    predictions of a request-sized batch of its first rows.
+    """
+    rows = len(next(iter(features.values())))
+    start = time.perf_counter()
+    model.predict(features, num_threads=num_threads)
+    split_s = time.perf_counter() - start
+    batch = {name: values[:LATENCY_ROWS] for name, values in features.items()}
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        model.predict(batch, num_threads=num_threads)
+        durations.append(time.perf_counter() - start)
+    return {
+        'test_predict_s': split_s,
+        'test_rows_per_s': rows / split_s if split_s > 0 else None,
+        'batch_rows': min(rows, LATENCY_ROWS),
+        'batch_predict_s': statistics.median(durations),
+    }
+
+
+def export_model(model, output_folder, files):
+    """
+    Save the model with its extra JSON files, then swap it in place of the previous export at once, so the
+    folder never holds a partial model.
+    """
+    output_folder = os.path.normpath(output_folder)
+    temporary_folder = output_folder + '.tmp'
+    previous_folder = output_folder + '.old'
+    shutil.rmtree(temporary_folder, ignore_errors=True)
+    model.save(temporary_folder)
+    for name, content in files.items():
+        with open(os.path.join(temporary_folder, name), 'w') as file:
+            json.dump(content, file, indent=1)
+    shutil.rmtree(previous_folder, ignore_errors=True)
+    if os.path.exists(output_folder):
+        os.replace(output_folder, previous_folder)
+    os.replace(temporary_folder, output_folder)
+    shutil.rmtree(previous_folder, ignore_errors=True)
+
+
+def split_window(split_folder, rolling_window=None):
+    """
+    Window of the rolling features of the split, recorded next to its train table. `rolling_window` is only
+    needed for splits written before windows were recorded, otherwise it must match the record.
+    """
+    recorded = read_rolling_window(find_table(split_folder, 'train'))
+    if recorded is None:
+        if rolling_window is None:
+            raise ValueError(f"The split in {split_folder} has rolling features but no recorded window, "
+                             f"pass the --rolling-window they were computed with")
+        return rolling_window
+    if rolling_window is not None and rolling_window != recorded:
+        raise ValueError(f"The rolling features of the split in {split_folder} are over {recorded} samples, "
+                         f"not {rolling_window}")
+    return recorded
+
+
+def train(split_folder=DATA_SPLIT_PATH, cache_root=FEATURE_CACHE_PATH, output_folder=SERVING_MODEL_PATH,
+          num_trees=300, num_threads=0, rolling_window=None, chunksize=100000, rebuild_cache=False):
+    """
+    Train the random forest on the cached split and export it.
+    Returns:
+        dict: The training report, also saved as `training.json` in the exported model.
+    """
+    import ydf
+
+    num_threads = num_threads or available_cores()
+    start = time.perf_counter()
+    train_data, train_build_s = cached_split(split_folder, 'train', cache_root, chunksize, rebuild_cache)
+    test_data, test_build_s = cached_split(split_folder, 'test', cache_root, chunksize, rebuild_cache)
+    load_s = time.perf_counter() - start - train_build_s - test_build_s
+    logger.info(f"Loaded {len(train_data[LABEL])} train and {len(test_data[LABEL])} test rows in {load_s:.2f}s")
+    if any(name in ROLLING_FEATURES for name in train_data):
+        rolling_window = split_window(split_folder, rolling_window)
+
+    start = time.perf_counter()
+    model = ydf.RandomForestLearner(label=LABEL, task=ydf.Task.CLASSIFICATION, num_trees=num_trees,
+                                    num_threads=num_threads).train(train_data)
+    train_s = time.perf_counter() - start
+    logger.info(f"Trained {num_trees} trees on {num_threads} threads in {train_s:.2f}s")
+
+    evaluation = model.evaluate(test_data)
+    test_features = {name: values for name, values in test_data.items() if name != LABEL}
+    latency = measure_latency(model, test_features, num_threads)
+    features = model.input_feature_names()
+    report = {
+        'ydf': ydf.__version__,
+        'train_rows': len(train_data[LABEL]),
+        'test_rows': len(test_data[LABEL]),
+        'features': features,
+        'num_trees': num_trees,
+        'num_threads': num_threads,
+        'cache_build_s': train_build_s + test_build_s,
+        'load_s': load_s,
+        'train_s': train_s,
+        'memory_mb': rss_mb(),
+        'accuracy': evaluation.accuracy,
+        'loss': evaluation.loss,
+        **latency,
+    }
+
+    # Activity of each label, as split_data assigned them
+    files = {LABELS_FILE: {str(label): activity for activity, label in activity_files.items()},
+             REPORT_FILE: report}
+    if rolling_window and any(feature in ROLLING_FEATURES for feature in features):
+        files[FEATURES_FILE] = {'rolling_window': rolling_window}
+    export_model(model, output_folder, files)
+    logger.info(f"Accuracy {evaluation.accuracy:.4f}, memory {report['memory_mb']:.0f} MB, "
+                f"test split predicted in {latency['test_predict_s']:.3f}s, {latency['batch_rows']} rows in "
+                f"{latency['batch_predict_s'] * 1000:.2f} ms. Model saved to {output_folder}")
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Train the serving model from the train/test split.")
+    parser.add_argument('--split', default=DATA_SPLIT_PATH, help="Folder of the train and test tables")
+    parser.add_argument('--cache', default=FEATURE_CACHE_PATH, help="Folder of the memory-mapped feature cache")
+    parser.add_argument('--output', default=SERVING_MODEL_PATH,
+                        help="Model folder, e.g. ../fast_server/model or a version folder of a model registry")
+    parser.add_argument('--num-trees', type=int, default=300, help="Trees of the random forest")
+    parser.add_argument('--threads', type=int, default=0, help="Training and inference threads, 0 uses every core")
+    parser.add_argument('--rolling-window', type=int, default=None,
+                        help="Window the rolling features of the split were computed with, only needed for splits "
+                             "written before the window was recorded next to them")
+    parser.add_argument('--chunksize', type=int, default=100000, help="Rows converted at once into the cache")
+    parser.add_argument('--rebuild-cache', action='store_true', help="Convert the split again even if it is cached")
+    args = parser.parse_args()
+    train(args.split, args.cache, args.output, args.num_trees, args.threads, args.rolling_window, args.chunksize,
+          args.rebuild_cache)